@@ -1,78 +1,106 @@
 import threading
-import time
-import socket
-import json
+import datetime
 from prompt_toolkit import PromptSession
 from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit.patch_stdout import patch_stdout
 from io_functions import select_from_list
-from service_manager import ServiceManager
+from service_manager import ServiceManager, diff_checks, index_checks
+from ingest import IngestLoop
+from check_result import CheckResult
+from timeseries import TimeSeriesStore
+from archive import ArchiveWriter
+from metrics import MetricsRegistry, MetricsServer
 import queue
 
+summary_window = 300        # seconds of history summarised by the 'summary' command
+archive_path = "./archive/"
+archive_fsync_interval = 5  # seconds between fsyncs of the result archive
+metrics_bind = "127.0.0.1"  # address of the /metrics endpoint
+metrics_port = 9464
 
-# Worker thread function
-def monitor_thread(stop_event: threading.Event, name: str, data: dict, print_queue) -> None:
-    """
-    Check thread
-    Runs network check for passed object at object's specified interval
-    """
-    socket_info = data["socket"]
-    ip, port = socket_info["ip"], socket_info["port"]
-    checks = data["checks"]
 
-    while not stop_event.is_set():
-        # Connect to monitor socket
-        client_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        with client_sock:
-            # Connect and send check info
-            client_sock.setblocking(True)
-            try:
-                client_sock.connect((ip, port))
-            except ConnectionRefusedError:
-                print(f"Network monitor service '{name}' is offline. Attempting to reconnect.")
-                time.sleep(5)
-                continue
-            print(f"Connected to service '{name}'")
-            client_sock.sendall(bytes(json.dumps(checks), encoding="utf-8"))
-
-            # Until user enters stop command, maintain connection
-            client_sock.settimeout(1)
-            while not stop_event.is_set():
-                try:
-                    msg = client_sock.recv(1024)
-                except (TimeoutError, ConnectionResetError) as err:
-                    if type(err) is TimeoutError:
-                        continue
-                    else:
-                        print(f"Monitoring service '{name}' disconnected. Attempting to reconnect.")
-                        break
-
-                if msg:
-                    msg = json.loads(msg.decode())
-                    print_queue.put(
-                        {
-                            "time": msg["time"],
-                            "name": name,
-                            "ip": ip,
-                            "port": port,
-                            "result": msg["results"]
-                        }
-                    )
-                elif not stop_event.is_set():
-                    print(f"Connection to service '{name}' timed out. Attempting to reconnect.")
-                    break
+def format_result(result: CheckResult) -> str:
+    """Format check result for display"""
+    msg = f"{result.check_type} check -- {result.target} -- {result.status.name}"
+    if result.latency_ns is not None:
+        msg += f" -- {result.latency_ms:.3f}ms"
+    if result.detail:
+        msg += f" -- {result.detail}"
+    if result.error_code:
+        msg += f" (errno {result.error_code})"
+    return msg
 
 
 def queue_printer(stop_event, print_queue):
     while not stop_event.is_set():
         try:
             data = print_queue.get(timeout=5)
-            msg = f"[{data['time']}]: {data['name']} ({data['ip']}:{data['port']}) -- {data['result']}"
+            result = data["result"]
+            if isinstance(result, CheckResult):
+                timestamp = datetime.datetime.fromtimestamp(result.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+                result = format_result(result)
+            else:
+                timestamp = data["time"]
+            msg = f"[{timestamp}]: {data['name']} ({data['ip']}:{data['port']}) -- {result}"
             print(msg)
         except queue.Empty:
             continue
 
 
+def print_monitor_stats(monitor_stats: dict) -> None:
+    """Print each monitor's latest self-instrumentation, averaged over the interval since the one before"""
+    for name, (previous, latest) in sorted(monitor_stats.items()):
+        before = previous["timers"] if previous else {}
+        print(f"{name} -- {latest['threads']} threads")
+        for operation, (count, total_ms, max_ms) in sorted(latest["timers"].items()):
+            prior_count, prior_total_ms, _ = before.get(operation, (0, 0.0, 0.0))
+            count, total_ms = count - prior_count, total_ms - prior_total_ms
+            mean_ms = total_ms / count if count else 0.0
+            print(f"  {operation} -- {count} calls -- {total_ms:.1f}ms total -- avg/max {mean_ms:.3f}/{max_ms:.3f}ms")
+
+
+def print_summary(store: TimeSeriesStore, seconds: float = summary_window) -> None:
+    """Print rolling availability and latency statistics of every stored check"""
+    for key in sorted(store.keys(), key=lambda k: (k[0], str(k[1]))):
+        stats = store.stats(key, seconds=seconds)
+        if stats is None:
+            continue
+        msg = f"{key[0]} -- {key[1]} -- {stats['samples']} samples -- {stats['availability'] * 100:.1f}% up"
+        if "p50" in stats:
+            msg += (f" -- min/avg/max {stats['min']:.3f}/{stats['avg']:.3f}/{stats['max']:.3f}ms"
+                    f" -- p50/p95/p99 {stats['p50']:.3f}/{stats['p95']:.3f}/{stats['p99']:.3f}ms")
+        print(msg)
+    print(f"{len(store.keys())} checks stored -- {store.memory_bytes() / 1024:.1f}KiB of samples")
+
+
+def reload_config(service_manager: ServiceManager, ingest_loop: IngestLoop, metrics: MetricsRegistry,
+                  config: dict) -> None:
+    """
+    Read the configuration file again and send each connected monitor only its changed checks
+
+    Metric series of removed checks are dropped.
+
+    :param config:  configuration the monitors are running, updated in place
+    """
+    new_config = service_manager.reload_config()
+    if new_config is None:
+        return
+    for name, data in new_config.items():
+        if name not in config:
+            print(f"Monitor '{name}' is new -- restart the manager to connect to it")
+            continue
+        delta = diff_checks(config[name]["checks"], data["checks"])
+        config[name]["checks"] = data["checks"]
+        if delta is None:
+            continue
+        ingest_loop.update_checks(name, data["checks"], delta)
+        metrics.set_checks(name, index_checks(data["checks"]))
+        print(f"{name} -- {sum(map(len, delta['add'].values()))} checks added, "
+              f"{sum(map(len, delta['modify'].values()))} modified, {len(delta['remove'])} removed")
+    for name in config.keys() - new_config.keys():
+        print(f"Monitor '{name}' was removed from the configuration -- restart the manager to disconnect it")
+
+
 # Output status and check for command input
 def command_loop() -> None:
     """
@@ -87,13 +115,57 @@ def command_loop() -> None:
     service_manager = ServiceManager()
     config = service_manager.startup()
 
-    # Create a thread for each monitoring service
+    # Create a single thread ingesting results from every monitoring service
     sub_threads = []
     print_queue = queue.Queue()
-    for name, remote_monitor in config.items():
-        sub_thread: threading.Thread = threading.Thread(target=monitor_thread, args=(stop_event, name, remote_monitor, print_queue))
-        sub_thread.start()
-        sub_threads.append(sub_thread)
+    store = TimeSeriesStore()
+    archive = ArchiveWriter(archive_path, fsync_interval=archive_fsync_interval)
+    metrics = MetricsRegistry()
+    monitor_stats = {}      # monitor name -> (previous, latest self-instrumentation snapshot)
+
+    def on_result(monitor, result):
+        store.record(monitor.name, result)
+        metrics.record(monitor.name, result)
+        archive.add(monitor.name, result)
+        print_queue.put({"name": monitor.name, "ip": monitor.ip, "port": monitor.port, "result": result})
+
+    def on_status(monitor, body):
+        print_queue.put(
+            {
+                "time": body["time"],
+                "name": monitor.name,
+                "ip": monitor.ip,
+                "port": monitor.port,
+                "result": body["results"]
+            }
+        )
+
+    def on_stats(monitor, body):
+        monitor_stats[monitor.name] = (monitor_stats.get(monitor.name, (None, None))[1], body)
+        metrics.record_monitor_stats(monitor.name, body)
+
+    ingest_loop = IngestLoop(config, on_result, on_status, on_stats)
+    ingest_thread: threading.Thread = threading.Thread(target=ingest_loop.run, args=(stop_event,))
+    ingest_thread.start()
+    sub_threads.append(ingest_thread)
+
+    # Create thread serving metrics for scraping
+    metrics.attach(ingest_loop.monitor_states, ingest_loop.stats)
+    for name, data in config.items():
+        metrics.set_checks(name, index_checks(data["checks"]))
+    try:
+        metrics_server = MetricsServer(metrics, metrics_bind, metrics_port)
+        metrics_thread = threading.Thread(target=metrics_server.run, args=(stop_event,))
+        metrics_thread.start()
+        sub_threads.append(metrics_thread)
+        print(f"Serving metrics on http://{metrics_bind}:{metrics_port}/metrics")
+    except OSError as e:
+        print(f"Could not serve metrics on {metrics_bind}:{metrics_port}: {e}")
+
+    # Create thread writing received results to the archive in batches
+    archive_thread = threading.Thread(target=archive.run, args=(stop_event,))
+    archive_thread.start()
+    sub_threads.append(archive_thread)
 
     # Create thread for printing messages in queue
     print_thread = threading.Thread(target=queue_printer, args=(stop_event, print_queue))
@@ -102,7 +174,7 @@ def command_loop() -> None:
 
     # Command completer for auto-completion
     # This is where you will add new auto-complete commands
-    command_completer: WordCompleter = WordCompleter(['stop'], ignore_case=True)
+    command_completer: WordCompleter = WordCompleter(['stop', 'stats', 'summary', 'reload'], ignore_case=True)
 
     # Create a prompt session
     session: PromptSession = PromptSession(completer=command_completer)
@@ -114,10 +186,20 @@ def command_loop() -> None:
         with patch_stdout():
             while is_running:
                 # Using prompt-toolkit for input with auto-completion
-                user_input: str = session.prompt("Enter 'stop' to terminate manager: ")
+                user_input: str = session.prompt("Enter 'stop' to terminate manager, 'stats' for ingest statistics, "
+                                                 "'summary' for check history or 'reload' to apply config changes: ")
                 if user_input == "stop":
                     print("Monitoring finished\n")
                     is_running = False
+                elif user_input == "stats":
+                    stats = ingest_loop.stats()
+                    print(f"{stats['connected']}/{stats['monitors']} monitors connected -- "
+                          f"{stats['results_per_second']:.1f} results/s -- {stats['results_total']} results received")
+                    print_monitor_stats(dict(monitor_stats))
+                elif user_input == "summary":
+                    print_summary(store)
+                elif user_input == "reload":
+                    reload_config(service_manager, ingest_loop, metrics, config)
     finally:
         # Signal the workers thread to stop and wait for their completion
         stop_event.set()
@@ -1,9 +1,10 @@
+import argparse
 import threading
 import time
+import selectors
 import socket
-import sys
 import datetime
-import json
+import multiprocessing
 import queue
 from services import *
 from prompt_toolkit import PromptSession
@@ -11,69 +12,291 @@ from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit.patch_stdout import patch_stdout
 from io_functions import select_from_list
 from service_monitor import ServiceMonitor
+from scheduler import CheckScheduler
+from shard_pool import ShardPool
+from result_buffer import ResultBuffer
+from protocol import FrameDecoder, FrameEncoder, ProtocolError, CONFIG, CONFIG_DELTA, STATS, STATUS
+from service_manager import diff_checks
+from check_spec import ConfigError
+import instrumentation
+from timing import now_ns
 
-
-# Worker thread function
-def worker(stop_event: threading.Event, check: object, out_queue) -> None:
-    """
-    Check thread
-    Runs network check for passed object at object's specified interval
-    """
-    while not stop_event.is_set():
-        out_queue.put({"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "results": check.check()})
-        micro_interval = check.interval
-
-        # Sleep in 100ms increments until interval is up or stop event set
-        # This ensures the thread will terminate within ~100ms of receiving a stop command
-        while not stop_event.is_set() and micro_interval > 0:
-            time.sleep(0.1)
-            micro_interval -= 0.1
+out_queue_size = 1024           # results buffered while waiting to be sent
+recv_size = 65536               # bytes read from manager socket at once
+batch_max_bytes = 64 * 1024     # send results once a batch reaches this size...
+batch_max_age = 0.05            # ...or its oldest result is this old (seconds)
+wait_report_interval = 60       # seconds between result buffer wait and lateness reports
+late_report_threshold = 100     # ms of p99 run lateness above which lateness is reported
+stats_report_interval = 10      # seconds between self-instrumentation snapshots sent to manager
+default_profile_seconds = 10
+select_timeout = 0.1            # seconds, bounds how long stop takes to be noticed
+final_send_timeout = 1          # seconds allowed for sending the remaining results when stopping
 
 
-def config(stop_event, checks_dict, out_queue, client_sock, server_sock):
-    # Define services to monitor
-    service_monitor = ServiceMonitor()
-    service_monitor.set_checks_from_dict(checks_dict)
+def config(stop_event, service_monitor, out_queue, client_sock, server_sock, encoder, compress, decoder=None,
+           shards=1):
     checks = service_monitor.get_checks()
 
-    # Create a thread for each check
+    def report(check, result):
+        # Called on the scheduler's event loop, which must not wait for a slow manager
+        out_queue.offer(result.to_list())
+
+    # Run every check from a single scheduler thread, or split them across shard processes
     sub_threads = []
-    for check in checks:
-        worker_thread: threading.Thread = threading.Thread(target=worker, args=(stop_event, check, out_queue))
-        worker_thread.start()
-        sub_threads.append(worker_thread)
+    if shards > 1:
+        scheduler = ShardPool(service_monitor.get_config(), shards, out_queue)
+    else:
+        scheduler = CheckScheduler(checks, report)
+    scheduler_thread = threading.Thread(target=scheduler.run, args=(stop_event,))
+    scheduler_thread.start()
+    sub_threads.append(scheduler_thread)
+
+    def apply(message):
+        # A full configuration arrives when the manager reconnects, only its differences are applied
+        delta = message.body if message.type == CONFIG_DELTA else diff_checks(service_monitor.get_config(), message.body)
+        if delta is None:
+            return
+        added, removed = service_monitor.apply_delta(delta)
+        if shards > 1:
+            scheduler.apply_delta(delta)
+        else:
+            scheduler.update(added, removed)
+        print(f"Configuration updated -- {sum(map(len, delta['add'].values()))} checks added, "
+              f"{sum(map(len, delta['modify'].values()))} modified, {len(delta['remove'])} removed")
+
+    # Create thread applying configuration changes sent by the manager
+    receiver = ConfigReceiver(client_sock, decoder or FrameDecoder(), apply)
+    receive_thread = threading.Thread(target=receiver.run, args=(stop_event,))
+    receive_thread.start()
+    sub_threads.append(receive_thread)
 
     # Create thread for sending messages in queue
-    send_thread = threading.Thread(target=send_queue, args=(stop_event, client_sock, server_sock, out_queue))
+    send_thread = threading.Thread(target=send_queue,
+                                   args=(stop_event, client_sock, server_sock, out_queue, encoder, compress, scheduler,
+                                         receiver.reconnected))
     send_thread.start()
     sub_threads.append(send_thread)
 
     return sub_threads
 
 
-def send_queue(stop_event, client_sock, server_sock, out_queue):
-    while not stop_event.is_set():
+class ConfigReceiver:
+    """
+    Reads configuration changes from the manager and hands them to apply.
+
+    The sender thread owns the manager connection and replaces it after a disconnect;
+    it passes each new connection to reconnected().
+    """
+
+    def __init__(self, sock, decoder: FrameDecoder, apply):
+        """
+        :param sock:    socket connected to manager
+        :param decoder: decoder that read the initial configuration from sock
+        :param apply:   callable(Message) invoked for every CONFIG and CONFIG_DELTA message
+        """
+        self._sock, self._decoder = sock, decoder
+        self._apply = apply
+        self._lock = threading.Lock()
+
+    def reconnected(self, sock) -> None:
+        """Read from sock, a new connection to the manager, from now on"""
+        with self._lock:
+            self._sock, self._decoder = sock, FrameDecoder()
+
+    def run(self, stop_event) -> None:
+        """
+        Receive until stop_event is set. Blocks the calling thread.
+
+        :param stop_event:  threading.Event used to stop the receiver
+        """
+        selector = selectors.DefaultSelector()
+        registered = None
         try:
-            msg = out_queue.get(timeout=1)
             while not stop_event.is_set():
+                with self._lock:
+                    sock, decoder = self._sock, self._decoder
+                if sock is not registered:
+                    if registered is not None:
+                        selector.unregister(registered)
+                    selector.register(sock, selectors.EVENT_READ)
+                    registered = sock
+                if not selector.select(select_timeout):
+                    continue
+
                 try:
-                    client_sock.sendall(bytes(json.dumps(msg), encoding="utf-8"))
-                    break
-                except ConnectionAbortedError:
-                    print("Manager service disconnected. Attempting to reconnect...")
-                    while not stop_event.is_set():
-                        server_sock.settimeout(1)
+                    data = sock.recv(recv_size)
+                except OSError:
+                    data = b''
+                if not data:
+                    # Manager disconnected, wait for the sender to accept its new connection
+                    selector.unregister(sock)
+                    registered = None
+                    while self._sock is sock and not stop_event.wait(select_timeout):
+                        pass
+                    continue
+
+                try:
+                    messages = decoder.feed(data)
+                except ProtocolError as e:
+                    print(f"Could not read configuration update from manager: {e}")
+                    continue
+                for message in messages:
+                    if message.type in (CONFIG, CONFIG_DELTA):
                         try:
-                            client_sock, client_address = server_sock.accept()
-                            print(f"Reconnected to manager service at {client_address}")
-                        except TimeoutError:
-                            continue
+                            self._apply(message)
+                        except Exception as e:
+                            print(f"Could not apply configuration update: {e}")
+        finally:
+            selector.close()
+
+
+def send_queue(stop_event, client_sock, server_sock, results, encoder, compress, scheduler=None, on_reconnect=None):
+    """
+    Ship results to manager in batches
+    A batch is sent once it holds batch_max_bytes of results or its oldest result is batch_max_age old
+    Buffer waits, and scheduler lateness if scheduler is given, are reported every wait_report_interval
+    Self-instrumentation snapshots are sent every stats_report_interval
+    on_reconnect, if given, is called with the new socket whenever the manager reconnects
+    Once stop_event is set, results already batched or buffered are sent before returning
+    """
+    batch, batch_bytes, batch_deadline = [], 0, None
+    report_deadline = time.monotonic() + wait_report_interval
+    stats_deadline = time.monotonic() + stats_report_interval
+
+    def send(frame):
+        nonlocal client_sock
+        client_sock = send_frame(stop_event, client_sock, server_sock, frame, on_reconnect)
+
+    while not stop_event.is_set():
+        timeout = 1 if batch_deadline is None else max(0.0, batch_deadline - time.monotonic())
+        try:
+            item = encoder.pack(results.get(timeout=timeout))
+            if not batch:
+                batch_deadline = time.monotonic() + batch_max_age
+            batch.append(item)
+            batch_bytes += len(item)
         except queue.Empty:
-            continue
+            pass
+
+        now = time.monotonic()
+        if batch and (batch_bytes >= batch_max_bytes or now >= batch_deadline):
+            send(encoder.encode_batch(batch, compress))
+            batch, batch_bytes, batch_deadline = [], 0, None
+
+        if now >= stats_deadline:
+            stats_deadline = now + stats_report_interval
+            snapshot = instrumentation.instruments.snapshot()
+            snapshot["time"] = time.time()
+            send(encoder.encode(STATS, snapshot, compress))
+
+        # Report results dropped, or waited for, because the result buffer was full
+        if now >= report_deadline:
+            report_deadline = now + wait_report_interval
+            stats = results.take_wait_stats()
+            if stats["dropped"] or stats["blocked_puts"]:
+                status = {
+                    "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "results": f"Result buffer full for {stats['dropped'] + stats['blocked_puts']} of {stats['puts']} "
+                               f"results -- {stats['dropped']} dropped, {stats['blocked_puts']} waited "
+                               f"{stats['wait_total_ms']:.1f}ms (max {stats['wait_max_ms']:.1f}ms)"
+                }
+                send(encoder.encode(STATUS, status, compress))
+
+            # Report checks starting late or skipping runs because the monitor is overloaded
+            stats = scheduler.take_lateness_stats() if scheduler is not None else None
+            if stats and (stats["skipped"] or stats["late_p99_ms"] > late_report_threshold):
+                status = {
+                    "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "results": f"{stats['runs']} checks started late by {stats['late_mean_ms']:.1f}ms on average "
+                               f"(p99 {stats['late_p99_ms']:.1f}ms, max {stats['late_max_ms']:.1f}ms) -- "
+                               f"{stats['skipped']} runs skipped"
+                }
+                send(encoder.encode(STATUS, status, compress))
+
+    # Send the last partial batch and anything still buffered rather than dropping them.
+    # send() gives up once stop_event is set, so this is a single, bounded attempt on the current connection.
+    try:
+        client_sock.settimeout(final_send_timeout)
+        while True:
+            try:
+                item = encoder.pack(results.get_nowait())
+            except queue.Empty:
+                break
+            batch.append(item)
+            batch_bytes += len(item)
+            if batch_bytes >= batch_max_bytes:
+                client_sock.sendall(encoder.encode_batch(batch, compress))
+                batch, batch_bytes = [], 0
+        if batch:
+            client_sock.sendall(encoder.encode_batch(batch, compress))
+    except OSError:
+        pass
+
+
+def send_frame(stop_event, client_sock, server_sock, frame, on_reconnect=None):
+    """
+    Send frame to manager, waiting for the manager to reconnect if it has disconnected
+
+    :returns:   socket connected to manager
+    """
+    while not stop_event.is_set():
+        try:
+            start = now_ns()
+            client_sock.sendall(frame)
+            instrumentation.record("sendall", now_ns() - start)
+            break
+        except ConnectionError:
+            print("Manager service disconnected. Attempting to reconnect...")
+            while not stop_event.is_set():
+                server_sock.settimeout(1)
+                try:
+                    client_sock, client_address = server_sock.accept()
+                    print(f"Reconnected to manager service at {client_address}")
+                    if on_reconnect is not None:
+                        on_reconnect(client_sock)
+                    break
+                except TimeoutError:
+                    continue
+    return client_sock
+
+
+def start_profile(command: str, stop_event) -> threading.Thread | None:
+    """
+    Start sampling profiler for the number of seconds given in a 'profile [seconds]' command
+
+    :returns:   profiler thread, or None if the command was invalid
+    """
+    args = command.split()[1:]
+    try:
+        seconds = float(args[0]) if args else default_profile_seconds
+    except ValueError:
+        seconds = 0
+    if not 0 < seconds <= instrumentation.max_profile_seconds:
+        print(f"Usage: profile [seconds], up to {instrumentation.max_profile_seconds}s")
+        return None
+    profile_thread = threading.Thread(target=instrumentation.profile, args=(seconds, stop_event))
+    profile_thread.start()
+    return profile_thread
+
+
+def receive_config(client_sock) -> tuple | None:
+    """
+    Read frames from manager until a configuration message arrives
+
+    :returns:   (checks dictionary, decoder used), or None if manager disconnected first
+    """
+    decoder = FrameDecoder()
+    while True:
+        data = client_sock.recv(recv_size)
+        if not data:
+            return None
+        for message in decoder.feed(data):
+            if message.type == CONFIG:
+                return message.body, decoder
 
 
 # Output status and check for command input
-def command_loop(port) -> None:
+def command_loop(port, shards=1) -> None:
     """
     Main function to handle user input and manage threads.
     Uses prompt-toolkit for handling user input with auto-completion and ensures
@@ -95,22 +318,42 @@ def command_loop(port) -> None:
             client_sock, client_address = server_sock.accept()
             print(f"Connected to manager at {client_address}")
             with client_sock:
-                data = ''
-                while True:
-                    msg = client_sock.recv(1024)
-                    data += msg.decode()
-                    if len(msg) < 1024:
-                        confirmation = {
-                            "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                            "results": "Configuration received! Beginning checks..."
-                        }
-                        client_sock.sendall(bytes(json.dumps(confirmation), encoding="utf-8"))
-                        break
-                checks_dict = json.loads(data)
-                out_queue = queue.Queue(maxsize=1)
-                check_threads = config(stop_event, checks_dict, out_queue, client_sock, server_sock)
-
-                command_completer: WordCompleter = WordCompleter(['stop'], ignore_case=True)
+                try:
+                    received = receive_config(client_sock)
+                except (ConnectionError, ProtocolError) as e:
+                    print(f"Could not receive configuration from manager: {e}")
+                    received = None
+                if received is None:
+                    continue
+                checks_dict, decoder = received
+
+                # Reply in the encoding and compression the manager used
+                encoder, compress = FrameEncoder(binary=decoder.binary), decoder.compressed
+
+                # Define services to monitor, rejecting the configuration if any check is invalid
+                service_monitor = ServiceMonitor()
+                try:
+                    service_monitor.set_checks_from_dict(checks_dict)
+                except ConfigError as e:
+                    print(f"Invalid configuration received from manager: {e}")
+                    rejection = {
+                        "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "results": f"Invalid configuration: {e}"
+                    }
+                    client_sock.sendall(encoder.encode(STATUS, rejection, compress))
+                    continue
+
+                confirmation = {
+                    "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "results": "Configuration received! Beginning checks..."
+                }
+                client_sock.sendall(encoder.encode(STATUS, confirmation, compress))
+
+                out_queue = ResultBuffer(out_queue_size)
+                check_threads = config(stop_event, service_monitor, out_queue, client_sock, server_sock, encoder, compress,
+                                       decoder, shards)
+
+                command_completer: WordCompleter = WordCompleter(['stop', 'profile'], ignore_case=True)
 
                 # Create a prompt session
                 session: PromptSession = PromptSession(completer=command_completer)
@@ -120,10 +363,15 @@ def command_loop(port) -> None:
                     with patch_stdout():
                         while is_running:
                             # Using prompt-toolkit for input with auto-completion
-                            user_input: str = session.prompt("Enter 'stop' to terminate monitoring: ")
+                            user_input: str = session.prompt("Enter 'stop' to terminate monitoring "
+                                                             "or 'profile [seconds]' to profile this monitor: ")
                             if user_input == "stop":
                                 print("Monitoring finished\n")
                                 is_running, maintain = False, False
+                            elif user_input.split()[:1] == ["profile"]:
+                                profile_thread = start_profile(user_input, stop_event)
+                                if profile_thread is not None:
+                                    check_threads.append(profile_thread)
                 finally:
                     # Signal the workers thread to stop and wait for their completion
                     stop_event.set()
@@ -132,13 +380,19 @@ def command_loop(port) -> None:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="NETMON - Network Monitor")
+    parser.add_argument("port", type=int, help="port the manager connects to")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="worker processes checks are split across, 0 for one per CPU (default 1, no workers)")
+    args = parser.parse_args()
+    shards = args.shards or multiprocessing.cpu_count()
+
     print("\nNETMON - Network Monitor")
+    if shards > 1:
+        print(f"Running checks in {shards} worker processes")
     while True:
         # Begin monitoring and waiting for user commands
-        if len(sys.argv) != 2:
-            print("Usage: NETMON [port]")
-            return
-        command_loop(int(sys.argv[1]))
+        command_loop(args.port, shards)
 
         # Check if user would like to quit
         print("\nDisconnected from manager service. Would you like to reconnect?")
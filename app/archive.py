@@ -0,0 +1,264 @@
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from check_result import CheckResult, Status
+
+default_archive_path = "./archive/"
+default_bucket_seconds = 86400      # one segment file per day
+default_flush_interval = 1.0        # seconds between writes of buffered results
+default_fsync_interval = 5.0        # seconds between fsyncs of written segments
+default_block_samples = 720         # samples of one check written together as one block...
+default_block_age = 600.0           # ...or once its oldest buffered sample is this old (seconds)
+compression_level = 6
+no_latency = -1                     # stored in place of a missing latency
+segment_suffix = ".seg"
+
+# Block header: magic, key length, sample count, first and last timestamp (microseconds),
+# then the compressed length of the timestamp, status and latency columns
+block_header = struct.Struct('!4sHIqqIII')
+block_magic = b'NMAB'
+
+
+def _check_key(monitor: str, check_id: str) -> bytes:
+    """Return the key identifying one check of one monitor in the archive"""
+    return f"{monitor}\0{check_id}".encode()
+
+
+def _column_bytes(column: array) -> bytes:
+    """Return column contents as little-endian bytes"""
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _column_from_bytes(typecode: str, data: bytes) -> array:
+    """Inverse of _column_bytes"""
+    column = array(typecode, data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def encode_block(key: bytes, samples: list) -> bytes:
+    """
+    Encode samples of one check into a compressed columnar block
+
+    :param key:         check key
+    :param samples:     (timestamp seconds, status, latency ns or None) tuples, oldest first
+    :returns:           block bytes
+    """
+    timestamps = array('q', (round(s[0] * 1_000_000) for s in samples))
+    first, last = timestamps[0], timestamps[-1]
+    # Delta-encode timestamps so regular check intervals compress to a handful of bytes
+    for i in range(len(timestamps) - 1, 0, -1):
+        timestamps[i] -= timestamps[i - 1]
+    status = array('b', (s[1] for s in samples))
+    latency = array('q', (no_latency if s[2] is None else s[2] for s in samples))
+
+    columns = [zlib.compress(_column_bytes(c), compression_level) for c in (timestamps, status, latency)]
+    header = block_header.pack(block_magic, len(key), len(samples), first, last, *map(len, columns))
+    return b"".join([header, key, *columns])
+
+
+class ArchiveWriter:
+    """
+    Append-only result archive.
+
+    Results are buffered in memory per check and written as one compressed block once the check
+    has block_samples of them, its oldest is block_age old, or its time bucket has ended, so blocks
+    are large enough to compress well. Each time bucket has its own segment file, closed once the
+    bucket has ended and its results are written. Segments are fsynced every fsync_interval seconds.
+    """
+
+    def __init__(self, path: str = default_archive_path, bucket_seconds: int = default_bucket_seconds,
+                 flush_interval: float = default_flush_interval, fsync_interval: float = default_fsync_interval,
+                 block_samples: int = default_block_samples, block_age: float = default_block_age):
+        """
+        :param path:            directory holding segment files
+        :param bucket_seconds:  time span covered by one segment file
+        :param flush_interval:  seconds between checks for blocks due to be written
+        :param fsync_interval:  seconds between fsyncs, 0 to fsync after every write
+        :param block_samples:   samples of one check that are written as a block at once
+        :param block_age:       seconds a sample is buffered at most before its block is written
+        """
+        self.path = path
+        self.bucket_seconds = bucket_seconds
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.block_samples = block_samples
+        self.block_age = block_age
+        self._pending = {}      # (bucket, key) -> [monotonic time of first sample, samples]
+        self._lock = threading.Lock()
+        self._files = {}
+        self._last_fsync = time.monotonic()
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, monitor: str, result: CheckResult) -> None:
+        """Buffer result for the next write"""
+        key = _check_key(monitor, result.check_id)
+        bucket = int(result.timestamp // self.bucket_seconds) * self.bucket_seconds
+        with self._lock:
+            pending = self._pending.get((bucket, key))
+            if pending is None:
+                pending = self._pending[(bucket, key)] = [time.monotonic(), []]
+            pending[1].append((result.timestamp, int(result.status), result.latency_ns))
+
+    def run(self, stop_event) -> None:
+        """
+        Write buffered results until stop_event is set, then write the remainder and close
+
+        :param stop_event:  threading.Event used to stop the writer
+        """
+        try:
+            while not stop_event.wait(self.flush_interval):
+                self.flush()
+        finally:
+            self.close()
+
+    def flush(self, everything: bool = False) -> None:
+        """
+        Write blocks of checks that are due, and fsync if due
+
+        :param everything:  write every buffered result, regardless of block size and age
+        """
+        now, wall_now = time.monotonic(), time.time()
+        with self._lock:
+            due = [entry for entry, (first, samples) in self._pending.items()
+                   if everything or len(samples) >= self.block_samples or now - first >= self.block_age
+                   or entry[0] + self.bucket_seconds <= wall_now]
+            due = [(entry, self._pending.pop(entry)[1]) for entry in due]
+            open_buckets = {bucket for bucket, _ in self._pending}
+
+        blocks = {}
+        for (bucket, key), samples in due:
+            samples.sort(key=lambda s: s[0])
+            blocks.setdefault(bucket, []).append(encode_block(key, samples))
+        for bucket, data in blocks.items():
+            self._segment(bucket).write(b"".join(data))
+
+        # Close segments of buckets that have ended and have nothing left to write
+        for bucket in [b for b in self._files if b + self.bucket_seconds <= wall_now and b not in open_buckets]:
+            self._sync(self._files.pop(bucket), close=True)
+
+        if now - self._last_fsync >= self.fsync_interval:
+            for file in self._files.values():
+                self._sync(file)
+            self._last_fsync = now
+
+    def close(self) -> None:
+        """Write buffered results and close every segment"""
+        self.flush(everything=True)
+        for file in self._files.values():
+            self._sync(file, close=True)
+        self._files.clear()
+
+    def _segment(self, bucket: int):
+        """Return open append-mode file of bucket's segment"""
+        file = self._files.get(bucket)
+        if file is None:
+            file = self._files[bucket] = open(os.path.join(self.path, f"{bucket}{segment_suffix}"), "ab")
+        return file
+
+    @staticmethod
+    def _sync(file, close: bool = False) -> None:
+        file.flush()
+        os.fsync(file.fileno())
+        if close:
+            file.close()
+
+
+class ArchiveReader:
+    """Read check history back from an archive directory"""
+
+    def __init__(self, path: str = default_archive_path):
+        """
+        :param path:    directory holding segment files
+        """
+        self.path = path
+
+    def segments(self) -> list:
+        """Return (bucket start, file path) of every segment, oldest first"""
+        segments = []
+        for filename in os.listdir(self.path):
+            name, suffix = os.path.splitext(filename)
+            if suffix == segment_suffix and name.isdigit():
+                segments.append((int(name), os.path.join(self.path, filename)))
+        return sorted(segments)
+
+    def scan(self, monitor: str, check_id: str, start: float = 0, end: float | None = None):
+        """
+        Yield archived samples of one check, oldest first within each block
+
+        Segments are memory-mapped and blocks of other checks are skipped using their headers,
+        so only the requested check's columns are decompressed.
+
+        :param monitor:     monitor name
+        :param check_id:    check id
+        :param start:       earliest timestamp, seconds since the epoch
+        :param end:         latest timestamp, default now
+        :returns:           generator of (timestamp, Status, latency ns or None)
+        """
+        end = time.time() if end is None else end
+        key = _check_key(monitor, check_id)
+        segments = self.segments()
+        for i, (bucket, path) in enumerate(segments):
+            # A segment holds results from its bucket start up to the next segment's start
+            if bucket > end or (i + 1 < len(segments) and segments[i + 1][0] <= start):
+                continue
+            yield from self._scan_segment(path, key, round(start * 1_000_000), round(end * 1_000_000))
+
+    @staticmethod
+    def _scan_segment(path: str, key: bytes, start_us: int, end_us: int):
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = 0
+                while offset + block_header.size <= len(data):
+                    magic, key_len, count, first, last, *lengths = block_header.unpack_from(data, offset)
+                    if magic != block_magic:
+                        print(f"Corrupt archive block in {path} at offset {offset}, skipping rest of segment")
+                        return
+                    key_start = offset + block_header.size
+                    column_start = key_start + key_len
+                    offset = column_start + sum(lengths)
+                    if offset > len(data):
+                        # Block torn by an interrupted write
+                        return
+                    if data[key_start:column_start] != key or last < start_us or first > end_us:
+                        continue
+
+                    columns = []
+                    for typecode, length in zip("qbq", lengths):
+                        columns.append(_column_from_bytes(typecode, zlib.decompress(data[column_start:column_start + length])))
+                        column_start += length
+                    deltas, status, latency = columns
+
+                    timestamp = 0
+                    for i in range(count):
+                        timestamp += deltas[i]
+                        if start_us <= timestamp <= end_us:
+                            yield (timestamp / 1_000_000, Status(status[i]),
+                                   None if latency[i] == no_latency else latency[i])
+
+
+def main():
+    # Print archived history of one check: archive.py monitor check_id [hours] [path]
+    if len(sys.argv) < 3:
+        print("Usage: archive.py monitor check_id [hours] [path]")
+        return
+    hours = float(sys.argv[3]) if len(sys.argv) > 3 else 24
+    reader = ArchiveReader(sys.argv[4] if len(sys.argv) > 4 else default_archive_path)
+    for timestamp, status, latency_ns in reader.scan(sys.argv[1], sys.argv[2], time.time() - hours * 3600):
+        latency = "" if latency_ns is None else f" -- {latency_ns / 1_000_000:.3f}ms"
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}]: {status.name}{latency}")
+
+
+if __name__ == "__main__":
+    main()
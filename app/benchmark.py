@@ -0,0 +1,420 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import check_spec
+import echo_server
+import NETMON
+from check_result import CheckResult
+from protocol import FrameDecoder, FrameEncoder, BATCH, RESULT
+from result_buffer import ResultBuffer
+from scheduler import CheckScheduler
+from service_monitor import ServiceMonitor
+from shard_pool import ShardPool
+
+loopback = "127.0.0.1"
+default_counts = "100,1000,5000"
+default_config_checks = 100000  # checks in the configuration load step
+default_duration = 10           # seconds each pipeline step runs
+default_service_duration = 2    # seconds each single service is driven
+default_interval = 1            # check interval used for pipeline steps (seconds)
+default_output = "benchmark_results.json"
+stand_in_poll = 0.1             # seconds, bounds how long stand-ins take to stop
+ntp_epoch_offset = 2208988800   # seconds between 1900-01-01 and 1970-01-01
+stand_in_stop_timeout = 5       # seconds to wait for stand-ins to stop before killing them
+max_open_files = 65536          # cap of the raised open files limit, the hard limit may be unlimited
+
+
+class QuietHTTPHandler(BaseHTTPRequestHandler):
+    """Minimal HTTP stand-in answering every GET with 200"""
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def dns_response(query: bytes) -> bytes | None:
+    """Answer any DNS query with a single A record for the loopback address"""
+    if len(query) < 12:
+        return None
+    # Find end of question: name labels, then type and class
+    end = 12
+    while end < len(query) and query[end]:
+        end += query[end] + 1
+    end += 5
+    header = query[:2] + struct.pack('!HHHHH', 0x8180, 1, 1, 0, 0)
+    answer = struct.pack('!HHHIH4s', 0xc00c, 1, 1, 60, 4, socket.inet_aton(loopback))
+    return header + query[12:end] + answer
+
+
+def ntp_response(request: bytes) -> bytes | None:
+    """Answer an NTP client request as a stratum 1 server"""
+    if len(request) < 48:
+        return None
+    now = time.time() + ntp_epoch_offset
+    timestamp = struct.pack('!II', int(now), int(now % 1 * 2 ** 32))
+    # Leap indicator 0, version 3, mode 4 (server), stratum 1, client's poll, precision
+    header = struct.pack('!BBBb', 0x1c, 1, request[2], -20) + bytes(8) + b'LOCL'
+    # Reference, originate (client's transmit time), receive and transmit timestamps
+    return header + timestamp + request[40:48] + timestamp + timestamp
+
+
+def serve_udp(sock: socket.socket, respond, stop_event) -> None:
+    """Reply to datagrams on sock with respond(data) until stop_event is set"""
+    sock.settimeout(stand_in_poll)
+    while not stop_event.is_set():
+        try:
+            data, address = sock.recvfrom(2048)
+        except TimeoutError:
+            continue
+        reply = respond(data)
+        if reply is not None:
+            sock.sendto(reply, address)
+
+
+def serve_tcp(sock: socket.socket, stop_event) -> None:
+    """Accept and immediately close connections on sock until stop_event is set"""
+    sock.settimeout(stand_in_poll)
+    while not stop_event.is_set():
+        try:
+            client_sock, _ = sock.accept()
+            client_sock.close()
+        except TimeoutError:
+            continue
+
+
+def bound_socket(sock_type: int) -> socket.socket:
+    """Return socket of sock_type bound to an ephemeral loopback port"""
+    sock = socket.socket(socket.AF_INET, sock_type)
+    sock.bind((loopback, 0))
+    return sock
+
+
+def run_stand_ins(ports, stop_event) -> None:
+    """
+    Serve every stand-in service until stop_event is set. Runs in its own process so the
+    stand-ins' CPU time and memory are not counted against the checks being measured.
+
+    :param ports:       multiprocessing queue receiving the stand-ins' port numbers
+    :param stop_event:  multiprocessing event used to stop the stand-ins
+    """
+    http_server = ThreadingHTTPServer((loopback, 0), QuietHTTPHandler)
+    http_server.daemon_threads = True
+    echo = echo_server.EchoServer(loopback, 0)
+    dns_sock, ntp_sock, udp_open_sock = (bound_socket(socket.SOCK_DGRAM) for _ in range(3))
+    tcp_open_sock = bound_socket(socket.SOCK_STREAM)
+    tcp_open_sock.listen(socket.SOMAXCONN)
+    # Bound but not listening, so connections are refused
+    tcp_closed_sock = bound_socket(socket.SOCK_STREAM)
+    # Nothing listens on a released port, so datagrams draw ICMP port unreachable
+    udp_closed_sock = bound_socket(socket.SOCK_DGRAM)
+    udp_closed_port = udp_closed_sock.getsockname()[1]
+    udp_closed_sock.close()
+
+    threads = [
+        threading.Thread(target=http_server.serve_forever, args=(stand_in_poll,)),
+        threading.Thread(target=echo.serve, args=(stop_event,)),
+        threading.Thread(target=serve_udp, args=(dns_sock, dns_response, stop_event)),
+        threading.Thread(target=serve_udp, args=(ntp_sock, ntp_response, stop_event)),
+        threading.Thread(target=serve_udp, args=(udp_open_sock, lambda data: None, stop_event)),
+        threading.Thread(target=serve_tcp, args=(tcp_open_sock, stop_event)),
+    ]
+    for thread in threads:
+        thread.start()
+
+    ports.put({
+        "http": http_server.server_address[1],
+        "echo": echo.address[1],
+        "dns": dns_sock.getsockname()[1],
+        "ntp": ntp_sock.getsockname()[1],
+        "udp_open": udp_open_sock.getsockname()[1],
+        "udp_closed": udp_closed_port,
+        "tcp_open": tcp_open_sock.getsockname()[1],
+        "tcp_closed": tcp_closed_sock.getsockname()[1],
+    })
+
+    stop_event.wait()
+    http_server.shutdown()
+    for thread in threads:
+        thread.join()
+    http_server.server_close()
+    for sock in (dns_sock, ntp_sock, udp_open_sock, tcp_open_sock, tcp_closed_sock):
+        sock.close()
+
+
+def check_templates(ports: dict) -> list:
+    """Return (label, check type, check configuration) of one check against every stand-in"""
+    return [
+        ("TCP open", "TCP", {"ip_address": loopback, "port": ports["tcp_open"]}),
+        ("TCP closed", "TCP", {"ip_address": loopback, "port": ports["tcp_closed"]}),
+        ("UDP open", "UDP", {"ip_address": loopback, "port": ports["udp_open"], "timeout": 1}),
+        ("UDP closed", "UDP", {"ip_address": loopback, "port": ports["udp_closed"], "timeout": 1}),
+        ("Echo", "Echo", {"ip_address": loopback, "port": ports["echo"]}),
+        ("HTTP", "HTTP", {"url": f"{loopback}:{ports['http']}"}),
+        ("DNS", "DNS", {"server": loopback, "port": ports["dns"], "query": "example.com", "record_type": "A"}),
+        ("NTP", "NTP", {"server": loopback, "port": ports["ntp"]}),
+    ]
+
+
+def build_checks(checks_dict: dict) -> list:
+    """Build check objects the same way NETMON does"""
+    service_monitor = ServiceMonitor()
+    service_monitor.set_checks_from_dict(checks_dict)
+    return service_monitor.get_checks()
+
+
+def peak_rss_bytes() -> int:
+    """Return peak resident set size of this process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def bench_services(templates: list, duration: float) -> dict:
+    """
+    Run each stand-in's check back to back from the calling thread
+
+    :param templates:   output of check_templates()
+    :param duration:    seconds to drive each check
+    :returns:           label -> throughput, per check wall and CPU time, and status counts
+    """
+    report = {}
+    for label, check_type, check_config in templates:
+        check = build_checks({check_type: [check_config]})[0]
+        statuses = {}
+        count = 0
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        while time.perf_counter() - wall_start < duration:
+            status = check.check().status.name
+            statuses[status] = statuses.get(status, 0) + 1
+            count += 1
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        report[label] = {
+            "checks": count,
+            "checks_per_second": count / wall,
+            "wall_ms_per_check": wall / count * 1000,
+            "cpu_ms_per_check": cpu / count * 1000,
+            "status": statuses,
+        }
+        print(f"{label:<12} {count / wall:>10.1f} checks/s  {wall / count * 1000:>9.3f}ms wall  "
+              f"{cpu / count * 1000:>7.3f}ms CPU per check  {statuses}")
+    return report
+
+
+def bench_config_load(templates: list, count: int) -> dict:
+    """
+    Time loading a configuration of count checks, cycling through templates
+
+    :param templates:   output of check_templates()
+    :param count:       checks in the configuration
+    :returns:           file size and, for each way of loading, its time and checks per second
+    """
+    checks_dict = {}
+    for i in range(count):
+        label, check_type, check_config = templates[i % len(templates)]
+        checks_dict.setdefault(check_type, []).append(dict(check_config, id=f"{label}-{i}"))
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as file:
+        json.dump(checks_dict, file)
+    try:
+        def parse():
+            with open(file.name) as config_file:
+                return json.load(config_file)
+
+        steps = (
+            ("parse", parse),
+            ("parse_compile", lambda: check_spec.compile_checks(parse())),
+            ("stream_compile", lambda: check_spec.load_checks(file.name)),
+            ("parse_build", lambda: build_checks(parse())),
+        )
+        report = {"checks": count, "file_bytes": os.path.getsize(file.name)}
+        for step, load in steps:
+            start = time.perf_counter()
+            load()
+            elapsed = time.perf_counter() - start
+            report[step] = {"ms": elapsed * 1000, "checks_per_second": count / elapsed}
+            print(f"{step:<15} {elapsed * 1000:>9.1f}ms  {count / elapsed:>10.0f} checks/s")
+    finally:
+        os.unlink(file.name)
+    return report
+
+
+def receive_results(sock: socket.socket, received: dict, stop_event) -> None:
+    """Decode result frames from sock, counting results by status"""
+    decoder = FrameDecoder()
+    sock.settimeout(stand_in_poll)
+    while not stop_event.is_set():
+        try:
+            data = sock.recv(NETMON.recv_size)
+        except TimeoutError:
+            continue
+        if not data:
+            return
+        for message in decoder.feed(data):
+            if message.type not in (BATCH, RESULT):
+                # Status and instrumentation reports
+                continue
+            bodies = message.body if message.type == BATCH else [message.body]
+            for body in bodies:
+                status = CheckResult.from_list(body).status.name
+                received[status] = received.get(status, 0) + 1
+
+
+def bench_pipeline(templates: list, count: int, duration: float, interval: float, shards: int = 1) -> dict:
+    """
+    Run count checks through the NETMON pipeline: scheduler, result buffer, batching sender
+
+    :param templates:   output of check_templates(), cycled through to build count checks
+    :param count:       number of checks to schedule
+    :param duration:    seconds to run
+    :param interval:    check interval in seconds
+    :param shards:      worker processes running the checks, 1 to run them in this process
+    :returns:           throughput, lateness (None if no shard reported it), CPU per check (including workers)
+                        and peak RSS
+    """
+    checks_dict = {}
+    for i in range(count):
+        _, check_type, check_config = templates[i % len(templates)]
+        checks_dict.setdefault(check_type, []).append(dict(check_config, id=f"bench-{i}", interval=interval))
+
+    stop_event = threading.Event()
+    results = ResultBuffer(NETMON.out_queue_size)
+    monitor_sock, manager_sock = socket.socketpair()
+    received = {}
+    if shards > 1:
+        scheduler = ShardPool(checks_dict, shards, results)
+    else:
+        scheduler = CheckScheduler(build_checks(checks_dict), lambda check, result: results.offer(result.to_list()))
+    threads = [
+        threading.Thread(target=scheduler.run, args=(stop_event,)),
+        threading.Thread(target=NETMON.send_queue,
+                         args=(stop_event, monitor_sock, None, results, FrameEncoder(binary=True), False, None)),
+        threading.Thread(target=receive_results, args=(manager_sock, received, stop_event)),
+    ]
+
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    total = sum(received.values())
+    lateness = scheduler.take_lateness_stats()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    monitor_sock.close()
+    manager_sock.close()
+    # Workers' CPU time is only known once they have exited, so it includes their shutdown
+    children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu += (children_end.ru_utime + children_end.ru_stime) - (children_start.ru_utime + children_start.ru_stime)
+
+    waits = results.take_wait_stats()
+    # Workers report every shard_pool.report_interval, so a short step may end before any report
+    if lateness is None:
+        lateness_text = "lateness n/a"
+    else:
+        lateness_text = (f"lateness p50 {lateness['late_p50_ms']:.1f}ms p99 {lateness['late_p99_ms']:.1f}ms  "
+                         f"{lateness['skipped']} skipped")
+    report = {
+        "checks": count,
+        "shards": shards,
+        "interval": interval,
+        "results": total,
+        "checks_per_second": total / wall,
+        "target_checks_per_second": count / interval,
+        "cpu_ms_per_check": cpu / total * 1000 if total else None,
+        "lateness": lateness,
+        "blocked_result_puts": waits["blocked_puts"],
+        "dropped_results": waits["dropped"],
+        "peak_rss_bytes": peak_rss_bytes(),
+        "status": received,
+    }
+    print(f"{count:>7} checks  {shards} shard(s)  {report['checks_per_second']:>9.1f}/{report['target_checks_per_second']:.0f} checks/s  "
+          f"{lateness_text}  "
+          f"{report['cpu_ms_per_check'] or 0:.3f}ms CPU per check  {report['peak_rss_bytes'] / 2 ** 20:.1f}MiB peak RSS")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark NETMON checks against local stand-in services")
+    parser.add_argument("--counts", default=default_counts, help="comma separated check counts for pipeline steps")
+    parser.add_argument("--duration", type=float, default=default_duration, help="seconds per pipeline step")
+    parser.add_argument("--interval", type=float, default=default_interval, help="check interval in seconds")
+    parser.add_argument("--service-duration", type=float, default=default_service_duration,
+                        help="seconds each single service check is driven")
+    parser.add_argument("--config-checks", type=int, default=default_config_checks,
+                        help="checks in the configuration load step")
+    parser.add_argument("--shards", default="1",
+                        help="comma separated worker process counts each pipeline step is run with")
+    parser.add_argument("--output", default=default_output, help="JSON file receiving the results")
+    args = parser.parse_args()
+
+    # Large steps hold one socket per in-flight check
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    limit = max_open_files if hard == resource.RLIM_INFINITY else min(hard, max_open_files)
+    if soft != resource.RLIM_INFINITY and soft < limit:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        except (ValueError, OSError) as e:
+            # e.g. macOS refuses limits above kern.maxfilesperproc
+            print(f"Could not raise the open files limit from {soft} to {limit}: {e}")
+    open_files_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+    ports = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    stand_ins = multiprocessing.Process(target=run_stand_ins, args=(ports, stop_event))
+    stand_ins.start()
+    try:
+        templates = check_templates(ports.get(timeout=10))
+
+        print("\nSingle service checks")
+        service_report = bench_services(templates, args.service_duration)
+
+        print(f"\nConfiguration load ({args.config_checks} checks)")
+        config_report = bench_config_load(templates, args.config_checks)
+
+        print("\nScheduler pipeline")
+        pipeline_report = [bench_pipeline(templates, int(count), args.duration, args.interval, int(shards))
+                           for shards in args.shards.split(",") for count in args.counts.split(",")]
+    finally:
+        stop_event.set()
+        stand_ins.join(stand_in_stop_timeout)
+        if stand_ins.is_alive():
+            stand_ins.terminate()
+
+    report = {
+        "meta": {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": multiprocessing.cpu_count(),
+            "open_files_limit": open_files_limit,
+            "args": vars(args),
+        },
+        "services": service_report,
+        "config_load": config_report,
+        "pipeline": pipeline_report,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import json
+import time
+import zlib
+from enum import IntEnum
+
+
+class Status(IntEnum):
+    """Outcome of a check"""
+    UP = 0
+    DOWN = 1
+    TIMEOUT = 2
+    ERROR = 3
+    UNKNOWN = 4
+
+
+def derive_check_id(check_type: str, check_dict: dict) -> str:
+    """
+    Derive a stable id for a check configured without one
+
+    :param check_type:  service type of check
+    :param check_dict:  check's configuration
+    :returns:           id built from the type and a hash of the configuration
+    """
+    config = json.dumps(check_dict, sort_keys=True).encode()
+    return f"{check_type}-{zlib.crc32(config):08x}"
+
+
+class CheckResult:
+    """
+    Structured result of a single check run.
+
+    Results are sent between monitor and manager as a flat list (see to_list/from_list)
+    and only turned into text for display on the manager.
+    """
+    __slots__ = ("check_id", "check_type", "target", "status", "latency_ns", "error_code", "detail", "timestamp")
+
+    def __init__(self, check_id: str | None, check_type: str, target: str, status: Status,
+                 latency_ns: int | None = None, error_code: int = 0, detail: str = "",
+                 timestamp: float | None = None):
+        """
+        :param check_id:    stable id of the check
+        :param check_type:  service type, e.g. "HTTP"
+        :param target:      what was checked, e.g. URL or host:port
+        :param status:      outcome of the check
+        :param latency_ns:  measured latency in nanoseconds, if any
+        :param error_code:  errno of a failed check, 0 if none
+        :param detail:      short free-form detail, e.g. HTTP status or resolved address
+        :param timestamp:   time of the result in seconds since the epoch, default now
+        """
+        self.check_id = check_id
+        self.check_type = check_type
+        self.target = target
+        self.status = status
+        self.latency_ns = latency_ns
+        self.error_code = error_code
+        self.detail = detail
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @property
+    def latency_ms(self) -> float | None:
+        return None if self.latency_ns is None else self.latency_ns / 1_000_000
+
+    def to_list(self) -> list:
+        """Return result as a flat list for the wire"""
+        return [self.check_id, self.check_type, self.target, int(self.status), self.latency_ns,
+                self.error_code, self.detail, self.timestamp]
+
+    @classmethod
+    def from_list(cls, values: list) -> "CheckResult":
+        """Rebuild a result from to_list() output"""
+        check_id, check_type, target, status, latency_ns, error_code, detail, timestamp = values
+        return cls(check_id, check_type, target, Status(status), latency_ns, error_code, detail, timestamp)
+
+
+def ms_to_ns(latency_ms: float | None) -> int | None:
+    """Convert an optional latency in milliseconds to integer nanoseconds"""
+    return None if latency_ms is None else int(latency_ms * 1_000_000)
@@ -0,0 +1,363 @@
+import argparse
+import difflib
+import json
+import sys
+import time
+import types
+from collections import namedtuple
+from check_result import derive_check_id
+from io_functions import max_interval
+
+chunk_size = 1 << 16        # bytes read at once when streaming a config file
+max_errors = 100            # errors collected before compiling gives up
+
+
+class ConfigError(Exception):
+    """Raised when a checks configuration does not match the check schemas"""
+
+    def __init__(self, errors: list):
+        """
+        :param errors:  (path, message) of every problem found, e.g. ("HTTP[3].interval", "must be a number")
+        """
+        self.errors = errors
+        lines = [f"{path}: {message}" if path else message for path, message in errors]
+        super().__init__(f"{len(errors)} error(s) in configuration:\n  " + "\n  ".join(lines))
+
+
+class Field:
+    """Schema of one check setting"""
+    __slots__ = ("kinds", "required", "default", "validate")
+
+    def __init__(self, kinds: tuple, *, required: bool = False, default=None, validate=None):
+        """
+        :param kinds:       accepted Python types of the JSON value
+        :param required:    the setting must be present
+        :param default:     value of an absent optional setting
+        :param validate:    callable(value) returning an error message, or None if the value is valid
+        """
+        self.kinds = kinds
+        self.required = required
+        self.default = default
+        self.validate = validate
+
+
+def between(low, high):
+    return lambda value: None if low <= value <= high else f"must be between {low} and {high}"
+
+
+def positive(value):
+    return None if value > 0 else "must be greater than 0"
+
+
+def positive_up_to(high):
+    return lambda value: None if 0 < value <= high else f"must be greater than 0 and at most {high}"
+
+
+def one_of(*choices):
+    return lambda value: None if value in choices else f"must be one of {', '.join(map(repr, choices))}"
+
+
+def strings(value):
+    return None if all(isinstance(item, str) for item in value) else "must be a list of strings"
+
+
+number = (int, float)
+port = Field((int,), required=True, validate=between(1, 65535))
+common_fields = {
+    "id": Field((str,)),
+    "interval": Field(number, default=5, validate=positive_up_to(max_interval)),
+}
+schemas = {
+    "HTTP": {
+        "url": Field((str,), required=True),
+        "timeout": Field(number, default=5, validate=positive),
+        "connection": Field((str,), default="warm", validate=one_of("warm", "cold")),
+    },
+    "ICMP": {
+        "host": Field((str,), required=True),
+        "ttl": Field((int,), default=64, validate=between(1, 500)),
+        "timeout": Field(number, default=1, validate=positive),
+        "sequence_number": Field((int,), default=1, validate=between(1, 65535)),
+    },
+    "DNS": {
+        "server": Field((str,), required=True),
+        "port": Field((int,), default=53, validate=between(1, 65535)),
+        "query": Field((str,), required=True),
+        "record_type": Field((str,), required=True),
+    },
+    "NTP": {
+        "server": Field((str,)),
+        "servers": Field((list,), default=(), validate=strings),
+        "port": Field((int,), default=123, validate=between(1, 65535)),
+        "samples": Field((int,), default=4, validate=between(1, 8)),
+        "timeout": Field(number, default=2, validate=positive),
+    },
+    "TCP": {
+        "ip_address": Field((str,), required=True),
+        "port": port,
+    },
+    "PortRange": {
+        "protocol": Field((str,), default="TCP", validate=one_of("TCP", "UDP")),
+        "ip_address": Field((str,), required=True),
+        "start_port": port,
+        "end_port": port,
+        "timeout": Field(number, default=3, validate=positive),
+    },
+    "UDP": {
+        "ip_address": Field((str,), required=True),
+        "port": port,
+        "timeout": Field(number, default=3, validate=positive),
+        "payload": Field((str,)),
+    },
+    "Echo": {
+        "ip_address": Field((str,), required=True),
+        "port": port,
+        "timeout": Field(number, default=3, validate=positive),
+        "persistent": Field((bool,), default=False),
+        "probes": Field((int,), default=1, validate=between(1, 1000)),
+        "payload_size": Field((int,), default=64, validate=between(1, 65536)),
+    },
+}
+schemas["HTTPS"] = schemas["HTTP"]
+
+# Immutable spec type per check type: its type, then common and type specific settings in schema order
+spec_types = {check_type: namedtuple(f"{check_type}Spec", ("type",) + tuple(common_fields) + tuple(fields))
+              for check_type, fields in schemas.items()}
+_fields = {check_type: tuple({**common_fields, **fields}.items()) for check_type, fields in schemas.items()}
+_names = {check_type: frozenset(name for name, _ in fields) for check_type, fields in _fields.items()}
+
+
+def _check_consistency(check_type: str, values: dict) -> tuple | None:
+    """Return (setting, message) of a problem spanning several settings, or None"""
+    if check_type == "NTP" and values["server"] is None and not values["servers"]:
+        return "servers", "at least one server is required"
+    if check_type == "PortRange" and values["start_port"] > values["end_port"]:
+        return "end_port", "must not be less than start_port"
+    return None
+
+
+def _type_name(kinds: tuple) -> str:
+    if float in kinds:
+        return "a number"
+    return {int: "an integer", str: "a string", bool: "true or false", list: "a list"}[kinds[0]]
+
+
+def compile_check(check_type: str, raw, path: str, errors: list):
+    """
+    Validate one check's settings and build its spec
+
+    :param check_type:  service type of the check
+    :param raw:         check's settings as parsed from JSON
+    :param path:        location of the check for error messages, e.g. "HTTP[3]"
+    :param errors:      list (path, message) errors are appended to
+    :returns:           spec, or None if the check is invalid
+    """
+    fields = _fields.get(check_type)
+    if fields is None:
+        errors.append((path, f"unknown check type {check_type!r}, expected one of {', '.join(schemas)}"))
+        return None
+    if not isinstance(raw, dict):
+        errors.append((path, "must be an object"))
+        return None
+
+    count = len(errors)
+    values = {}
+    for name, field in fields:
+        value = raw.get(name)
+        if value is None:
+            if field.required:
+                errors.append((f"{path}.{name}", "is required"))
+            values[name] = field.default
+            continue
+        # bool is an int in Python, but not a number in a config file
+        if not isinstance(value, field.kinds) or (isinstance(value, bool) and bool not in field.kinds):
+            errors.append((f"{path}.{name}", f"must be {_type_name(field.kinds)}, not {json.dumps(value)}"))
+            continue
+        if field.validate is not None:
+            message = field.validate(value)
+            if message is not None:
+                errors.append((f"{path}.{name}", message))
+                continue
+        values[name] = tuple(value) if isinstance(value, list) else value
+
+    for name in raw.keys() - _names[check_type]:
+        close = difflib.get_close_matches(name, _names[check_type], n=1)
+        hint = f" (did you mean {close[0]!r}?)" if close else ""
+        errors.append((f"{path}.{name}", f"unknown setting{hint}"))
+    if len(errors) > count:
+        return None
+
+    problem = _check_consistency(check_type, values)
+    if problem is not None:
+        errors.append((f"{path}.{problem[0]}", problem[1]))
+        return None
+    if values["id"] is None:
+        values["id"] = derive_check_id(check_type, raw)
+    return spec_types[check_type](check_type, *values.values())
+
+
+def compile_checks(checks_dict, prefix: str = "") -> list:
+    """
+    Validate a checks dictionary and build a spec for every check
+
+    :param checks_dict: check type -> list of check settings
+    :param prefix:      path of checks_dict in its file, prepended to error paths
+    :returns:           list of specs
+    :raises ConfigError: listing every invalid setting
+    """
+    if not isinstance(checks_dict, dict):
+        raise ConfigError([(prefix, "checks must be an object of check type -> list of checks")])
+    return _compile(((check_type, check_list) for check_type, check_list in checks_dict.items()), prefix)
+
+
+def _compile(groups, prefix: str) -> list:
+    """Compile (check type, iterable of checks) groups, raising ConfigError for any invalid check"""
+    prefix = f"{prefix}." if prefix else ""
+    specs, errors = [], []
+    paths = {}      # check id -> path of the check using it
+    for check_type, check_list in groups:
+        if not isinstance(check_list, (list, types.GeneratorType)):
+            errors.append((f"{prefix}{check_type}", "must be a list of checks"))
+            continue
+        for i, raw in enumerate(check_list):
+            path = f"{prefix}{check_type}[{i}]"
+            spec = compile_check(check_type, raw, path, errors)
+            if spec is not None:
+                # Checks are scheduled and updated by id, so a second check with the same id would replace the first
+                first = paths.setdefault(spec.id, path)
+                if first != path:
+                    hint = "" if raw.get("id") else ", give one of these identical checks an id"
+                    errors.append((f"{path}.id", f"duplicate id {spec.id!r}, also used by {first}{hint}"))
+                    continue
+                specs.append(spec)
+            if len(errors) >= max_errors:
+                raise ConfigError(errors)
+    if errors:
+        raise ConfigError(errors)
+    return specs
+
+
+class _Stream:
+    """
+    Incremental JSON reader for files too large to parse in one go.
+
+    Structure is walked character by character, while each element is decoded with
+    JSONDecoder.raw_decode() as soon as it is complete in the buffer.
+    """
+
+    def __init__(self, file, path: str):
+        self._file = file
+        self._path = path
+        self._buffer = ""
+        self._offset = 0
+        self._consumed = 0      # characters dropped from the buffer so far
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """Read more of the file, returning False at its end"""
+        data = self._file.read(chunk_size)
+        if not data:
+            return False
+        self._consumed += self._offset
+        self._buffer = self._buffer[self._offset:] + data
+        self._offset = 0
+        return True
+
+    def _error(self, message: str) -> ConfigError:
+        return ConfigError([(self._path, f"{message} at character {self._consumed + self._offset}")])
+
+    def peek(self) -> str:
+        """Return next non-whitespace character without consuming it"""
+        while True:
+            while self._offset < len(self._buffer) and self._buffer[self._offset] in " \t\r\n":
+                self._offset += 1
+            if self._offset < len(self._buffer):
+                return self._buffer[self._offset]
+            if not self._fill():
+                raise self._error("unexpected end of file")
+
+    def expect(self, characters: str) -> str:
+        """Consume next non-whitespace character, which must be one of characters"""
+        char = self.peek()
+        if char not in characters:
+            raise self._error(f"expected {' or '.join(map(repr, characters))}, found {char!r}")
+        self._offset += 1
+        return char
+
+    def value(self):
+        """Decode next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._offset)
+            except json.JSONDecodeError as e:
+                # An incomplete value fails to decode until the rest of it is read
+                if not self._fill():
+                    raise self._error(e.msg)
+                continue
+            if end == len(self._buffer) and not isinstance(value, (dict, list, str)) and self._fill():
+                # A number may continue in the next chunk
+                continue
+            self._offset = end
+            return value
+
+    def items(self):
+        """Yield every element of the array at the current position as it is decoded"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.expect("]")
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def groups(self):
+        """Yield (key, element generator or value) for every member of the object at the start of the file"""
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            if self.peek() == "[":
+                items = self.items()
+                yield key, items
+                # Skip elements the consumer did not read
+                for _ in items:
+                    pass
+            else:
+                yield key, self.value()
+            if self.expect(",}") == "}":
+                return
+
+
+def load_checks(path: str) -> list:
+    """
+    Stream a checks dictionary JSON file and compile it, without holding the whole parse tree in memory
+
+    :param path:    file of check type -> list of check settings
+    :returns:       list of specs
+    :raises ConfigError: if the file is not valid JSON or any check is invalid
+    """
+    with open(path, "r") as file:
+        return _compile(_Stream(file, path).groups(), "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate a checks dictionary JSON file")
+    parser.add_argument("path", help="file of check type -> list of check settings")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        specs = load_checks(args.path)
+    except (ConfigError, OSError) as e:
+        print(e)
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+    print(f"{len(specs)} checks valid -- loaded in {elapsed * 1000:.1f}ms ({len(specs) / elapsed:.0f} checks/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import socket
+import threading
+import time
+import dns.resolver
+
+default_address_ttl = 300   # seconds before a nameserver's address is looked up again
+default_port = 53
+
+
+class ResolverCache:
+    """
+    Pre-configured DNS resolvers, one per nameserver.
+
+    Resolvers are built without reading resolv.conf and point only at their nameserver.
+    The nameserver's own address is resolved once and refreshed after address_ttl seconds.
+    """
+
+    def __init__(self, address_ttl: float = default_address_ttl):
+        self._address_ttl = address_ttl
+        self._resolvers = {}        # (server, port) -> (resolver, time address was resolved)
+        self._lock = threading.Lock()
+
+    def get(self, server: str, port: int = default_port) -> dns.resolver.Resolver:
+        """
+        Return the resolver for server, resolving its address if missing or stale.
+
+        :param server:  DNS server name or IP address
+        :param port:    DNS server port
+        :returns:       resolver querying only that server
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._resolvers.get((server, port))
+        if entry is not None and now - entry[1] < self._address_ttl:
+            return entry[0]
+
+        # Resolve outside the lock so one slow lookup does not hold up other checks
+        address = socket.gethostbyname(server)
+        # A new resolver is swapped in, other threads may be querying with the cached one
+        resolver = dns.resolver.Resolver(configure=False)
+        resolver.nameservers = [address]
+        resolver.port = port
+        with self._lock:
+            self._resolvers[(server, port)] = (resolver, now)
+        return resolver
+
+
+resolver_cache = ResolverCache()
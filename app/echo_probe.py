@@ -0,0 +1,173 @@
+import asyncio
+import socket
+import struct
+from timing import now_ns, elapsed_ms, enable_rx_timestamps, kernel_arrival_ns, timespec_size, wait_readable
+
+default_probes = 1          # probes per burst
+default_payload_size = 64   # bytes per probe after its header
+send_chunk = 16384          # bytes sent before reading echoes back, so large bursts cannot deadlock
+probe_header = struct.Struct('!II')     # sequence number, payload size
+ancillary_size = socket.CMSG_SPACE(timespec_size)
+
+
+def build_burst(sequence: int, probes: int, payload_size: int) -> bytes:
+    """
+    Build a burst of sequence-numbered probes
+
+    Each payload byte depends on the probe's sequence number and position, so an echo that is
+    reordered, truncated or left over from an earlier burst fails verification.
+
+    :param sequence:        sequence number of the first probe
+    :param probes:          number of probes
+    :param payload_size:    bytes of payload per probe
+    :returns:               probes concatenated
+    """
+    pattern = bytes(range(256)) * (payload_size // 256 + 2)
+    burst = bytearray()
+    for i in range(probes):
+        seq = (sequence + i) & 0xffffffff
+        offset = seq & 0xff
+        burst += probe_header.pack(seq, payload_size)
+        burst += pattern[offset:offset + payload_size]
+    return bytes(burst)
+
+
+def verify(burst: bytes, echoed: memoryview, probe_size: int) -> str | None:
+    """Return description of the first probe echoed incorrectly, or None if the echo is byte-exact"""
+    if echoed == burst:
+        return None
+    for i in range(0, len(burst), probe_size):
+        if echoed[i:i + probe_size] != burst[i:i + probe_size]:
+            sequence = probe_header.unpack_from(burst, i)[0]
+            return f"Echo of probe {sequence} did not match"
+    return None
+
+
+def rtt_summary(rtts: list) -> dict:
+    """
+    Summarise probe round trip times
+
+    :param rtts:    round trip times in ms
+    :returns:       min, avg and max RTT and jitter (mean difference between consecutive RTTs) in ms
+    """
+    jitter = 0.0
+    if len(rtts) > 1:
+        jitter = sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1)
+    return {"min": min(rtts), "avg": sum(rtts) / len(rtts), "max": max(rtts), "jitter": jitter}
+
+
+class _BurstReader:
+    """Collects an echoed burst, timing the arrival of each probe's last byte"""
+
+    def __init__(self, burst: bytes, probe_size: int):
+        self.buffer = bytearray(len(burst))
+        self.view = memoryview(self.buffer)
+        self.received = 0
+        self.rtts = []
+        self._probe_size = probe_size
+        self._next_end = probe_size
+
+    def done(self) -> bool:
+        return self.received == len(self.buffer)
+
+    def read(self, sock: socket.socket, start: int) -> int:
+        """Receive into the buffer, returning bytes received"""
+        size, ancdata, _, _ = sock.recvmsg_into([self.view[self.received:]], ancillary_size)
+        arrival = kernel_arrival_ns(ancdata)
+        self.received += size
+        while self._next_end <= self.received:
+            self.rtts.append(elapsed_ms(start, arrival))
+            self._next_end += self._probe_size
+        return size
+
+
+def echo_burst(sock: socket.socket, sequence: int, probes: int = default_probes,
+               payload_size: int = default_payload_size) -> tuple:
+    """
+    Send a pipelined burst of probes over a connected blocking socket and time their echoes
+
+    :param sock:            connected socket, its timeout bounds each receive
+    :param sequence:        sequence number of the first probe
+    :param probes:          number of probes
+    :param payload_size:    bytes of payload per probe
+    :returns:               (True if every probe was echoed byte-exact, description, RTT per echoed probe in ms)
+    """
+    burst = build_burst(sequence, probes, payload_size)
+    reader = _BurstReader(burst, probe_header.size + payload_size)
+    start = now_ns()
+    timeout = sock.gettimeout()
+    for offset in range(0, len(burst), send_chunk):
+        sock.sendall(burst[offset:offset + send_chunk])
+        # Read echoes already waiting so the server is never blocked sending them back.
+        # A socket with a timeout waits out MSG_DONTWAIT, so make it non-blocking meanwhile.
+        sock.settimeout(0)
+        try:
+            while not reader.done():
+                if not reader.read(sock, start):
+                    return False, "Server closed the connection", reader.rtts
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            sock.settimeout(timeout)
+    while not reader.done():
+        if not reader.read(sock, start):
+            return False, "Server closed the connection", reader.rtts
+    return _report(burst, reader, probe_header.size + payload_size)
+
+
+async def echo_burst_async(sock: socket.socket, sequence: int, probes: int = default_probes,
+                           payload_size: int = default_payload_size) -> tuple:
+    """
+    Coroutine version of echo_burst() for non-blocking sockets on an asyncio event loop.
+
+    Callers bound the burst with asyncio.wait_for().
+
+    :returns:   same as echo_burst()
+    """
+    loop = asyncio.get_running_loop()
+    burst = build_burst(sequence, probes, payload_size)
+    reader = _BurstReader(burst, probe_header.size + payload_size)
+    start = now_ns()
+    # Send while reading, so the server is never blocked sending echoes back
+    sending = loop.create_task(loop.sock_sendall(sock, burst))
+    try:
+        while not reader.done():
+            try:
+                if not reader.read(sock, start):
+                    return False, "Server closed the connection", reader.rtts
+            except (BlockingIOError, InterruptedError):
+                await wait_readable(sock)
+        await sending
+    finally:
+        sending.cancel()
+    return _report(burst, reader, probe_header.size + payload_size)
+
+
+def _report(burst: bytes, reader: _BurstReader, probe_size: int) -> tuple:
+    mismatch = verify(burst, reader.view, probe_size)
+    if mismatch is not None:
+        return False, mismatch, reader.rtts
+    return True, f"Server echoed {len(reader.rtts)} probes byte-exact.", reader.rtts
+
+
+def open_connection(host: str, port: int, timeout: float) -> socket.socket:
+    """Open a blocking connection to an echo server with receive timestamps enabled"""
+    sock = socket.create_connection((host, port), timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    enable_rx_timestamps(sock)
+    return sock
+
+
+async def open_connection_async(host: str, port: int, timeout: float) -> socket.socket:
+    """Open a non-blocking connection to an echo server with receive timestamps enabled"""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setblocking(False)
+        await asyncio.wait_for(loop.sock_connect(sock, (host, port)), timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        enable_rx_timestamps(sock)
+        return sock
+    except BaseException:
+        sock.close()
+        raise
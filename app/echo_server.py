@@ -3,47 +3,154 @@
 # Written with reference to:
 # Source URL: https://docs.python.org/3/howto/sockets.html
 # Source URL: https://docs.python.org/3/library/socket.html
+# Source URL: https://docs.python.org/3/library/selectors.html
 
+import argparse
+import selectors
 import socket
 import threading
 from prompt_toolkit import PromptSession
 from prompt_toolkit.completion import WordCompleter
 from prompt_toolkit.patch_stdout import patch_stdout
 
+default_port = 45446
+default_bind = "localhost"
+buffer_size = 65536         # bytes received at once, shared by every connection
+select_timeout = 0.1        # seconds, bounds how long stop takes to be noticed
 
-# Worker thread function
-def worker(stop_event: threading.Event) -> None:
+
+class EchoConnection:
+    """State of one TCP client"""
+    __slots__ = ("sock", "pending")
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.pending = bytearray()     # echo bytes the client has not accepted yet
+
+
+class EchoServer:
     """
-    Open server socket and echo messages back
+    Single-threaded TCP or UDP echo server.
+
+    Every socket is multiplexed through one selector, so thousands of clients are served at once.
+    Data is received into one preallocated buffer and echoed straight from a memoryview of it; bytes
+    are only copied when a client is not reading fast enough, and that client is not read from
+    again until it has caught up.
     """
-    # Set up server socket
-    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_sock.settimeout(3)
-    with server_sock:
-        server_sock.bind(('localhost', 45446))
-        server_sock.listen()
-
-        while not stop_event.is_set():
-            # Accept client connection
+
+    def __init__(self, host: str = default_bind, port: int = default_port, mode: str = "tcp"):
+        """
+        :param host:    address to bind to
+        :param port:    port to listen on, 0 for any free port
+        :param mode:    "tcp" or "udp"
+        """
+        self.mode = mode
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._selector = selectors.DefaultSelector()
+        sock_type = socket.SOCK_STREAM if mode == "tcp" else socket.SOCK_DGRAM
+        self._sock = socket.socket(socket.AF_INET, sock_type)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        if mode == "tcp":
+            self._sock.listen(socket.SOMAXCONN)
+        self._sock.setblocking(False)
+        self.address = self._sock.getsockname()
+
+    def serve(self, stop_event) -> None:
+        """
+        Echo until stop_event is set, then close every socket
+
+        :param stop_event:  threading.Event used to stop the server
+        """
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        try:
+            while not stop_event.is_set():
+                for key, mask in self._selector.select(select_timeout):
+                    if key.fileobj is not self._sock:
+                        self._handle(key.data, mask)
+                    elif self.mode == "tcp":
+                        self._accept()
+                    else:
+                        self._echo_datagrams()
+        finally:
+            for key in list(self._selector.get_map().values()):
+                key.fileobj.close()
+            self._selector.close()
+
+    def _accept(self) -> None:
+        """Accept every waiting client"""
+        while True:
+            try:
+                client_sock, _ = self._sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # e.g. out of file descriptors, retry on the next readiness event
+                print(f"Could not accept connection: {e}")
+                return
+            client_sock.setblocking(False)
+            self._selector.register(client_sock, selectors.EVENT_READ, EchoConnection(client_sock))
+
+    def _echo_datagrams(self) -> None:
+        """Echo every waiting datagram to its sender"""
+        while True:
             try:
-                # Nonblocking accept call
-                client_sock, client_address = server_sock.accept()
-                with client_sock:
+                size, address = self._sock.recvfrom_into(self._buffer)
+                self._sock.sendto(self._view[:size], address)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. ICMP error from an earlier sender that has gone away
+                continue
+
+    def _handle(self, connection: EchoConnection, mask: int) -> None:
+        try:
+            if mask & selectors.EVENT_WRITE:
+                self._send_pending(connection)
+            elif mask & selectors.EVENT_READ:
+                self._receive(connection)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            # A client giving up mid-echo must not stop the server
+            self._close(connection)
+
+    def _receive(self, connection: EchoConnection) -> None:
+        size = connection.sock.recv_into(self._buffer)
+        if not size:
+            self._close(connection)
+            return
+        try:
+            sent = connection.sock.send(self._view[:size])
+        except BlockingIOError:
+            sent = 0
+        if sent < size:
+            # Keep the remainder and stop reading from this client until it is sent
+            connection.pending += self._view[sent:size]
+            self._selector.modify(connection.sock, selectors.EVENT_WRITE, connection)
+
+    def _send_pending(self, connection: EchoConnection) -> None:
+        sent = connection.sock.send(connection.pending)
+        del connection.pending[:sent]
+        if not connection.pending:
+            self._selector.modify(connection.sock, selectors.EVENT_READ, connection)
+
+    def _close(self, connection: EchoConnection) -> None:
+        self._selector.unregister(connection.sock)
+        connection.sock.close()
 
-                    # Recieve and echo back messages from client until connection is closed
-                    while True:
-                        client_msg = client_sock.recv(1024)
-                        if not client_msg:
-                            break
-                        client_sock.sendall(client_msg)
 
-            # If accept call times out, thread stop event will be checked
-            except TimeoutError:
-                pass
+# Worker thread function
+def worker(stop_event: threading.Event, host: str = default_bind, port: int = default_port, mode: str = "tcp") -> None:
+    """
+    Open server socket and echo messages back
+    """
+    EchoServer(host, port, mode).serve(stop_event)
 
 
 # Output status and check for command input
-def command_loop() -> None:
+def command_loop(host: str, port: int, mode: str) -> None:
     """
     Main function to handle user input and manage threads.
     Uses prompt-toolkit for handling user input with auto-completion and ensures
@@ -53,7 +160,7 @@ def command_loop() -> None:
     stop_event: threading.Event = threading.Event()
 
     # Create a thread for the server socket
-    worker_thread: threading.Thread = threading.Thread(target=worker, args=(stop_event,))
+    worker_thread: threading.Thread = threading.Thread(target=worker, args=(stop_event, host, port, mode))
     worker_thread.start()
 
     # Command completer for auto-completion
@@ -82,9 +189,15 @@ def command_loop() -> None:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="TCP/UDP echo server")
+    parser.add_argument("--port", type=int, default=default_port, help="port to listen on")
+    parser.add_argument("--bind", default=default_bind, help="address to bind to")
+    parser.add_argument("--mode", choices=["tcp", "udp"], default="tcp", help="transport protocol")
+    args = parser.parse_args()
+
     # Begin monitoring and waiting for user commands
-    print("Echo server running...")
-    command_loop()
+    print(f"Echo server running on {args.bind}:{args.port} ({args.mode.upper()})...")
+    command_loop(args.bind, args.port, args.mode)
 
 
 if __name__ == "__main__":
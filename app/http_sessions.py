@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+default_max_sessions = 256          # hosts with a pooled session
+default_connections_per_host = 4    # keep-alive connections per host
+default_headers = {'User-Agent': 'Mozilla/5.0'}
+
+
+class SessionPool:
+    """
+    Bounded pool of keep-alive HTTP sessions keyed by scheme and host.
+
+    Each session keeps at most connections_per_host connections open to its host and blocks
+    further requests until one is free. The least recently used session is closed once
+    max_sessions hosts are pooled.
+    """
+
+    def __init__(self, max_sessions: int = default_max_sessions,
+                 connections_per_host: int = default_connections_per_host):
+        self._sessions = OrderedDict()
+        self._max_sessions = max_sessions
+        self._connections_per_host = connections_per_host
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> requests.Session:
+        """
+        Return the pooled session for url's scheme and host, creating it if needed.
+
+        :param url:     full URL including scheme
+        :returns:       session for the URL's host
+        """
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}".lower()
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                return session
+
+            session = new_session(self._connections_per_host)
+            self._sessions[key] = session
+            if len(self._sessions) > self._max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                evicted.close()
+            return session
+
+    def close(self) -> None:
+        """Close every pooled session"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+def new_session(connections: int = 1) -> requests.Session:
+    """
+    Create a session with a bounded connection pool.
+
+    :param connections:     maximum connections kept per host
+    :returns:               configured session
+    """
+    session = requests.Session()
+    session.headers.update(default_headers)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connections, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+session_pool = SessionPool()
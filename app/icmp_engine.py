@@ -0,0 +1,287 @@
+import array
+import errno
+import os
+import random
+import socket
+import string
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Tuple
+from timing import now_ns, elapsed_ms, enable_rx_timestamps, recv_timestamped
+
+ICMP_ECHO_REPLY = 0
+ICMP_DEST_UNREACHABLE = 3
+ICMP_ECHO_REQUEST = 8
+ICMP_TIME_EXCEEDED = 11
+IPPROTO_ICMP = 1
+max_sequence = 65535
+recv_buffer_size = 4096
+default_data_size = 192         # bytes of ICMP payload
+max_packet_templates = 1024
+receive_error_backoff = 0.01        # seconds waited after a receive error, doubled per consecutive error...
+max_receive_error_backoff = 1.0     # ...up to this
+
+
+def calculate_icmp_checksum(data: bytes) -> int:
+    """
+    Calculate the Internet checksum (RFC 1071) of data.
+
+    The 16-bit words are summed in bulk from an array in native byte order; the one's complement
+    sum is byte-order independent, so only the folded result needs swapping on little-endian hosts.
+    Odd-length data is padded with a zero byte.
+
+    :param data:    bytes to checksum
+    :returns:       checksum in network byte order, as an integer
+    """
+    if len(data) % 2:
+        data = bytes(data) + b'\x00'
+    s = sum(array.array('H', data))
+
+    # Fold carries back into the low 16 bits
+    while s >> 16:
+        s = (s >> 16) + (s & 0xffff)
+
+    if sys.byteorder == 'little':
+        s = ((s & 0xff) << 8) | (s >> 8)
+    return ~s & 0xffff
+
+
+def update_icmp_checksum(checksum: int, old_word: int, new_word: int) -> int:
+    """
+    Incrementally update a checksum after one 16-bit word changed (RFC 1624, eqn. 3).
+
+    :param checksum:    current checksum
+    :param old_word:    previous value of the changed word
+    :param new_word:    new value of the changed word
+    :returns:           updated checksum
+    """
+    s = (~checksum & 0xffff) + (~old_word & 0xffff) + new_word
+    s = (s >> 16) + (s & 0xffff)
+    s += s >> 16
+    return ~s & 0xffff
+
+
+class IcmpPacketFactory:
+    """
+    Builds ICMP echo packets from cached templates.
+
+    A template (header with sequence 0 plus payload) and its checksum are computed once per
+    (type, code, identifier, payload size). Each packet then only patches the sequence field
+    and updates the checksum incrementally.
+    """
+
+    def __init__(self, max_templates: int = max_packet_templates):
+        self._templates = {}
+        self._max_templates = max_templates
+
+    def _make_template(self, key: Tuple) -> Tuple:
+        icmp_type, icmp_code, identifier, data_size = key
+
+        # Payload is a single random alphanumeric character repeated to the requested size
+        payload = random.choice(string.ascii_letters + string.digits).encode() * data_size
+        header = struct.pack('!BBHHH', icmp_type, icmp_code, 0, identifier, 0)
+        template = (calculate_icmp_checksum(header + payload), payload)
+
+        if len(self._templates) >= self._max_templates:
+            self._templates.clear()
+        self._templates[key] = template
+        return template
+
+    def build(self, identifier: int, sequence: int, data_size: int = default_data_size,
+              icmp_type: int = ICMP_ECHO_REQUEST, icmp_code: int = 0) -> bytes:
+        """
+        Return an ICMP packet for identifier and sequence.
+
+        :param identifier:  ICMP identifier
+        :param sequence:    ICMP sequence number
+        :param data_size:   payload size in bytes
+        :param icmp_type:   ICMP type, echo request by default
+        :param icmp_code:   ICMP code
+        :returns:           complete ICMP packet
+        """
+        key = (icmp_type, icmp_code, identifier & 0xffff, data_size)
+        template = self._templates.get(key)
+        if template is None:
+            template = self._make_template(key)
+        template_checksum, payload = template
+
+        checksum = update_icmp_checksum(template_checksum, 0, sequence & 0xffff)
+        return struct.pack('!BBHHH', icmp_type, icmp_code, checksum, identifier & 0xffff, sequence & 0xffff) + payload
+
+
+packet_factory = IcmpPacketFactory()
+
+
+class IcmpEngine:
+    """
+    Process-wide ICMP engine.
+
+    One raw socket is shared by every probe in the process. A single receiver thread parses
+    the IP and ICMP headers of each incoming packet and routes echo replies, time-exceeded and
+    destination-unreachable messages to the waiting probe by (identifier, sequence).
+    """
+
+    def __init__(self):
+        self._identifier = os.getpid() & 0xffff
+        self._next_sequence = 1
+        self._waiters = {}          # (identifier, sequence) -> (future, send time in ns)
+        self._lock = threading.Lock()
+        self._sock = None
+        self._receiver = None
+
+    def _ensure_socket(self) -> socket.socket:
+        """Open the shared raw socket and start the receiver thread on first use"""
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            enable_rx_timestamps(self._sock)
+            self._receiver = threading.Thread(target=self._receive_loop, args=(self._sock,), name="icmp-receiver",
+                                              daemon=True)
+            self._receiver.start()
+        return self._sock
+
+    def _allocate_sequence(self, preferred: int) -> int:
+        """Return preferred sequence number if no probe is using it, else the next free one"""
+        sequence = preferred & max_sequence
+        while (self._identifier, sequence) in self._waiters:
+            sequence = self._next_sequence
+            self._next_sequence = self._next_sequence % max_sequence + 1
+        return sequence
+
+    def send(self, address: str, ttl: int = 64, sequence_number: int = 1) -> Tuple:
+        """
+        Send an ICMP Echo Request to address.
+
+        :param address:         IPv4 address of the target host
+        :param ttl:             Time-To-Live of the probe
+        :param sequence_number: preferred sequence number; another is used if it is in flight
+
+        :returns:   (key, future) -- future resolves to (replier address, RTT in ms, ICMP type)
+        """
+        future = Future()
+        with self._lock:
+            sock = self._ensure_socket()
+            sequence = self._allocate_sequence(sequence_number)
+            key = (self._identifier, sequence)
+            packet = packet_factory.build(self._identifier, sequence)
+
+            # TTL is a socket option, so it is set and used under the same lock
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+            self._waiters[key] = (future, now_ns())
+            try:
+                sock.sendto(packet, (address, 1))
+            except OSError:
+                del self._waiters[key]
+                raise
+        return key, future
+
+    def cancel(self, key: Tuple) -> None:
+        """Stop waiting for a probe, e.g. after it timed out"""
+        with self._lock:
+            self._waiters.pop(key, None)
+
+    def close(self) -> None:
+        """Close the shared socket, stopping the receiver thread. A later send() opens a new one."""
+        with self._lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            # shutdown() wakes the receiver blocked in recv, close() alone does not
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def _receive_loop(self, sock: socket.socket) -> None:
+        """Receive every ICMP packet on sock and hand it to its probe, until sock is closed"""
+        backoff = receive_error_backoff
+        while True:
+            try:
+                data, addr, arrival = recv_timestamped(sock, recv_buffer_size)
+            except OSError as e:
+                if self._sock is not sock or e.errno in (errno.EBADF, errno.ENOTSOCK):
+                    return
+                # Back off so a persistent error does not spin the thread
+                print(f"ICMP receive failed: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, max_receive_error_backoff)
+                continue
+            backoff = receive_error_backoff
+            if self._sock is not sock:
+                return
+
+            parsed = parse_icmp_packet(data)
+            if parsed is None:
+                continue
+            icmp_type, key = parsed
+
+            with self._lock:
+                waiter = self._waiters.get(key)
+                # A reply arriving before the probe was sent answers an earlier probe that used its sequence
+                if waiter is not None and arrival < waiter[1]:
+                    continue
+                self._waiters.pop(key, None)
+            if waiter is not None:
+                future, start = waiter
+                try:
+                    future.set_result((addr, elapsed_ms(start, arrival), icmp_type))
+                except InvalidStateError:
+                    # The probe gave up (timed out or was cancelled) just before its reply arrived
+                    pass
+
+
+def parse_icmp_packet(data: bytes) -> Tuple | None:
+    """
+    Parse a packet received on a raw ICMP socket.
+
+    :param data:    raw packet including IP header
+    :returns:       (ICMP type, (identifier, sequence)) of the probe it answers, or None if it
+                    does not answer an echo request
+    """
+    try:
+        ip_header_length = (data[0] & 0x0f) * 4
+        icmp_type = data[ip_header_length]
+
+        if icmp_type == ICMP_ECHO_REPLY:
+            # Echo replies carry our identifier and sequence in their own header
+            identifier, sequence = struct.unpack_from('!HH', data, ip_header_length + 4)
+            return icmp_type, (identifier, sequence)
+
+        if icmp_type in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACHABLE):
+            # Errors quote the original IP header followed by the first 8 bytes of our request
+            inner = ip_header_length + 8
+            if data[inner + 9] != IPPROTO_ICMP:
+                return None
+            inner_icmp = inner + (data[inner] & 0x0f) * 4
+            if data[inner_icmp] != ICMP_ECHO_REQUEST:
+                return None
+            identifier, sequence = struct.unpack_from('!HH', data, inner_icmp + 4)
+            return icmp_type, (identifier, sequence)
+
+    except (IndexError, struct.error):
+        pass
+    return None
+
+
+def resolve_ipv4(host: str) -> str:
+    """Return host unchanged if it is an IPv4 address, otherwise resolve it"""
+    try:
+        socket.inet_aton(host)
+        return host
+    except OSError:
+        return socket.gethostbyname(host)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> IcmpEngine:
+    """Return the process-wide ICMP engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = IcmpEngine()
+        return _engine
@@ -0,0 +1,278 @@
+import errno
+import queue
+import selectors
+import socket
+import time
+from protocol import FrameDecoder, FrameEncoder, ProtocolError, BATCH, CONFIG, CONFIG_DELTA, STATS, STATUS
+from check_result import CheckResult
+
+recv_size = 65536           # bytes read from a monitor socket at once
+reconnect_delay = 5         # seconds between connection attempts
+select_timeout = 0.1        # seconds, bounds how long stop takes to be noticed
+rate_interval = 1.0         # seconds between results per second updates
+
+
+class MonitorConnection:
+    """Connection state for one remote monitor"""
+
+    def __init__(self, name: str, data: dict):
+        socket_info = data["socket"]
+        self.name = name
+        self.ip, self.port = socket_info["ip"], socket_info["port"]
+        self.checks = data["checks"]
+        self.binary = socket_info.get("encoding") == "binary"
+        self.compress = socket_info.get("compress", False)
+        self.state = "disconnected"
+        self.sock = None
+        self.encoder = None
+        self.decoder = None
+        self.out_buffer = bytearray()
+        self.retry_at = 0.0
+        self.address = None     # IPv4 address of ip, once resolved
+
+    def resolve(self) -> bool:
+        """Resolve the monitor's host to an IPv4 address, returning False if it cannot be resolved"""
+        try:
+            self.address = socket.gethostbyname(self.ip)
+            return True
+        except OSError as e:
+            print(f"Could not resolve address of network monitor service '{self.name}' ({self.ip}): {e}")
+            return False
+
+
+class IngestLoop:
+    """
+    Single-threaded ingest loop for every monitor connection.
+
+    One selector holds all monitor sockets. The loop connects to monitors without blocking,
+    sends each its configuration, reconnects dropped monitors, and decodes incoming results.
+    Other threads hand it configuration changes through an outbound queue, waking the selector
+    through a socket pair.
+    """
+
+    def __init__(self, config: dict, on_result, on_status, on_stats=None):
+        """
+        :param config:      manager configuration, monitor name -> {"socket": ..., "checks": ...}
+        :param on_result:   callable(connection, CheckResult) invoked for every result received
+        :param on_status:   callable(connection, message body) invoked for every status message received
+        :param on_stats:    callable(connection, message body) invoked for every instrumentation snapshot received
+        """
+        self._monitors = [MonitorConnection(name, data) for name, data in config.items()]
+        # Resolve host names here rather than on the loop, where a slow lookup would hold up every monitor
+        for monitor in self._monitors:
+            monitor.resolve()
+        self._on_result = on_result
+        self._on_status = on_status
+        self._on_stats = on_stats
+        self._selector = selectors.DefaultSelector()
+        self._outbound = queue.Queue()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self.results_total = 0
+        self.results_per_second = 0.0
+        self._rate_count = 0
+        self._rate_start = time.monotonic()
+
+    def stats(self) -> dict:
+        """Return ingest statistics"""
+        return {
+            "monitors": len(self._monitors),
+            "connected": sum(1 for m in self._monitors if m.state == "connected"),
+            "results_total": self.results_total,
+            "results_per_second": self.results_per_second,
+        }
+
+    def update_checks(self, name: str, checks: dict, delta: dict) -> None:
+        """
+        Change a monitor's checks without reconnecting. Safe to call from any thread.
+
+        :param name:    monitor name
+        :param checks:  monitor's full checks dictionary, sent if it reconnects
+        :param delta:   changes sent to the monitor now if it is connected, see service_manager.diff_checks()
+        """
+        self._outbound.put((name, checks, delta))
+        try:
+            self._wakeup_send.send(b'\0')
+        except BlockingIOError:
+            # Loop already has a wakeup pending
+            pass
+
+    def monitor_states(self) -> list:
+        """Return (name, connection state) of every monitor"""
+        return [(monitor.name, monitor.state) for monitor in self._monitors]
+
+    def run(self, stop_event) -> None:
+        """
+        Run until stop_event is set. Blocks the calling thread.
+
+        :param stop_event:  threading.Event used to stop the loop
+        """
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        try:
+            while not stop_event.is_set():
+                now = time.monotonic()
+                for monitor in self._monitors:
+                    if monitor.state == "disconnected" and monitor.retry_at <= now:
+                        self._connect(monitor)
+
+                for key, mask in self._selector.select(select_timeout):
+                    monitor = key.data
+                    if monitor is None:
+                        self._send_updates()
+                        continue
+                    if monitor.state == "connecting":
+                        self._finish_connect(monitor)
+                        continue
+                    if mask & selectors.EVENT_WRITE:
+                        self._flush(monitor)
+                    if mask & selectors.EVENT_READ and monitor.state == "connected":
+                        self._read(monitor)
+
+                self._update_rate()
+        finally:
+            for monitor in self._monitors:
+                if monitor.sock is not None:
+                    self._close(monitor)
+            self._selector.close()
+            self._wakeup_recv.close()
+            self._wakeup_send.close()
+
+    def _connect(self, monitor: MonitorConnection) -> None:
+        """Start a non-blocking connection to monitor"""
+        # Only a host that could not be resolved before is looked up again on the loop
+        if monitor.address is None and not monitor.resolve():
+            self._offline(monitor)
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            err = sock.connect_ex((monitor.address, monitor.port))
+        except (OSError, OverflowError, TypeError) as e:
+            # e.g. a port outside 0-65535 in the configuration
+            print(f"Could not connect to network monitor service '{monitor.name}': {e}")
+            err = None
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            self._offline(monitor)
+            return
+        monitor.sock, monitor.state = sock, "connecting"
+        self._selector.register(sock, selectors.EVENT_WRITE, monitor)
+
+    def _finish_connect(self, monitor: MonitorConnection) -> None:
+        """Complete connection once socket is writable and queue the monitor's configuration"""
+        if monitor.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+            self._close(monitor)
+            self._offline(monitor)
+            return
+
+        print(f"Connected to service '{monitor.name}'")
+        monitor.encoder = FrameEncoder(binary=monitor.binary)
+        monitor.state = "connected"
+        monitor.decoder = FrameDecoder()
+        monitor.out_buffer = bytearray(monitor.encoder.encode(CONFIG, monitor.checks, monitor.compress))
+        self._flush(monitor)
+
+    def _send_updates(self) -> None:
+        """Queue configuration changes handed over by update_checks() on their monitors' connections"""
+        try:
+            while self._wakeup_recv.recv(recv_size):
+                pass
+        except BlockingIOError:
+            pass
+        monitors = {monitor.name: monitor for monitor in self._monitors}
+        while True:
+            try:
+                name, checks, delta = self._outbound.get_nowait()
+            except queue.Empty:
+                return
+            monitor = monitors.get(name)
+            if monitor is None:
+                continue
+            monitor.checks = checks
+            # A monitor that is not connected receives the full configuration when it reconnects
+            if monitor.state == "connected":
+                monitor.out_buffer += monitor.encoder.encode(CONFIG_DELTA, delta, monitor.compress)
+                self._flush(monitor)
+
+    def _flush(self, monitor: MonitorConnection) -> None:
+        """Send as much queued data as the socket accepts"""
+        try:
+            sent = monitor.sock.send(monitor.out_buffer)
+            del monitor.out_buffer[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._disconnect(monitor, "disconnected")
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if monitor.out_buffer else 0)
+        self._selector.modify(monitor.sock, events, monitor)
+
+    def _read(self, monitor: MonitorConnection) -> None:
+        """Read available data and hand decoded results to on_result"""
+        try:
+            data = monitor.sock.recv(recv_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._disconnect(monitor, "disconnected")
+            return
+        if not data:
+            self._disconnect(monitor, "timed out")
+            return
+
+        try:
+            messages = monitor.decoder.feed(data)
+        except ProtocolError as e:
+            self._disconnect(monitor, f"sent invalid data ({e})")
+            return
+        for message in messages:
+            if message.type == STATUS:
+                self._dispatch(self._on_status, monitor, message.body)
+                continue
+            if message.type == STATS:
+                if self._on_stats is not None:
+                    self._dispatch(self._on_stats, monitor, message.body)
+                continue
+            bodies = message.body if message.type == BATCH else [message.body]
+            try:
+                results = [CheckResult.from_list(body) for body in bodies]
+            except (ValueError, TypeError, IndexError, KeyError) as e:
+                self._disconnect(monitor, f"sent an invalid result ({e!r})")
+                return
+            self._rate_count += len(results)
+            for result in results:
+                self._dispatch(self._on_result, monitor, result)
+
+    @staticmethod
+    def _dispatch(callback, monitor: MonitorConnection, body) -> None:
+        """Call callback, reporting rather than raising its errors so other monitors are still served"""
+        try:
+            callback(monitor, body)
+        except Exception as e:
+            print(f"Could not process message from '{monitor.name}': {e!r}")
+
+    def _offline(self, monitor: MonitorConnection) -> None:
+        print(f"Network monitor service '{monitor.name}' is offline. Attempting to reconnect.")
+        monitor.retry_at = time.monotonic() + reconnect_delay
+
+    def _disconnect(self, monitor: MonitorConnection, reason: str) -> None:
+        print(f"Monitoring service '{monitor.name}' {reason}. Attempting to reconnect.")
+        self._close(monitor)
+        monitor.retry_at = time.monotonic() + reconnect_delay
+
+    def _close(self, monitor: MonitorConnection) -> None:
+        self._selector.unregister(monitor.sock)
+        monitor.sock.close()
+        monitor.sock, monitor.state = None, "disconnected"
+        monitor.out_buffer.clear()
+
+    def _update_rate(self) -> None:
+        """Recompute results per second once every rate_interval"""
+        now = time.monotonic()
+        elapsed = now - self._rate_start
+        if elapsed >= rate_interval:
+            self.results_total += self._rate_count
+            self.results_per_second = self._rate_count / elapsed
+            self._rate_count = 0
+            self._rate_start = now
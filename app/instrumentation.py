@@ -0,0 +1,167 @@
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+
+profile_path = "./profiles/"
+profile_interval = 0.01     # seconds between stack samples
+max_profile_seconds = 600
+
+
+class Timer:
+    """Cumulative count and duration of one instrumented operation"""
+    __slots__ = ("count", "total_ns", "max_ns")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0     # longest since the last snapshot
+
+    def record(self, ns: int) -> None:
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+
+class Instruments:
+    """
+    Process-wide timers for the monitor's hot paths.
+
+    Counts and totals only ever grow, so the manager can difference two snapshots to get rates
+    and averages over any interval, and a lost snapshot loses no information.
+    """
+
+    def __init__(self):
+        self._timers = {}
+        self._sources = {}      # source -> [threads, timers] of its latest snapshot, see merge()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, ns: int) -> None:
+        """
+        Add one duration to a timer
+
+        :param name:    timer name, e.g. "check.HTTP"
+        :param ns:      duration in nanoseconds
+        """
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = Timer()
+            timer.record(ns)
+
+    def merge(self, source, snapshot: dict) -> None:
+        """
+        Include another process's instruments in every later snapshot
+
+        :param source:      key of the other process, replacing its previous snapshot
+        :param snapshot:    its latest snapshot(), e.g. of a shard worker
+        """
+        with self._lock:
+            previous = self._sources.get(source)
+            timers = {name: list(timer) for name, timer in snapshot["timers"].items()}
+            if previous is not None:
+                # Keep the longest duration since our own last snapshot, not just since the source's
+                for name, timer in previous[1].items():
+                    if name in timers:
+                        timers[name][2] = max(timers[name][2], timer[2])
+            self._sources[source] = [snapshot["threads"], timers]
+
+    def snapshot(self) -> dict:
+        """
+        Return every timer and the number of live threads, resetting each timer's max
+
+        Timers and threads of merged sources are added to this process's own.
+
+        :returns:   {"threads": count, "timers": {name: [count, total ms, max ms since last snapshot]}}
+        """
+        threads = threading.active_count()
+        with self._lock:
+            timers = {name: [t.count, t.total_ns / 1_000_000, t.max_ns / 1_000_000] for name, t in self._timers.items()}
+            for timer in self._timers.values():
+                timer.max_ns = 0
+            for source in self._sources.values():
+                threads += source[0]
+                for name, (count, total_ms, max_ms) in source[1].items():
+                    timer = timers.setdefault(name, [0, 0.0, 0.0])
+                    timer[0] += count
+                    timer[1] += total_ms
+                    timer[2] = max(timer[2], max_ms)
+                    source[1][name][2] = 0.0
+        return {"threads": threads, "timers": timers}
+
+
+instruments = Instruments()
+
+
+def record(name: str, ns: int) -> None:
+    """Add one duration to a timer of the process-wide instruments"""
+    instruments.record(name, ns)
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling every thread's stack.
+
+    Stacks are read with sys._current_frames() from a separate thread, so nothing needs to be
+    enabled in the profiled code and the overhead is one stack walk per thread per sample.
+    Samples are written in collapsed stack format, one "thread;outer;...;inner count" line per
+    distinct stack, as read by flame graph tools.
+    """
+
+    def __init__(self, seconds: float, interval: float = profile_interval, path: str = profile_path):
+        """
+        :param seconds:     how long to sample for
+        :param interval:    seconds between samples
+        :param path:        folder profiles are written to
+        """
+        self.seconds = seconds
+        self.interval = interval
+        self.path = path
+
+    def run(self, stop_event) -> str | None:
+        """
+        Sample until the duration elapses or stop_event is set, then write the profile
+
+        :param stop_event:  threading.Event used to stop sampling early
+        :returns:           path of the profile written, or None if nothing was sampled
+        """
+        stacks = collections.Counter()
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline and not stop_event.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stacks[_collapse(names.get(ident, str(ident)), frame)] += 1
+            stop_event.wait(self.interval)
+        if not stacks:
+            return None
+
+        os.makedirs(self.path, exist_ok=True)
+        filename = os.path.join(self.path, f"netmon-{datetime.datetime.now():%Y%m%d-%H%M%S}.folded")
+        with open(filename, "w") as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        return filename
+
+
+def _collapse(thread_name: str, frame) -> str:
+    """Return stack of frame as "thread;outermost;...;innermost" """
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    functions.append(thread_name.replace(";", ":"))
+    return ";".join(reversed(functions))
+
+
+def profile(seconds: float, stop_event) -> None:
+    """Run a SamplingProfiler and report where its profile was written, for use as a thread target"""
+    print(f"Profiling for {seconds}s...")
+    filename = SamplingProfiler(seconds).run(stop_event)
+    if filename is not None:
+        print(f"Profile written to {filename}")
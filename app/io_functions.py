@@ -3,6 +3,9 @@ max_interval = 600          # seconds
 max_timeout = 300           # seconds
 max_ttl = 500
 max_16b = 65535
+max_echo_probes = 1000
+max_echo_payload = 65536    # bytes
+max_ntp_samples = 8
 
 
 def get_input(val_type: type, def_val: str | int | None = None, *, minmax: (int, int) = None) -> str | int | None:
@@ -96,6 +99,36 @@ def get_input_sequeunce_number(default: int = 1) -> int:
     return get_input(int, default, minmax=(1, max_16b))
 
 
+def get_input_echo_probes(default: int = 1) -> int:
+    """
+    Helper function for get_input().
+    Accepts and returns a number of echo probes per check from user.
+    """
+    print("Input number of probes sent per check.")
+    print(f"Press enter to leave at default value ({default}).")
+    return get_input(int, default, minmax=(1, max_echo_probes))
+
+
+def get_input_payload_size(default: int = 64) -> int:
+    """
+    Helper function for get_input().
+    Accepts and returns a probe payload size from user.
+    """
+    print("Input probe payload size (in bytes).")
+    print(f"Press enter to leave at default value ({default}B).")
+    return get_input(int, default, minmax=(1, max_echo_payload))
+
+
+def get_input_ntp_samples(default: int = 4) -> int:
+    """
+    Helper function for get_input().
+    Accepts and returns a number of requests sent to each NTP server per check from user.
+    """
+    print("Input number of samples taken from each server per check.")
+    print(f"Press enter to leave at default value ({default}).")
+    return get_input(int, default, minmax=(1, max_ntp_samples))
+
+
 def get_input_port_number() -> int:
     """
     Helper function for get_input().
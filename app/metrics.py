@@ -0,0 +1,249 @@
+import gzip
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from check_result import CheckResult, Status
+
+default_bind = "127.0.0.1"
+default_port = 9464
+request_timeout = 0.1       # seconds, bounds how long stop takes to be noticed
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)    # seconds
+latency_bucket_ns = tuple(round(bound * 1_000_000_000) for bound in latency_buckets)
+prometheus_type = "text/plain; version=0.0.4; charset=utf-8"
+openmetrics_type = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Families rendered from per-check fragments: name, type, help
+check_families = (
+    ("netman_check_latency_seconds", "histogram", "Latency of check results"),
+    ("netman_check_up", "gauge", "1 if the check's last result was UP, else 0"),
+    ("netman_check_results", "counter", "Check results received, by status"),
+    ("netman_check_last_result_timestamp_seconds", "gauge", "Time of the check's last result"),
+)
+
+
+def escape(value) -> str:
+    """Escape a label value for the text exposition format"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _header(name: str, metric_type: str, description: str, openmetrics: bool) -> str:
+    # OpenMetrics names a counter family without its samples' _total suffix, Prometheus with it
+    if metric_type == "counter" and not openmetrics:
+        name += "_total"
+    return f"# HELP {name} {description}\n# TYPE {name} {metric_type}\n"
+
+
+class CheckMetrics:
+    """Pre-aggregated metrics of one check and its last rendered fragments"""
+    __slots__ = ("identity", "labels", "buckets", "latency_sum", "latency_count", "results", "up", "timestamp",
+                 "fragments", "dirty")
+
+    def __init__(self, monitor: str, result: CheckResult):
+        self.identity = (result.check_type, result.target)     # labels besides monitor and check id
+        self.labels = (f'monitor="{escape(monitor)}",check_id="{escape(result.check_id)}",'
+                       f'type="{escape(result.check_type)}",target="{escape(result.target)}"')
+        self.buckets = [0] * (len(latency_buckets) + 1)
+        self.latency_sum = 0
+        self.latency_count = 0
+        self.results = [0] * len(Status)
+        self.up = 0
+        self.timestamp = 0.0
+        self.fragments = None
+        self.dirty = True
+
+    def record(self, result: CheckResult) -> None:
+        if result.latency_ns is not None:
+            self.buckets[bisect_left(latency_bucket_ns, result.latency_ns)] += 1
+            self.latency_sum += result.latency_ns
+            self.latency_count += 1
+        self.results[result.status] += 1
+        self.up = int(result.status == Status.UP)
+        self.timestamp = result.timestamp
+        self.dirty = True
+
+    def snapshot(self) -> tuple:
+        self.dirty = False
+        return list(self.buckets), self.latency_sum, self.latency_count, list(self.results), self.up, self.timestamp
+
+    def render(self, snapshot: tuple) -> None:
+        """Render this check's samples of every family in check_families"""
+        buckets, latency_sum, latency_count, results, up, timestamp = snapshot
+        labels = self.labels
+        histogram = []
+        cumulative = 0
+        for bound, count in zip(latency_buckets, buckets):
+            cumulative += count
+            histogram.append(f'netman_check_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}\n')
+        histogram.append(f'netman_check_latency_seconds_bucket{{{labels},le="+Inf"}} {latency_count}\n'
+                         f'netman_check_latency_seconds_sum{{{labels}}} {latency_sum / 1e9}\n'
+                         f'netman_check_latency_seconds_count{{{labels}}} {latency_count}\n')
+        counters = "".join(f'netman_check_results_total{{{labels},status="{status.name}"}} {results[status]}\n'
+                           for status in Status)
+        self.fragments = (
+            "".join(histogram).encode(),
+            f'netman_check_up{{{labels}}} {up}\n'.encode(),
+            counters.encode(),
+            f'netman_check_last_result_timestamp_seconds{{{labels}}} {timestamp}\n'.encode(),
+        )
+
+
+class MetricsRegistry:
+    """
+    Pre-aggregated check metrics for the /metrics endpoint.
+
+    Recording a result only updates a few counters. Each check's exposition text is cached and
+    only rendered again once the check has new results, so a scrape mostly joins cached bytes.
+    """
+
+    def __init__(self):
+        self._checks = {}
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self._monitor_states = None
+        self._ingest_stats = None
+        self._monitor_instruments = {}
+        self._configured = {}       # monitor -> ids of its configured checks, see set_checks()
+
+    def attach(self, monitor_states, ingest_stats) -> None:
+        """
+        Also expose monitor connection state and ingest statistics
+
+        :param monitor_states:  callable returning (monitor name, connection state) pairs
+        :param ingest_stats:    callable returning ingest statistics, see IngestLoop.stats()
+        """
+        self._monitor_states = monitor_states
+        self._ingest_stats = ingest_stats
+
+    def set_checks(self, monitor: str, check_ids) -> None:
+        """
+        Export only the given checks of a monitor, dropping series of checks no longer configured
+
+        :param monitor:     monitor name
+        :param check_ids:   ids of the monitor's configured checks
+        """
+        check_ids = frozenset(check_ids)
+        with self._lock:
+            self._configured[monitor] = check_ids
+            for key in [key for key in self._checks if key[0] == monitor and key[1] not in check_ids]:
+                del self._checks[key]
+
+    def record(self, monitor: str, result: CheckResult) -> None:
+        """Add result to its check's metrics"""
+        key = (monitor, result.check_id)
+        with self._lock:
+            configured = self._configured.get(monitor)
+            if configured is not None and result.check_id not in configured:
+                # Result of a removed check still in flight when it was removed
+                return
+            metrics = self._checks.get(key)
+            if metrics is None or metrics.identity != (result.check_type, result.target):
+                # New check, or one whose settings changed its labels: start a new series
+                metrics = self._checks[key] = CheckMetrics(monitor, result)
+            metrics.record(result)
+
+    def record_monitor_stats(self, monitor: str, snapshot: dict) -> None:
+        """Keep a monitor's latest self-instrumentation snapshot, see instrumentation.Instruments"""
+        with self._lock:
+            self._monitor_instruments[monitor] = snapshot
+
+    def render(self, openmetrics: bool = False) -> bytes:
+        """
+        Render every metric in the text exposition format
+
+        :param openmetrics: render OpenMetrics rather than Prometheus text format
+        :returns:           exposition text
+        """
+        with self._render_lock:
+            # Copy changed checks' counters under the lock, format them without holding it
+            with self._lock:
+                checks = list(self._checks.values())
+                changed = [(metrics, metrics.snapshot()) for metrics in checks if metrics.dirty]
+            for metrics, snapshot in changed:
+                metrics.render(snapshot)
+
+            parts = []
+            for i, (name, metric_type, description) in enumerate(check_families):
+                parts.append(_header(name, metric_type, description, openmetrics).encode())
+                parts.extend(metrics.fragments[i] for metrics in checks)
+            parts.append(self._render_ingest(openmetrics).encode())
+            if openmetrics:
+                parts.append(b"# EOF\n")
+            return b"".join(parts)
+
+    def _render_ingest(self, openmetrics: bool) -> str:
+        lines = []
+        if self._monitor_states is not None:
+            lines.append(_header("netman_monitor_connected", "gauge",
+                                 "1 if the manager is connected to the monitor, else 0", openmetrics))
+            for name, state in self._monitor_states():
+                lines.append(f'netman_monitor_connected{{monitor="{escape(name)}"}} {int(state == "connected")}\n')
+        if self._ingest_stats is not None:
+            stats = self._ingest_stats()
+            lines.append(_header("netman_ingest_results", "counter", "Results received from every monitor", openmetrics))
+            lines.append(f"netman_ingest_results_total {stats['results_total']}\n")
+            lines.append(_header("netman_ingest_results_per_second", "gauge", "Recent result ingest rate", openmetrics))
+            lines.append(f"netman_ingest_results_per_second {stats['results_per_second']}\n")
+
+        with self._lock:
+            instruments = list(self._monitor_instruments.items())
+        if instruments:
+            lines.append(_header("netman_monitor_threads", "gauge", "Threads alive in the monitor", openmetrics))
+            lines.extend(f'netman_monitor_threads{{monitor="{escape(name)}"}} {snapshot["threads"]}\n'
+                         for name, snapshot in instruments)
+            lines.append(_header("netman_monitor_operation_seconds", "summary",
+                                 "Time the monitor spent in instrumented operations", openmetrics))
+            for name, snapshot in instruments:
+                for operation, (count, total_ms, _) in snapshot["timers"].items():
+                    labels = f'monitor="{escape(name)}",operation="{escape(operation)}"'
+                    lines.append(f"netman_monitor_operation_seconds_sum{{{labels}}} {total_ms / 1000}\n"
+                                 f"netman_monitor_operation_seconds_count{{{labels}}} {count}\n")
+        return "".join(lines)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the registry's metrics at /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = self.server.registry.render(openmetrics)
+        self.send_response(200)
+        self.send_header("Content-Type", openmetrics_type if openmetrics else prometheus_type)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """HTTP server exposing a MetricsRegistry, served from its own thread"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = default_bind, port: int = default_port):
+        """
+        :param registry:    metrics to serve
+        :param host:        address to bind to
+        :param port:        port to listen on, 0 for any free port
+        """
+        self._server = HTTPServer((host, port), MetricsHandler)
+        self._server.registry = registry
+        self._server.timeout = request_timeout
+        self.address = self._server.server_address
+
+    def run(self, stop_event) -> None:
+        """
+        Serve scrapes until stop_event is set. Blocks the calling thread.
+
+        :param stop_event:  threading.Event used to stop the server
+        """
+        try:
+            while not stop_event.is_set():
+                self._server.handle_request()
+        finally:
+            self._server.server_close()
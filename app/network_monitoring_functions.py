@@ -1,61 +1,29 @@
+import asyncio
 import os
 import socket
-import struct
 import threading
 import time
 import zlib
-import random
-import string
 import requests
-import ntplib
 import dns.resolver
 import dns.exception
-from socket import gaierror
-from time import ctime
+from dns_resolvers import resolver_cache
+from concurrent.futures import TimeoutError as FutureTimeoutError, FIRST_COMPLETED, wait as futures_wait
+from http_sessions import session_pool, new_session
+from icmp_engine import get_engine, resolve_ipv4, packet_factory
+from tcp_probe import probe_tcp_ports, probe_tcp_ports_sync
+from udp_probe import probe_udp_ports, probe_udp_ports_sync
+import udp_probe
+import echo_probe
+import ntp_client
 from typing import Tuple, Optional, Any
 
-
-def calculate_icmp_checksum(data: bytes) -> int:
-    """
-    Calculate the checksum for the ICMP packet.
-
-    The checksum is calculated by summing the 16-bit words of the entire packet,
-    carrying any overflow bits around, and then complementing the result.
-
-    Args:
-    data (bytes): The data for which the checksum is to be calculated.
-
-    Returns:
-    int: The calculated checksum.
-    """
-
-    s: int = 0  # Initialize the sum to 0.
-
-    # Iterate over the data in 16-bit (2-byte) chunks.
-    for i in range(0, len(data), 2):
-        # Combine two adjacent bytes (8-bits each) into one 16-bit word.
-        # data[i] is the high byte, shifted left by 8 bits.
-        # data[i + 1] is the low byte, added to the high byte.
-        # This forms one 16-bit word for each pair of bytes.
-        w: int = (data[i] << 8) + (data[i + 1])
-        s += w  # Add the 16-bit word to the sum.
-
-    # Add the overflow back into the sum.
-    # If the sum is larger than 16 bits, the overflow will be in the higher bits.
-    # (s >> 16) extracts the overflow by shifting right by 16 bits.
-    # (s & 0xffff) keeps only the lower 16 bits of the sum.
-    # The two parts are then added together.
-    s = (s >> 16) + (s & 0xffff)
-
-    # Complement the result.
-    # ~s performs a bitwise complement (inverting all the bits).
-    # & 0xffff ensures the result is a 16-bit value by masking the higher bits.
-    s = ~s & 0xffff
-
-    return s  # Return the calculated checksum.
+# Header row for traceroute results. Each column is formatted for alignment and width.
+traceroute_header = f"{'Hop':>3} {'Address':<15} {'Min (ms)':>8}   {'Avg (ms)':>8}   {'Max (ms)':>8}   {'Count':>5}"
 
 
-def create_icmp_packet(icmp_type: int = 8, icmp_code: int = 0, sequence_number: int = 1, data_size: int = 192) -> bytes:
+def create_icmp_packet(icmp_type: int = 8, icmp_code: int = 0, sequence_number: int = 1, data_size: int = 192,
+                       identifier: int | None = None) -> bytes:
     """
     Creates an ICMP (Internet Control Message Protocol) packet with specified parameters.
 
@@ -64,113 +32,125 @@ def create_icmp_packet(icmp_type: int = 8, icmp_code: int = 0, sequence_number:
     icmp_code (int): The code of the ICMP packet. Default is 0.
     sequence_number (int): The sequence number of the ICMP packet. Default is 1.
     data_size (int): The size of the data payload in the ICMP packet. Default is 192 bytes.
+    identifier (int | None): The ICMP identifier. Default derives one from the thread and process IDs.
 
     Returns:
     bytes: A bytes object representing the complete ICMP packet.
 
     Description:
-    The function generates a unique ICMP packet by combining the specified ICMP type, code, and sequence number
-    with a data payload of a specified size. It calculates a checksum for the packet and ensures that the packet
-    is in the correct format for network transmission.
+    The packet is built from the shared packet factory, which caches a template per identifier and payload size
+    and only patches the sequence number and checksum for each new packet.
     """
 
-    # Get the current thread identifier and process identifier.
-    # These are used to create a unique ICMP identifier.
-    thread_id = threading.get_ident()
-    process_id = os.getpid()
+    if identifier is None:
+        # Get the current thread identifier and process identifier.
+        # These are used to create a unique ICMP identifier.
+        thread_id = threading.get_ident()
+        process_id = os.getpid()
 
-    # Generate a unique ICMP identifier using CRC32 over the concatenation of thread_id and process_id.
-    # The & 0xffff ensures the result is within the range of an unsigned 16-bit integer (0-65535).
-    icmp_id = zlib.crc32(f"{thread_id}{process_id}".encode()) & 0xffff
+        # Generate a unique ICMP identifier using CRC32 over the concatenation of thread_id and process_id.
+        # The & 0xffff ensures the result is within the range of an unsigned 16-bit integer (0-65535).
+        identifier = zlib.crc32(f"{thread_id}{process_id}".encode()) & 0xffff
 
-    # Pack the ICMP header fields into a bytes object.
-    # 'bbHHh' is the format string for struct.pack, which means:
-    # b - signed char (1 byte) for ICMP type
-    # b - signed char (1 byte) for ICMP code
-    # H - unsigned short (2 bytes) for checksum, initially set to 0
-    # H - unsigned short (2 bytes) for ICMP identifier
-    # h - short (2 bytes) for sequence number
-    header: bytes = struct.pack('bbHHh', icmp_type, icmp_code, 0, icmp_id, sequence_number)
-
-    # Create the data payload for the ICMP packet.
-    # It's a sequence of a single randomly chosen alphanumeric character (uppercase or lowercase),
-    # repeated to match the total length specified by data_size.
-    random_char: str = random.choice(string.ascii_letters + string.digits)
-    data: bytes = (random_char * data_size).encode()
-
-    # Calculate the checksum of the header and data.
-    chksum: int = calculate_icmp_checksum(header + data)
-
-    # Repack the header with the correct checksum.
-    # socket.htons ensures the checksum is in network byte order.
-    header = struct.pack('bbHHh', icmp_type, icmp_code, socket.htons(chksum), icmp_id, sequence_number)
-
-    # Return the complete ICMP packet by concatenating the header and data.
-    return header + data
+    return packet_factory.build(identifier, sequence_number, data_size, icmp_type, icmp_code)
 
 
 def ping(host: str, ttl: int = 64, timeout: int = 1, sequence_number: int = 1) -> Tuple[Any, float] | Tuple[Any, None]:
     """
     Send an ICMP Echo Request to a specified host and measure the round-trip time.
 
-    This function creates a raw socket to send an ICMP Echo Request packet to the given host.
-    It then waits for an Echo Reply, measuring the time taken for the round trip. If the
-    specified timeout is exceeded before receiving a reply, the function returns None for the ping time.
+    The request is sent through the process-wide ICMP engine, which shares one raw socket between
+    all probes and routes each reply to its probe by (identifier, sequence). If the specified
+    timeout is exceeded before receiving a reply, the function returns None for the ping time.
 
     Args:
     host (str): The IP address or hostname of the target host.
     ttl (int): Time-To-Live for the ICMP packet. Determines how many hops (routers) the packet can pass through.
     timeout (int): The time in seconds that the function will wait for a reply before giving up.
-    sequence_number (int): The sequence number for the ICMP packet. Useful for matching requests with replies.
+    sequence_number (int): The preferred sequence number for the ICMP packet. The engine picks another
+                           one if a probe with the same sequence number is already in flight.
 
     Returns:
     Tuple[Any, float] | Tuple[Any, None]: A tuple containing the address of the replier and the total ping time in milliseconds.
     If the request times out, the function returns None for the ping time. The address part of the tuple is also None if no reply is received.
     """
+    engine = get_engine()
+
+    # Send the ICMP Echo Request through the shared socket.
+    key, future = engine.send(resolve_ipv4(host), ttl, sequence_number)
+
+    try:
+        # Wait for the receiver thread to hand us our reply.
+        addr, total_ping_time, _ = future.result(timeout=timeout)
+
+        # Return the address of the replier and the total ping time.
+        return addr, total_ping_time
+    except FutureTimeoutError:
+        # If no reply is received within the timeout period, return None for the ping time.
+        engine.cancel(key)
+        return None, None
+
+
+async def ping_async(host: str, ttl: int = 64, timeout: int = 1, sequence_number: int = 1) -> Tuple[Any, float] | Tuple[Any, None]:
+    """
+    Coroutine version of ping() for use on an asyncio event loop.
 
-    # Create a raw socket with the Internet Protocol (IPv4) and ICMP.
-    # socket.AF_INET specifies the IPv4 address family.
-    # socket.SOCK_RAW allows sending raw packets (including ICMP).
-    # socket.IPPROTO_ICMP specifies the ICMP protocol.
-    with socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP) as sock:
-        # Set the Time-To-Live (TTL) for the ICMP packet.
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+    Args:
+    host (str): The IP address or hostname of the target host.
+    ttl (int): Time-To-Live for the ICMP packet.
+    timeout (int): The time in seconds to wait for a reply before giving up.
+    sequence_number (int): The preferred sequence number for the ICMP packet.
 
-        # Set the timeout for the socket's blocking operations (e.g., recvfrom).
-        sock.settimeout(timeout)
+    Returns:
+    Tuple[Any, float] | Tuple[Any, None]: Same as ping().
+    """
+    loop = asyncio.get_running_loop()
+    engine = get_engine()
 
-        # Create an ICMP Echo Request packet.
-        # icmp_type=8 and icmp_code=0 are standard for Echo Request.
-        # sequence_number is used to match Echo Requests with Replies.
-        packet: bytes = create_icmp_packet(icmp_type=8, icmp_code=0, sequence_number=sequence_number)
+    # Resolve hostnames without blocking the event loop
+    address = host
+    try:
+        socket.inet_aton(host)
+    except OSError:
+        address = (await loop.getaddrinfo(host, None, family=socket.AF_INET))[0][4][0]
 
-        # Send the ICMP packet to the target host.
-        # The second argument of sendto is a tuple (host, port).
-        # For raw sockets, the port number is irrelevant, hence set to 1.
-        sock.sendto(packet, (host, 1))
+    key, future = engine.send(address, ttl, sequence_number)
+    try:
+        addr, total_ping_time, _ = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        return addr, total_ping_time
+    except asyncio.TimeoutError:
+        return None, None
+    finally:
+        # Also when the task is cancelled, so the engine does not keep waiting for this probe
+        engine.cancel(key)
 
-        # Record the current time to measure the round-trip time later.
-        start: float = time.time()
 
-        try:
-            # Wait to receive data from the socket (up to 1024 bytes).
-            # This will be the ICMP Echo Reply if the target host is reachable.
-            data, addr = sock.recvfrom(1024)
+def format_hop(ttl: int, addr: Any, ping_times: list) -> str:
+    """
+    Format one row of the traceroute results table.
 
-            # Record the time when the reply is received.
-            end: float = time.time()
+    Args:
+    ttl (int): The hop's TTL.
+    addr (Any): The address of the replier, or None.
+    ping_times (list): Response times in milliseconds received for this hop.
 
-            # Calculate the round-trip time in milliseconds.
-            total_ping_time = (end - start) * 1000
+    Returns:
+    str: The formatted row with min/avg/max/count columns.
+    """
+    # If there are valid ping responses, calculate and format the statistics.
+    if ping_times:
+        min_time = min(ping_times)  # Minimum ping time.
+        avg_time = sum(ping_times) / len(ping_times)  # Average ping time.
+        max_time = max(ping_times)  # Maximum ping time.
+        count = len(ping_times)  # Count of successful pings.
+        return f"{ttl:>3} {addr[0] if addr else '*':<15} {min_time:>8.2f}ms {avg_time:>8.2f}ms {max_time:>8.2f}ms {count:>5}"
 
-            # Return the address of the replier and the total ping time.
-            return addr, total_ping_time
-        except socket.timeout:
-            # If no reply is received within the timeout period, return None for the ping time.
-            return None, None
+    # If no valid responses, return a row of asterisks and zero count.
+    return f"{ttl:>3} {'*':<15} {'*':>8}   {'*':>8}   {'*':>8}   {0:>5}"
 
 
-def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: bool = False) -> str:
+def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: bool = False,
+               parallel: bool = False, window: int | None = None, timeout: int = 1) -> str:
     """
     Perform a traceroute to the specified host, with multiple pings per hop.
 
@@ -179,12 +159,18 @@ def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: b
     max_hops (int): Maximum number of hops to try before stopping.
     pings_per_hop (int): Number of pings to perform at each hop.
     verbose (bool): If True, print additional details during execution.
+    parallel (bool): If True, probe all TTLs at once instead of one hop at a time.
+    window (int | None): In parallel mode, the maximum number of probes in flight. Default is all of them.
+    timeout (int): The time in seconds to wait for each probe's reply.
 
     Returns:
     str: The results of the traceroute, including statistics for each hop.
     """
+    if parallel:
+        return _traceroute_parallel(host, max_hops, pings_per_hop, verbose, window, timeout)
+
     # Header row for the results. Each column is formatted for alignment and width.
-    results = [f"{'Hop':>3} {'Address':<15} {'Min (ms)':>8}   {'Avg (ms)':>8}   {'Max (ms)':>8}   {'Count':>5}"]
+    results = [traceroute_header]
 
     # Loop through each TTL (Time-To-Live) value from 1 to max_hops.
     for ttl in range(1, max_hops + 1):
@@ -199,24 +185,14 @@ def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: b
         for _ in range(pings_per_hop):
             # Ping the host with the current TTL and sequence number.
             # The sequence number is incremented with TTL for each ping.
-            addr, response = ping(host, ttl=ttl, sequence_number=ttl)
+            addr, response = ping(host, ttl=ttl, timeout=timeout, sequence_number=ttl)
 
             # If a response is received (not None), append it to ping_times.
             if response is not None:
                 ping_times.append(response)
 
-        # If there are valid ping responses, calculate and format the statistics.
-        if ping_times:
-            min_time = min(ping_times)  # Minimum ping time.
-            avg_time = sum(ping_times) / len(ping_times)  # Average ping time.
-            max_time = max(ping_times)  # Maximum ping time.
-            count = len(ping_times)  # Count of successful pings.
-
-            # Append the formatted results for this TTL to the results list.
-            results.append(f"{ttl:>3} {addr[0] if addr else '*':<15} {min_time:>8.2f}ms {avg_time:>8.2f}ms {max_time:>8.2f}ms {count:>5}")
-        else:
-            # If no valid responses, append a row of asterisks and zero count.
-            results.append(f"{ttl:>3} {'*':<15} {'*':>8}   {'*':>8}   {'*':>8}   {0:>5}")
+        # Append the formatted results for this TTL to the results list.
+        results.append(format_hop(ttl, addr, ping_times))
 
         # Print the last entry in the results if verbose mode is enabled.
         if verbose and results:
@@ -230,21 +206,108 @@ def traceroute(host: str, max_hops: int = 30, pings_per_hop: int = 1, verbose: b
     return '\n'.join(results)
 
 
-def check_server_http(url: str) -> Tuple[bool, Optional[int]]:
+def _traceroute_parallel(host: str, max_hops: int, pings_per_hop: int, verbose: bool,
+                         window: int | None, timeout: int) -> str:
+    """
+    Traceroute that sends probes for many TTLs at once and builds the hop table from replies as they arrive.
+
+    Args:
+    host (str): The IP address or hostname of the target host.
+    max_hops (int): Maximum number of hops to try.
+    pings_per_hop (int): Number of pings to perform at each hop.
+    verbose (bool): If True, print additional details during execution.
+    window (int | None): Maximum number of probes in flight. None sends every probe at once.
+    timeout (int): The time in seconds to wait for each probe's reply.
+
+    Returns:
+    str: The results of the traceroute, in the same format as traceroute().
+    """
+    engine = get_engine()
+    address = resolve_ipv4(host)
+
+    # Probes still to send, ordered by TTL so a window fills the nearest hops first.
+    pending = [ttl for ttl in range(1, max_hops + 1) for _ in range(pings_per_hop)]
+    pending.reverse()
+    window = window or len(pending)
+
+    hops = {ttl: (None, []) for ttl in range(1, max_hops + 1)}
+    in_flight = {}          # future -> (engine key, ttl, deadline)
+    last_hop = max_hops     # lowest TTL at which the target itself answered
+
+    while pending or in_flight:
+        # Fill the window, skipping TTLs beyond the target.
+        while pending and len(in_flight) < window:
+            ttl = pending.pop()
+            if ttl > last_hop:
+                continue
+            if verbose:
+                print(f"pinging {host} with ttl: {ttl}")
+            key, future = engine.send(address, ttl, ttl)
+            in_flight[future] = (key, ttl, time.monotonic() + timeout)
+        if not in_flight:
+            break
+
+        # Wait for the next reply or the earliest probe timeout.
+        next_deadline = min(deadline for _, _, deadline in in_flight.values())
+        done, _ = futures_wait(in_flight, timeout=max(0, next_deadline - time.monotonic()),
+                               return_when=FIRST_COMPLETED)
+
+        for future in done:
+            _, ttl, _ = in_flight.pop(future)
+            addr, response, _ = future.result()
+            hops[ttl][1].append(response)
+            hops[ttl] = (addr, hops[ttl][1])
+            if addr[0] == address:
+                last_hop = min(last_hop, ttl)
+
+        # Give up on probes whose timeout has passed.
+        now = time.monotonic()
+        for future, (key, ttl, deadline) in list(in_flight.items()):
+            if deadline <= now or ttl > last_hop:
+                engine.cancel(key)
+                del in_flight[future]
+
+    results = [traceroute_header]
+    for ttl in range(1, last_hop + 1):
+        results.append(format_hop(ttl, *hops[ttl]))
+        if verbose:
+            print(f"\tResult: {results[-1]}")
+    return '\n'.join(results)
+
+
+def http_get(url: str, timeout: int = 5, connection: str = "warm") -> requests.Response:
+    """
+    Make a GET request for an HTTP or HTTPS check.
+
+    :param url:         URL of the server (including scheme)
+    :param timeout:     Timeout for the request in seconds
+    :param connection:  "warm" reuses a pooled keep-alive connection to the host,
+                        "cold" opens (and closes) a fresh connection so handshakes are measured
+    :return:            the server's response
+    """
+    if connection == "cold":
+        with new_session() as session:
+            return session.get(url, headers={'Connection': 'close'}, timeout=timeout)
+    return session_pool.get(url).get(url, timeout=timeout)
+
+
+def check_server_http(url: str, timeout: int = 5, connection: str = "warm") -> Tuple[bool, Optional[int], Optional[float]]:
     """
     Check if an HTTP server is up by making a request to the provided URL.
 
     This function attempts to connect to a web server using the specified URL.
     It returns a tuple containing a boolean indicating whether the server is up,
-    and the HTTP status code returned by the server.
+    the HTTP status code returned by the server, and the response time.
 
     :param url: URL of the server (including http://)
-    :return: Tuple (True/False, status code)
+    :param timeout: Timeout for the request in seconds. Default is 5 seconds.
+    :param connection: "warm" to reuse pooled connections, "cold" for a fresh connection per check.
+    :return: Tuple (True/False, status code, response time in ms)
              True if server is up (status code < 400), False otherwise
     """
     try:
         # Making a GET request to the server
-        response: requests.Response = requests.get(url)
+        response: requests.Response = http_get(url, timeout, connection)
 
         # The HTTP status code is a number that indicates the outcome of the request.
         # Here, we consider status codes less than 400 as successful,
@@ -252,9 +315,9 @@ def check_server_http(url: str) -> Tuple[bool, Optional[int]]:
         # Common successful status codes are 200 (OK), 301 (Moved Permanently), etc.
         is_up: bool = response.status_code < 400
 
-        # Returning a tuple: (True/False, status code)
+        # Returning a tuple: (True/False, status code, response time)
         # True if the server is up, False if an exception occurs (see except block)
-        return is_up, response.status_code
+        return is_up, response.status_code, response.elapsed.total_seconds() * 1000
 
     except requests.RequestException:
         # This block catches any exception that might occur during the request.
@@ -262,145 +325,164 @@ def check_server_http(url: str) -> Tuple[bool, Optional[int]]:
         # If an exception occurs, we assume the server is down.
         # Returning False for the status, and None for the status code,
         # as we couldn't successfully connect to the server to get a status code.
-        return False, None
+        return False, None, None
 
 
-def check_server_https(url: str, timeout: int = 5) -> Tuple[bool, Optional[int], str]:
+def check_server_https(url: str, timeout: int = 5, connection: str = "warm") -> Tuple[bool, Optional[int], str, Optional[float]]:
     """
     Check if an HTTPS server is up by making a request to the provided URL.
 
     This function attempts to connect to a web server using the specified URL with HTTPS.
     It returns a tuple containing a boolean indicating whether the server is up,
-    the HTTP status code returned by the server, and a descriptive message.
+    the HTTP status code returned by the server, a descriptive message, and the response time.
 
     :param url: URL of the server (including https://)
     :param timeout: Timeout for the request in seconds. Default is 5 seconds.
-    :return: Tuple (True/False for server status, status code, description)
+    :param connection: "warm" to reuse pooled connections, "cold" for a fresh connection (and TLS handshake) per check.
+    :return: Tuple (True/False for server status, status code, description, response time in ms)
     """
     try:
-        # Setting custom headers for the request. Here, 'User-Agent' is set to mimic a web browser.
-        headers: dict = {'User-Agent': 'Mozilla/5.0'}
-
         # Making a GET request to the server with the specified URL and timeout.
         # The timeout ensures that the request does not hang indefinitely.
-        response: requests.Response = requests.get(url, headers=headers, timeout=timeout)
+        response: requests.Response = http_get(url, timeout, connection)
 
         # Checking if the status code is less than 400. Status codes in the 200-399 range generally indicate success.
         is_up: bool = response.status_code < 400
 
-        # Returning a tuple: (server status, status code, descriptive message)
-        return is_up, response.status_code, "Server is up"
+        # Returning a tuple: (server status, status code, descriptive message, response time)
+        return is_up, response.status_code, "Server is up", response.elapsed.total_seconds() * 1000
 
     except requests.ConnectionError:
         # This exception is raised for network-related errors, like DNS failure or refused connection.
-        return False, None, "Connection error"
+        return False, None, "Connection error", None
 
     except requests.Timeout:
         # This exception is raised if the server does not send any data in the allotted time (specified by timeout).
-        return False, None, "Timeout occurred"
+        return False, None, "Timeout occurred", None
 
     except requests.RequestException as e:
         # A catch-all exception for any error not covered by the specific exceptions above.
         # 'e' contains the details of the exception.
-        return False, None, f"Error during request: {e}"
+        return False, None, f"Error during request: {e}", None
 
 
-def check_ntp_server(server: str) -> Tuple[bool, Optional[str]]:
+def check_ntp_server(servers: str | list, port: int = 123, samples: int = ntp_client.default_samples,
+                     timeout: float = ntp_client.default_timeout) -> Tuple[bool, Optional[Any], list]:
     """
-    Checks if an NTP server is up and returns its status and time.
+    Checks if NTP servers are up and measures the local clock's offset from them.
+
+    Every server is queried concurrently from one socket, several times each, and the sample with
+    the lowest round trip delay is kept per server.
 
     Args:
-    server (str): The hostname or IP address of the NTP server to check.
+    servers (str | list): Hostname or IP address of the NTP server to check, or a list of them.
+    port (int): The UDP port of the NTP servers.
+    samples (int): Number of requests sent to each server.
+    timeout (float): Seconds allowed for all samples.
 
     Returns:
-    Tuple[bool, Optional[str]]: A tuple containing a boolean indicating the server status
-                                 (True if up, False if down) and the current time as a string
-                                 if the server is up, or None if it's down.
+    Tuple[bool, Optional[NTPServerResult], list]: A tuple containing a boolean indicating whether any server
+                                                   answered usably, the server with the smallest synchronization
+                                                   distance (None if none answered), and every server's result.
     """
-    # Create an NTP client instance
-    client = ntplib.NTPClient()
+    results = ntp_client.query_servers_sync(_as_list(servers), port, samples, timeout)
+    selected = ntp_client.select_server(results)
+    return selected is not None, selected, results
 
-    try:
-        # Request time from the NTP server
-        # 'version=3' specifies the NTP version to use for the request
-        response = client.request(server, version=3)
 
-        # If request is successful, return True and the server time
-        # 'ctime' converts the time in seconds since the epoch to a readable format
-        return True, ctime(response.tx_time)
-    except (ntplib.NTPException, gaierror):
-        # If an exception occurs (server is down or unreachable), return False and None
-        return False, None
+async def check_ntp_server_async(servers: str | list, port: int = 123, samples: int = ntp_client.default_samples,
+                                 timeout: float = ntp_client.default_timeout) -> Tuple[bool, Optional[Any], list]:
+    """
+    Coroutine version of check_ntp_server() for use on an asyncio event loop.
+
+    Returns:
+    Same as check_ntp_server().
+    """
+    results = await ntp_client.query_servers(_as_list(servers), port, samples, timeout)
+    selected = ntp_client.select_server(results)
+    return selected is not None, selected, results
 
 
-def check_dns_server_status(server, query, record_type) -> (bool, str):
+def _as_list(servers: str | list) -> list:
+    return [servers] if isinstance(servers, str) else list(servers)
+
+
+def check_dns_server_status(server, query, record_type, port=53) -> (bool, str, Optional[float], Optional[float]):
     """
     Check if a DNS server is up and return the DNS query results for a specified domain and record type.
 
+    The resolver for each server is reused between checks (see dns_resolvers.ResolverCache), so only the
+    first check, or one after the server's address expires, pays for resolver setup.
+
     :param server: DNS server name or IP address
     :param query: Domain name to query
     :param record_type: Type of DNS record (e.g., 'A', 'AAAA', 'MX', 'CNAME')
-    :return: Tuple (status, query_results)
+    :param port: DNS server port
+    :return: Tuple (status, query_results, query time in ms, setup time in ms)
     """
     try:
-        # Set the DNS resolver to use the specified server
-        resolver = dns.resolver.Resolver()
-        resolver.nameservers = [socket.gethostbyname(server)]
+        # Get the DNS resolver for the specified server
+        start = time.perf_counter()
+        resolver = resolver_cache.get(server, port)
+        setup_time = (time.perf_counter() - start) * 1000
 
         # Perform a DNS query for the specified domain and record type
+        start = time.perf_counter()
         query_results = resolver.resolve(query, record_type)
+        query_time = (time.perf_counter() - start) * 1000
         results = [str(rdata) for rdata in query_results]
 
-        return True, results
+        # Prefer the response time measured by dnspython around the network exchange itself
+        response_time = getattr(query_results.response, "time", None)
+        if response_time is not None:
+            query_time = response_time * 1000
+
+        return True, results, query_time, setup_time
 
     except (dns.exception.Timeout, dns.resolver.NoNameservers, dns.resolver.NoAnswer, socket.gaierror) as e:
         # Return False if there's an exception (server down, query failed, or record type not found)
-        return False, str(e)
+        return False, str(e), None, None
 
 
-def check_tcp_port(ip_address: str, port: int) -> (bool, str):
+def check_tcp_port(ip_address: str, port: int, timeout: int = 3) -> (bool, str, Optional[float]):
     """
     Checks the status of a specific TCP port on a given IP address.
 
     Args:
     ip_address (str): The IP address of the target server.
     port (int): The TCP port number to check.
+    timeout (int): The timeout duration in seconds for the connection attempt. Default is 3 seconds.
 
     Returns:
-    tuple: A tuple containing a boolean and a string.
+    tuple: A tuple containing a boolean, a string and the connect latency.
            The boolean is True if the port is open, False otherwise.
            The string provides a description of the port status.
+           The latency is the handshake round-trip time in milliseconds, or None if the port is not open.
 
     Description:
     This function attempts to establish a TCP connection to the specified port on the given IP address.
     If the connection is successful, it means the port is open; otherwise, the port is considered closed or unreachable.
+    The connection is made by the batch prober (see tcp_probe.probe_tcp_ports), so use that directly to check many ports.
     """
+    return probe_tcp_ports_sync([(ip_address, port)], timeout)[0][2:]
 
-    try:
-        # Create a socket object using the AF_INET address family (IPv4) and SOCK_STREAM socket type (TCP).
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            # Set a timeout for the socket to avoid waiting indefinitely. Here, 3 seconds is used as a reasonable timeout duration.
-            s.settimeout(3)
-
-            # Attempt to connect to the specified IP address and port.
-            # If the connection is successful, the port is open.
-            s.connect((ip_address, port))
-            return True, f"Port {port} on {ip_address} is open."
 
-    except socket.timeout:
-        # If a timeout occurs, it means the connection attempt took too long, implying the port might be filtered or the server is slow to respond.
-        return False, f"Port {port} on {ip_address} timed out."
+async def check_tcp_port_async(ip_address: str, port: int, timeout: int = 3) -> (bool, str, Optional[float]):
+    """
+    Coroutine version of check_tcp_port() for use on an asyncio event loop.
 
-    except socket.error:
-        # If a socket error occurs, it generally means the port is closed or not reachable.
-        return False, f"Port {port} on {ip_address} is closed or not reachable."
+    Args:
+    ip_address (str): The IP address of the target server.
+    port (int): The TCP port number to check.
+    timeout (int): The timeout duration in seconds for the connection attempt. Default is 3 seconds.
 
-    except Exception as e:
-        # Catch any other exceptions and return a general failure message along with the exception raised.
-        return False, f"Failed to check port {port} on {ip_address} due to an error: {e}"
+    Returns:
+    tuple: Same as check_tcp_port().
+    """
+    return (await probe_tcp_ports([(ip_address, port)], timeout))[0][2:]
 
 
-def check_udp_port(ip_address: str, port: int, timeout: int = 3) -> (bool, str):
+def check_udp_port(ip_address: str, port: int, timeout: int = 3) -> (bool, str, Optional[float]):
     """
     Checks the status of a specific UDP port on a given IP address.
 
@@ -410,69 +492,82 @@ def check_udp_port(ip_address: str, port: int, timeout: int = 3) -> (bool, str):
     timeout (int): The timeout duration in seconds for the socket operation. Default is 3 seconds.
 
     Returns:
-    tuple: A tuple containing a boolean and a string.
+    tuple: A tuple containing a boolean, a string and the response latency.
            The boolean is True if the port is open (or if the status is uncertain), False if the port is definitely closed.
            The string provides a description of the port status.
+           The latency is the round-trip time in milliseconds of the reply or ICMP error, otherwise None.
 
     Description:
-    This function attempts to send a UDP packet to the specified port on the given IP address.
-    Since UDP is a connectionless protocol, the function can't definitively determine if the port is open.
-    It can only confirm if the port is closed, typically indicated by an ICMP 'Destination Unreachable' response.
+    This function sends a UDP probe to the specified port on the given IP address, using a payload the service
+    on well-known ports answers (see udp_probe.udp_payloads). A reply means the port is open, and an ICMP
+    'Destination Unreachable' error, matched to the probe as soon as it arrives, means it is closed.
+    Only silence waits for the full timeout, as the port may be open or filtered.
     """
+    return _udp_port_status(probe_udp_ports_sync([(ip_address, port)], timeout)[0])
 
-    try:
-        # Create a socket object using the AF_INET address family (IPv4) and SOCK_DGRAM socket type (UDP).
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            # Set a timeout for the socket to avoid waiting indefinitely.
-            s.settimeout(timeout)
 
-            # Send a dummy packet to the specified IP address and port.
-            # As UDP is connectionless, this does not establish a connection but merely sends the packet.
-            s.sendto(b'', (ip_address, port))
+async def check_udp_port_async(ip_address: str, port: int, timeout: int = 3) -> (bool, str, Optional[float]):
+    """
+    Coroutine version of check_udp_port() for use on an asyncio event loop.
+
+    Args:
+    ip_address (str): The IP address of the target server.
+    port (int): The UDP port number to check.
+    timeout (int): The timeout duration in seconds for the socket operation. Default is 3 seconds.
 
-            try:
-                # Try to receive data from the socket.
-                # If an ICMP 'Destination Unreachable' message is received, the port is considered closed.
-                s.recvfrom(1024)
-                return False, f"Port {port} on {ip_address} is closed."
+    Returns:
+    tuple: Same as check_udp_port().
+    """
+    return _udp_port_status((await probe_udp_ports([(ip_address, port)], timeout))[0])
 
-            except socket.timeout:
-                # If a timeout occurs, it's uncertain whether the port is open or closed, as no response is received.
-                return True, f"Port {port} on {ip_address} may be open, but no response received."
 
-    except Exception as e:
-        # Catch any other exceptions and return a general failure message along with the exception raised.
-        return False, f"Failed to check UDP port {port} on {ip_address} due to an error: {e}"
+def _udp_port_status(response: tuple) -> (bool, str, Optional[float]):
+    """Convert a udp_probe result to check_udp_port() output"""
+    _, _, state, description, rtt = response
+    return state in (udp_probe.OPEN, udp_probe.NO_RESPONSE), description, rtt
 
 
-def check_echo_server(host: str, port: int) -> bool:
+def check_echo_server(host: str, port: int, timeout: int = 3, probes: int = 1,
+                      payload_size: int = echo_probe.default_payload_size) -> (bool, str, Optional[float]):
     """
     Checks status of echo server at specified hostname or IP address and port
 
-    :param host:    hostname or IP address of server
-    :param port:    server's port number
+    :param host:            hostname or IP address of server
+    :param port:            server's port number
+    :param timeout:         seconds to wait for connection and each echo
+    :param probes:          sequence-numbered probes pipelined over the connection
+    :param payload_size:    bytes of payload per probe
 
-    :returns:       True if server successfully echoes message, else False
+    :returns:       True if server echoes every probe byte-exact, else False; description; average echo RTT in ms
     """
-    # Set up  socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
     try:
-        # Connect to server socket
-        sock.connect((host, port))
+        # Connection is closed on return, whatever the outcome
+        with echo_probe.open_connection(host, port, timeout) as sock:
+            return _echo_status(echo_probe.echo_burst(sock, 0, probes, payload_size))
+
+    except Exception as e:
+        return False, f"Could not connect to server at {host}:{port} due to error: {e}.", None
+
 
-        # Until user enters stop, send any input to server and print its response
-        msg = "test"
-        sock.sendall(msg.encode())
-        if sock.recv(1024).decode() != "test":
-            return False, "Server connected but did not successfully echo."
-        return True, "Server successfully echoed sent message."
+async def check_echo_server_async(host: str, port: int, timeout: int = 3, probes: int = 1,
+                                  payload_size: int = echo_probe.default_payload_size) -> (bool, str, Optional[float]):
+    """
+    Coroutine version of check_echo_server() for use on an asyncio event loop.
+
+    :returns:       same as check_echo_server()
+    """
+    try:
+        with await echo_probe.open_connection_async(host, port, timeout) as sock:
+            return _echo_status(await asyncio.wait_for(echo_probe.echo_burst_async(sock, 0, probes, payload_size), timeout))
 
     except Exception as e:
-        return False, f"Could not connect to server at {host}:{port} due to error: {e}."
+        return False, f"Could not connect to server at {host}:{port} due to error: {e}.", None
 
-    finally:
-        sock.close
+
+def _echo_status(response: tuple) -> (bool, str, Optional[float]):
+    """Convert an echo_probe burst result to check_echo_server() output"""
+    ok, description, rtts = response
+    return ok, description, echo_probe.rtt_summary(rtts)["avg"] if ok else None
 
 
 def main():
@@ -490,18 +585,18 @@ def main():
     # HTTP/HTTPS Usage Examples
     print("\nHTTP/HTTPS Examples:")
     http_url = "http://example.com"
-    http_server_status, http_server_response_code = check_server_http(http_url)
+    http_server_status, http_server_response_code, _ = check_server_http(http_url)
     print(f"HTTP URL: {http_url}, HTTP server status: {http_server_status}, Status Code: {http_server_response_code if http_server_response_code is not None else 'N/A'}")
 
     https_url = "https://example.com"
-    https_server_status, https_server_response_code, description = check_server_https(https_url)
+    https_server_status, https_server_response_code, description, _ = check_server_https(https_url)
     print(f"HTTPS URL: {https_url}, HTTPS server status: {https_server_status}, Status Code: {https_server_response_code if https_server_response_code is not None else 'N/A'}, Description: {description}")
 
     # NTP Usage Example
     print("\nNTP Example:")
     ntp_server = 'pool.ntp.org'  # Replace with your NTP server
-    ntp_server_status, ntp_server_time = check_ntp_server(ntp_server)
-    print(f"{ntp_server} is up. Time: {ntp_server_time}" if ntp_server_status else f"{ntp_server} is down.")
+    ntp_server_status, ntp_selected, _ = check_ntp_server(ntp_server)
+    print(ntp_selected.describe() if ntp_server_status else f"{ntp_server} is down.")
 
     # DNS Usage Examples
     print("\nDNS Examples:")
@@ -516,7 +611,7 @@ def main():
     ]
 
     for dns_query, dns_record_type in dns_queries:
-        dns_server_status, dns_query_results = check_dns_server_status(dns_server, dns_query, dns_record_type)
+        dns_server_status, dns_query_results, _, _ = check_dns_server_status(dns_server, dns_query, dns_record_type)
         print(f"DNS Server: {dns_server}, Status: {dns_server_status}, {dns_record_type} Records Results: {dns_query_results}")
 
 
@@ -524,14 +619,14 @@ def main():
     print("\nTCP Port Example:")
     tcp_port_server = "google.com"
     tcp_port_number = 80
-    tcp_port_status, tcp_port_description = check_tcp_port(tcp_port_server, tcp_port_number)
+    tcp_port_status, tcp_port_description, _ = check_tcp_port(tcp_port_server, tcp_port_number)
     print(f"Server: {tcp_port_server}, TCP Port: {tcp_port_number}, TCP Port Status: {tcp_port_status}, Description: {tcp_port_description}")
 
     # UDP Port Usage Example
     print("\nUDP Port Example:")
     udp_port_server = "8.8.8.8"
     udp_port_number = 53
-    udp_port_status, udp_port_description = check_udp_port(udp_port_server, udp_port_number)
+    udp_port_status, udp_port_description, _ = check_udp_port(udp_port_server, udp_port_number)
     print(f"Server: {udp_port_server}, UDP Port: {udp_port_number}, UDP Port Status: {udp_port_status}, Description: {udp_port_description}")
 
 
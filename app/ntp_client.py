@@ -0,0 +1,226 @@
+import asyncio
+import os
+import socket
+import struct
+import time
+from tcp_probe import run_blocking
+from timing import enable_rx_timestamps, kernel_timestamp_ns, timespec_size, wait_readable
+
+ntp_port = 123
+default_samples = 4             # requests sent to each server per check
+default_timeout = 2             # seconds allowed for every sample of a check
+ntp_epoch_offset = 2208988800   # seconds between 1900-01-01 and 1970-01-01
+ntp_packet = struct.Struct('!BBBbII4sQQQQ')     # header, root delay/dispersion, refid, ref/orig/rx/tx timestamps
+recv_size = 1024
+ancillary_size = socket.CMSG_SPACE(timespec_size)
+client_header = 0x23            # leap indicator 0, version 4, mode 3 (client)
+server_modes = (4, 5)           # server, broadcast
+leap_unsynchronized = 3
+
+
+def to_ntp(ns: int) -> int:
+    """Convert nanoseconds since the Unix epoch to a 64-bit NTP timestamp"""
+    return ((ns + ntp_epoch_offset * 1_000_000_000) << 32) // 1_000_000_000
+
+
+def from_ntp(timestamp: int) -> int:
+    """Convert a 64-bit NTP timestamp to nanoseconds since the Unix epoch"""
+    return (timestamp * 1_000_000_000 >> 32) - ntp_epoch_offset * 1_000_000_000
+
+
+def from_short(value: int) -> float:
+    """Convert an NTP short format (16.16 fixed point seconds) value to milliseconds"""
+    return value / 65536 * 1000
+
+
+class NTPSample:
+    """One request/response exchange with an NTP server, times in milliseconds"""
+    __slots__ = ("offset", "delay", "stratum", "root_delay", "root_dispersion", "refid", "leap")
+
+    def __init__(self, t1: int, t2: int, t3: int, t4: int, stratum: int, root_delay: float,
+                 root_dispersion: float, refid: str, leap: int):
+        """
+        :param t1:  client transmit time, ns since the Unix epoch
+        :param t2:  server receive time
+        :param t3:  server transmit time
+        :param t4:  client receive time
+        """
+        self.offset = ((t2 - t1) + (t3 - t4)) / 2_000_000
+        self.delay = max(0, (t4 - t1) - (t3 - t2)) / 1_000_000
+        self.stratum = stratum
+        self.root_delay = root_delay
+        self.root_dispersion = root_dispersion
+        self.refid = refid
+        self.leap = leap
+
+    def distance(self) -> float:
+        """Root synchronization distance in ms, the error bound NTP uses to choose between servers"""
+        return (self.root_delay + self.delay) / 2 + self.root_dispersion
+
+
+class NTPServerResult:
+    """Samples collected from one server and the one selected by the clock filter"""
+    __slots__ = ("server", "address", "samples", "sent", "error")
+
+    def __init__(self, server: str):
+        self.server = server
+        self.address = None
+        self.samples = []
+        self.sent = 0
+        self.error = None      # why the server gave no usable sample, if it did not
+
+    @property
+    def best(self) -> NTPSample | None:
+        """Sample with the lowest round trip delay, as in NTP's clock filter"""
+        return min(self.samples, key=lambda sample: sample.delay, default=None)
+
+    @property
+    def jitter(self) -> float:
+        """RMS difference between every sample's offset and the selected sample's, in ms"""
+        best = self.best
+        if best is None or len(self.samples) < 2:
+            return 0.0
+        return (sum((s.offset - best.offset) ** 2 for s in self.samples) / (len(self.samples) - 1)) ** 0.5
+
+    def describe(self) -> str:
+        best = self.best
+        if best is None:
+            return f"{self.server}: {self.error or 'no response'}"
+        return (f"{self.server}: offset {best.offset:+.3f}ms delay {best.delay:.3f}ms stratum {best.stratum} "
+                f"dispersion {best.root_dispersion:.3f}ms jitter {self.jitter:.3f}ms "
+                f"({len(self.samples)}/{self.sent} samples)")
+
+
+def select_server(results: list) -> NTPServerResult | None:
+    """Return the server whose selected sample has the smallest synchronization distance"""
+    usable = [result for result in results if result.best is not None]
+    return min(usable, key=lambda result: result.best.distance(), default=None)
+
+
+def _request(transmit: int) -> bytes:
+    """Build a client request carrying transmit, which the server echoes as its originate timestamp"""
+    return ntp_packet.pack(client_header, 0, 0, 0, 0, 0, bytes(4), 0, 0, 0, transmit)
+
+
+def _parse(data: bytes, t1: int, t4: int) -> NTPSample | str:
+    """Return sample from a server response, or why the response cannot be used"""
+    header, stratum, _, _, root_delay, root_dispersion, refid, _, _, receive, transmit = ntp_packet.unpack_from(data)
+    leap, mode = header >> 6, header & 0x7
+    if mode not in server_modes:
+        return f"unexpected mode {mode}"
+    if stratum == 0:
+        # Kiss-o'-Death: the reference id carries an ASCII code such as RATE or DENY
+        return f"kiss-o'-death {refid.decode('ascii', 'replace').strip(chr(0))}"
+    if leap == leap_unsynchronized or not transmit:
+        return "server clock is not synchronized"
+    refid = refid.decode('ascii', 'replace').strip(chr(0)) if stratum == 1 else socket.inet_ntoa(refid)
+    return NTPSample(t1, from_ntp(receive), from_ntp(transmit), t4, stratum, from_short(root_delay),
+                     from_short(root_dispersion), refid, leap)
+
+
+async def _resolve(loop, result: NTPServerResult, port: int) -> None:
+    try:
+        info = await loop.getaddrinfo(result.server, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        result.address = info[0][4]
+    except OSError as e:
+        result.error = f"could not resolve: {e}"
+
+
+async def query_servers(servers: list, port: int = ntp_port, samples: int = default_samples,
+                        timeout: float = default_timeout) -> list:
+    """
+    Query several NTP servers concurrently from one UDP socket.
+
+    Every server is sent its first request at once, and its next request as soon as the previous
+    one is answered or given up on, so checking many servers takes about as long as checking the
+    slowest one. Responses are matched to requests by the originate timestamp the server echoes,
+    and receive times come from kernel timestamps where available.
+
+    :param servers: hostnames or IP addresses of the servers
+    :param port:    UDP port of the servers
+    :param samples: requests sent to each server
+    :param timeout: seconds allowed for all samples
+    :returns:       NTPServerResult per server, in server order
+    """
+    loop = asyncio.get_running_loop()
+    results = [NTPServerResult(server) for server in servers]
+    await asyncio.gather(*(_resolve(loop, result, port) for result in results))
+    sample_timeout = timeout / samples
+
+    outstanding = {}    # transmit timestamp -> (result, send time in ns since the epoch, give up at loop time)
+
+    def send(result: NTPServerResult) -> None:
+        t1 = time.time_ns()
+        # The low bits are below the clock's resolution, randomise them so requests cannot be spoofed
+        transmit = to_ntp(t1) ^ int.from_bytes(os.urandom(2), "big")
+        try:
+            sock.sendto(_request(transmit), result.address)
+        except OSError as e:
+            result.error = str(e)
+            return
+        result.sent += 1
+        outstanding[transmit] = (result, t1, loop.time() + sample_timeout)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        enable_rx_timestamps(sock)
+        for result in results:
+            if result.address is not None:
+                send(result)
+
+        deadline = loop.time() + timeout
+        while outstanding:
+            now = loop.time()
+            # Give up on unanswered requests, moving on to the server's next sample
+            for transmit, (result, _, give_up) in list(outstanding.items()):
+                if give_up <= now:
+                    del outstanding[transmit]
+                    if result.sent < samples and now < deadline:
+                        send(result)
+            if not outstanding:
+                break
+            wait = min(give_up for _, _, give_up in outstanding.values()) - now
+            try:
+                await asyncio.wait_for(wait_readable(sock), max(wait, 0))
+            except asyncio.TimeoutError:
+                continue
+
+            while True:
+                try:
+                    data, ancdata, _, address = sock.recvmsg(recv_size, ancillary_size)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    # ICMP error from a server, its request times out
+                    continue
+                if len(data) < ntp_packet.size:
+                    continue
+                t4 = kernel_timestamp_ns(ancdata) or time.time_ns()
+                originate = ntp_packet.unpack_from(data)[8]
+                pending = outstanding.get(originate)
+                if pending is None or pending[0].address != address[:2]:
+                    # Late reply to a request already given up on, or not from the server asked
+                    continue
+                del outstanding[originate]
+                result, t1, _ = pending
+                sample = _parse(data, t1, t4)
+                if isinstance(sample, NTPSample):
+                    result.samples.append(sample)
+                else:
+                    result.error = sample
+                    # Kiss-o'-Death asks clients to stop querying
+                    if sample.startswith("kiss"):
+                        result.sent = samples
+                if result.sent < samples and loop.time() < deadline:
+                    send(result)
+    return results
+
+
+def query_servers_sync(servers: list, port: int = ntp_port, samples: int = default_samples,
+                       timeout: float = default_timeout) -> list:
+    """
+    Blocking version of query_servers() for callers without an event loop.
+
+    :returns:   same as query_servers()
+    """
+    return run_blocking(query_servers(servers, port, samples, timeout))
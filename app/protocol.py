@@ -0,0 +1,275 @@
+import json
+import struct
+import zlib
+from collections import namedtuple
+
+# Frame header:
+#   2s  magic
+#   B   protocol version
+#   B   message type
+#   B   flags
+#   x   reserved
+#   I   sequence number
+#   I   payload length
+header_format = '!2sBBBxII'
+header_size = struct.calcsize(header_format)
+magic = b'NM'
+version = 1
+max_payload_size = 64 * 1024 * 1024
+
+# Message types
+CONFIG = 1          # manager -> monitor: checks dictionary
+STATUS = 2          # monitor -> manager: status message, e.g. configuration received
+RESULT = 3          # monitor -> manager: check result
+BATCH = 4           # monitor -> manager: list of check results
+STATS = 5           # monitor -> manager: self-instrumentation snapshot
+CONFIG_DELTA = 6    # manager -> monitor: checks to add, modify and remove by id
+
+# Flags
+FLAG_BINARY = 0x01      # payload uses the compact binary encoding instead of JSON
+FLAG_COMPRESSED = 0x02  # payload is zlib compressed
+compression_level = 1
+
+Message = namedtuple("Message", ["type", "sequence", "body"])
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends data that is not a valid frame"""
+
+
+class FrameEncoder:
+    """Encodes messages into length-prefixed frames with increasing sequence numbers"""
+
+    def __init__(self, binary: bool = False):
+        """
+        :param binary:  use the compact binary encoding instead of JSON
+        """
+        self.binary = binary
+        self._sequence = 0
+
+    def encode(self, msg_type: int, body, compress: bool = False) -> bytes:
+        """
+        Encode one message.
+
+        :param msg_type:    message type
+        :param body:        JSON-compatible message body
+        :param compress:    zlib compress the payload
+        :returns:           complete frame
+        """
+        return self._frame(msg_type, self.pack(body), compress)
+
+    def pack(self, body) -> bytes:
+        """
+        Encode a message body without framing, e.g. to collect it into a batch.
+
+        :param body:    JSON-compatible message body
+        :returns:       encoded body
+        """
+        if self.binary:
+            return pack_binary(body)
+        return json.dumps(body, separators=(',', ':')).encode()
+
+    def encode_batch(self, items: list, compress: bool = False) -> bytes:
+        """
+        Encode bodies already encoded with pack() as a single BATCH message.
+
+        :param items:       list of encoded bodies
+        :param compress:    zlib compress the payload
+        :returns:           complete frame
+        """
+        if self.binary:
+            header = bytearray([_LIST])
+            _pack_varint(header, len(items))
+            payload = bytes(header) + b''.join(items)
+        else:
+            payload = b'[' + b','.join(items) + b']'
+        return self._frame(BATCH, payload, compress)
+
+    def _frame(self, msg_type: int, payload: bytes, compress: bool) -> bytes:
+        flags = FLAG_BINARY if self.binary else 0
+        if compress:
+            payload = zlib.compress(payload, compression_level)
+            flags |= FLAG_COMPRESSED
+        self._sequence = (self._sequence + 1) & 0xffffffff
+        return struct.pack(header_format, magic, version, msg_type, flags, self._sequence, len(payload)) + payload
+
+
+class FrameDecoder:
+    """
+    Streaming frame decoder.
+
+    Bytes are fed in as they arrive from the socket; complete frames are returned regardless
+    of how they were split or coalesced into TCP segments.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.binary = False         # encoding of the last decoded frame
+        self.compressed = False     # compression of the last decoded frame
+
+    def feed(self, data: bytes) -> list:
+        """
+        Add received bytes and decode every complete frame.
+
+        :param data:    bytes received from the socket
+        :returns:       list of Message tuples
+        """
+        self._buffer += data
+        messages = []
+        offset = 0
+        while len(self._buffer) - offset >= header_size:
+            frame_magic, frame_version, msg_type, flags, sequence, length = struct.unpack_from(
+                header_format, self._buffer, offset)
+            if frame_magic != magic or frame_version != version:
+                raise ProtocolError("Received data is not a valid frame")
+            if length > max_payload_size:
+                raise ProtocolError(f"Frame of {length} bytes exceeds maximum size")
+
+            end = offset + header_size + length
+            if len(self._buffer) < end:
+                break
+            payload = view = memoryview(self._buffer)[offset + header_size:end]
+            try:
+                self.binary = bool(flags & FLAG_BINARY)
+                self.compressed = bool(flags & FLAG_COMPRESSED)
+                if self.compressed:
+                    payload = _decompress(view)
+                body = unpack_binary(payload) if self.binary else json.loads(bytes(payload))
+            finally:
+                view.release()
+            messages.append(Message(msg_type, sequence, body))
+            offset = end
+
+        del self._buffer[:offset]
+        return messages
+
+
+def _decompress(payload) -> bytes:
+    """Decompress a payload, refusing to expand it beyond max_payload_size"""
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(payload, max_payload_size)
+    except zlib.error as e:
+        raise ProtocolError(f"Malformed compressed payload: {e}")
+    if decompressor.unconsumed_tail:
+        raise ProtocolError("Decompressed frame exceeds maximum size")
+    return data
+
+
+# Compact binary encoding tags
+_NONE, _TRUE, _FALSE, _INT, _FLOAT, _STR, _LIST, _DICT = b'NTFidslm'
+
+
+def _pack_varint(out: bytearray, value: int) -> None:
+    """Append unsigned LEB128 integer"""
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _pack_value(out: bytearray, value) -> None:
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        # Zigzag so small negative numbers stay short
+        out.append(_INT)
+        _pack_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += struct.pack('!d', value)
+    elif isinstance(value, str):
+        encoded = value.encode()
+        out.append(_STR)
+        _pack_varint(out, len(encoded))
+        out += encoded
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        _pack_varint(out, len(value))
+        for item in value:
+            _pack_value(out, item)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _pack_varint(out, len(value))
+        for key, item in value.items():
+            _pack_value(out, str(key))
+            _pack_value(out, item)
+    else:
+        raise TypeError(f"Cannot encode value of type {type(value).__name__}")
+
+
+def pack_binary(value) -> bytes:
+    """
+    Encode a JSON-compatible value in the compact binary encoding.
+
+    :param value:   None, bool, int, float, str, list, tuple or dict
+    :returns:       encoded bytes
+    """
+    out = bytearray()
+    _pack_value(out, value)
+    return bytes(out)
+
+
+def _unpack_varint(data, offset: int) -> tuple:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _unpack_value(data, offset: int) -> tuple:
+    tag = data[offset]
+    offset += 1
+    if tag == _NONE:
+        return None, offset
+    if tag == _TRUE:
+        return True, offset
+    if tag == _FALSE:
+        return False, offset
+    if tag == _INT:
+        value, offset = _unpack_varint(data, offset)
+        return (value >> 1) ^ -(value & 1), offset
+    if tag == _FLOAT:
+        return struct.unpack_from('!d', data, offset)[0], offset + 8
+    if tag == _STR:
+        length, offset = _unpack_varint(data, offset)
+        return str(data[offset:offset + length], 'utf-8'), offset + length
+    if tag == _LIST:
+        count, offset = _unpack_varint(data, offset)
+        items = []
+        for _ in range(count):
+            item, offset = _unpack_value(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == _DICT:
+        count, offset = _unpack_varint(data, offset)
+        items = {}
+        for _ in range(count):
+            key, offset = _unpack_value(data, offset)
+            items[key], offset = _unpack_value(data, offset)
+        return items, offset
+    raise ProtocolError(f"Unknown binary tag {tag!r}")
+
+
+def unpack_binary(data) -> object:
+    """
+    Decode a value encoded with pack_binary().
+
+    :param data:    bytes-like encoded value
+    :returns:       decoded value
+    """
+    try:
+        value, offset = _unpack_value(data, 0)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ProtocolError(f"Malformed binary payload: {e}")
+    if offset != len(data):
+        raise ProtocolError("Trailing bytes after binary payload")
+    return value
@@ -0,0 +1,86 @@
+import queue
+import threading
+import time
+import instrumentation
+
+
+class ResultBuffer:
+    """
+    Bounded buffer between the check scheduler and the result sender.
+
+    When the buffer is full, put() blocks until the sender catches up, while offer() drops the
+    item so an event loop thread never stalls. Time spent blocked and items dropped are recorded
+    so a monitor that cannot ship results fast enough can be spotted.
+    """
+
+    def __init__(self, maxsize: int):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._blocked_puts = 0
+        self._dropped = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def put(self, item, timeout: float | None = None) -> None:
+        """Add item, blocking while the buffer is full, raising queue.Full after timeout"""
+        try:
+            self._queue.put_nowait(item)
+            waited = 0.0
+        except queue.Full:
+            start = time.perf_counter()
+            try:
+                self._queue.put(item, timeout=timeout)
+            finally:
+                waited = time.perf_counter() - start
+                instrumentation.record("out_queue_blocked_put", int(waited * 1_000_000_000))
+
+        with self._lock:
+            self._puts += 1
+            if waited:
+                self._blocked_puts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+
+    def offer(self, item) -> bool:
+        """
+        Add item if there is room, without blocking
+
+        :returns:   False if the buffer was full and item was dropped
+        """
+        try:
+            self._queue.put_nowait(item)
+            added = True
+        except queue.Full:
+            added = False
+        with self._lock:
+            self._puts += 1
+            if not added:
+                self._dropped += 1
+        return added
+
+    def get(self, timeout: float | None = None):
+        """Remove and return an item, raising queue.Empty after timeout"""
+        return self._queue.get(timeout=timeout)
+
+    def get_nowait(self):
+        """Remove and return an item if one is available, else raise queue.Empty"""
+        return self._queue.get_nowait()
+
+    def take_wait_stats(self) -> dict:
+        """
+        Return producer wait statistics since the last call and reset them
+
+        :returns:   dictionary of puts, blocked puts, items dropped, total and max wait in ms
+        """
+        with self._lock:
+            stats = {
+                "puts": self._puts,
+                "blocked_puts": self._blocked_puts,
+                "dropped": self._dropped,
+                "wait_total_ms": self._wait_total * 1000,
+                "wait_max_ms": self._wait_max * 1000,
+            }
+            self._puts = self._blocked_puts = self._dropped = 0
+            self._wait_total = self._wait_max = 0.0
+        return stats
@@ -0,0 +1,235 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+from timing import now_ns
+
+default_executor_workers = 8    # threads for blocking library checks
+stop_poll_interval = 0.1        # seconds
+lateness_sample_size = 4096     # most recent run lateness samples kept for percentiles
+
+
+def check_key(check: object):
+    """Return key identifying check in the scheduler, its id if it has one"""
+    return getattr(check, "id", None) or id(check)
+
+
+def check_phase(check: object) -> float:
+    """
+    Return offset of check's first run within its interval
+
+    The offset is derived from a hash of the check id, so checks loaded together are spread
+    evenly across their interval and a check keeps the same phase across restarts.
+    """
+    key = str(getattr(check, "id", None) or id(check)).encode()
+    return zlib.crc32(key) / 2 ** 32 * check.interval
+
+
+class CheckScheduler:
+    """
+    Single-threaded check scheduler.
+
+    All checks are kept in one deadline-ordered timer heap driven by an asyncio event loop.
+    Checks exposing a check_async() coroutine (socket based checks) run directly on the loop,
+    while blocking library checks (requests, dnspython) run on a small bounded executor.
+
+    Run k of a check is due at start + phase + k * interval, so the check's runtime never
+    shifts later runs. A run that overruns its interval skips the slots it missed rather
+    than firing them back to back.
+
+    Checks can be added, replaced and removed by id while the scheduler runs (see update()).
+    Other checks keep their objects, and so their connections and timing phase.
+    """
+
+    def __init__(self, checks: list, on_result, max_workers: int = default_executor_workers):
+        """
+        :param checks:      check objects to schedule
+        :param on_result:   callable(check, result) invoked on the loop thread for every result
+        :param max_workers: size of the executor used for blocking checks
+        """
+        self._active = {check_key(check): check for check in checks}     # key -> check currently scheduled
+        self._running = set()
+        self._start = 0.0
+        self._on_result = on_result
+        self._max_workers = max_workers
+        self._heap = []
+        self._tiebreak = itertools.count()
+        self._loop = None
+        self._executor = None
+        self._stats_lock = threading.Lock()
+        self._runs = 0
+        self._skipped = 0
+        self._late_total = 0.0
+        self._late_max = 0.0
+        self._late_samples = deque(maxlen=lateness_sample_size)
+
+    def run(self, stop_event) -> None:
+        """
+        Run checks until stop_event is set. Blocks the calling thread.
+
+        :param stop_event:  threading.Event used to stop the scheduler
+        """
+        asyncio.run(self._main(stop_event))
+
+    def take_lateness_stats(self) -> dict:
+        """
+        Return run lateness statistics since the last call and reset them
+
+        Lateness is how long after its deadline a run started.
+
+        :returns:   dictionary of runs, skipped slots, and mean, p50, p99 and max lateness in ms
+        """
+        with self._stats_lock:
+            samples = sorted(self._late_samples)
+            stats = {
+                "runs": self._runs,
+                "skipped": self._skipped,
+                "late_mean_ms": self._late_total / self._runs * 1000 if self._runs else 0.0,
+                "late_max_ms": self._late_max * 1000,
+            }
+            for p in (50, 99):
+                stats[f"late_p{p}_ms"] = samples[round(p / 100 * (len(samples) - 1))] * 1000 if samples else 0.0
+            self._runs = self._skipped = 0
+            self._late_total = self._late_max = 0.0
+            self._late_samples.clear()
+        return stats
+
+    def update(self, checks: list, remove: list) -> None:
+        """
+        Add or replace checks and remove others while the scheduler runs. Safe to call from any thread.
+
+        A check replacing one with the same id takes over its slots. Checks removed or replaced
+        mid-run finish that run first, and are then closed.
+
+        :param checks:  checks to add, or to replace the scheduled check with the same id
+        :param remove:  ids of checks to stop running
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self._update(checks, remove)
+            return
+        loop.call_soon_threadsafe(self._update, checks, remove)
+
+    def _update(self, checks: list, remove: list) -> None:
+        for key in remove:
+            self._retire(self._active.pop(key, None))
+        for check in checks:
+            key = check_key(check)
+            self._retire(self._active.get(key))
+            self._active[key] = check
+            if self._loop is not None:
+                self._push(self._next_slot(check), check)
+
+    def _retire(self, check: object | None) -> None:
+        """Close a check no longer scheduled, after its current run if it is running"""
+        if check is not None and check not in self._running:
+            self._close(check)
+
+    def _next_slot(self, check: object) -> float:
+        """Return first deadline from now on check's start + phase + k * interval grid"""
+        first = self._start + check_phase(check)
+        now = self._loop.time()
+        if first >= now:
+            return first
+        return first + math.ceil((now - first) / check.interval) * check.interval
+
+    def _push(self, deadline: float, check: object) -> None:
+        """Add check to timer heap at specified loop time"""
+        heapq.heappush(self._heap, (deadline, next(self._tiebreak), check))
+
+    async def _main(self, stop_event) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="check")
+        tasks = set()
+
+        self._start = self._loop.time()
+        for check in self._active.values():
+            self._push(self._start + check_phase(check), check)
+
+        try:
+            while not stop_event.is_set():
+                # Sleep until the next deadline, waking at least every stop_poll_interval
+                # so the scheduler terminates within ~100ms of receiving a stop command
+                delay = stop_poll_interval
+                if self._heap:
+                    delay = min(delay, self._heap[0][0] - self._loop.time())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                # Start every check whose deadline has passed
+                now = self._loop.time()
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, _, check = heapq.heappop(self._heap)
+                    if self._active.get(check_key(check)) is not check:
+                        # Removed or replaced since it was scheduled
+                        continue
+                    task = self._loop.create_task(self._run_check(check, deadline))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            for check in self._active.values():
+                self._close(check)
+
+    async def _run_check(self, check: object, deadline: float) -> None:
+        """Run a single check, report its result, and schedule its next run"""
+        self._record_lateness(self._loop.time() - deadline)
+        start = now_ns()
+        self._running.add(check)
+        try:
+            if hasattr(check, "check_async"):
+                result = await check.check_async()
+            else:
+                result = await self._loop.run_in_executor(self._executor, check.check)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result = check.error(e)
+        finally:
+            self._running.discard(check)
+        instrumentation.record(f"check.{check.service_type}", now_ns() - start)
+
+        try:
+            self._on_result(check, result)
+        except Exception as e:
+            print(f"Could not report {check.service_type} check result: {e}")
+
+        # Next run is due one interval after this one was, so runtime does not cause drift.
+        # Runs never overlap: slots that passed while this run was in progress are skipped.
+        deadline += check.interval
+        now = self._loop.time()
+        if deadline <= now:
+            missed = math.ceil((now - deadline) / check.interval)
+            deadline += missed * check.interval
+            with self._stats_lock:
+                self._skipped += missed
+        if self._active.get(check_key(check)) is check:
+            self._push(deadline, check)
+        else:
+            # Removed or replaced during this run
+            self._close(check)
+
+    @staticmethod
+    def _close(check: object) -> None:
+        """Let check release connections it keeps between runs"""
+        try:
+            getattr(check, "close", lambda: None)()
+        except Exception as e:
+            print(f"Could not close {check.service_type} check: {e}")
+
+    def _record_lateness(self, late: float) -> None:
+        late = max(0.0, late)
+        instrumentation.record("check_lateness", int(late * 1_000_000_000))
+        with self._stats_lock:
+            self._runs += 1
+            self._late_total += late
+            self._late_max = max(self._late_max, late)
+            self._late_samples.append(late)
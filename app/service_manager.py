@@ -1,4 +1,6 @@
 from io_functions import *
+from check_result import derive_check_id
+from check_spec import ConfigError, compile_checks
 import os
 import json
 
@@ -14,6 +16,7 @@ class ServiceManager:
             "DNS": self.add_dns_check,
             "NTP": self.add_ntp_check,
             "TCP": self.add_tcp_check,
+            "PortRange": self.add_port_range_check,
             "UDP": self.add_udp_check,
             "Echo": self.add_echo_server_check
         }
@@ -24,6 +27,7 @@ class ServiceManager:
             "A", "AAAA", "MX", "CNAME", "manual entry"
         ]
         self._monitor_config_path = "./configs/"
+        self._config_file = None    # file the configuration was loaded from or saved to
 
     def startup(self):
         """Begin configuration process"""
@@ -50,10 +54,56 @@ class ServiceManager:
         print("Select configuration:")
         filename = configs[select_from_list(configs)]
 
-        with open(os.path.join(self._monitor_config_path, filename), 'r') as file:
-            self._monitor_config = json.load(file)
+        try:
+            config = self.read_config(os.path.join(self._monitor_config_path, filename))
+        except (ConfigError, ValueError) as e:
+            print(f"Could not load {filename}: {e}\n")
+            return False
+        self._config_file = os.path.join(self._monitor_config_path, filename)
+        self._monitor_config = config
         return True
 
+    def read_config(self, path: str) -> dict:
+        """
+        Read configuration file, giving every check without an id the id its monitor would derive
+
+        :raises ConfigError: if a monitor's checks are invalid, with the path of every error
+        :raises ValueError: if the file is not valid JSON
+        """
+        with open(path, 'r') as file:
+            config = json.load(file)
+        errors = []
+        for name, monitor in config.items():
+            try:
+                compile_checks(monitor.get("checks") or {}, f"{name}.checks")
+            except ConfigError as e:
+                errors += e.errors
+        if errors:
+            raise ConfigError(errors)
+
+        for monitor in config.values():
+            for check_type, check_list in (monitor.get("checks") or {}).items():
+                for check in check_list:
+                    if check.get("id") is None:
+                        check["id"] = derive_check_id(check_type, check)
+        return config
+
+    def reload_config(self) -> dict | None:
+        """
+        Read the configuration file again, e.g. after it was edited
+
+        :returns:   configuration, or None if it was never saved to a file
+        """
+        if self._config_file is None:
+            print("Configuration was not loaded from or saved to a file.")
+            return None
+        try:
+            self._monitor_config = self.read_config(self._config_file)
+        except (ConfigError, ValueError) as e:
+            print(f"Could not reload {self._config_file}, keeping the running configuration: {e}")
+            return None
+        return self._monitor_config
+
     def save_config(self, config: dict):
         """Save config under filename. Default: 'def_config.json' """
         while True:
@@ -66,7 +116,8 @@ class ServiceManager:
             else:
                 if get_input_confirmation(f"Save configuration as {filename}?"):
                     break
-        with open(os.path.join(self._monitor_config_path, filename), 'w') as file:
+        self._config_file = os.path.join(self._monitor_config_path, filename)
+        with open(self._config_file, 'w') as file:
             json.dump(config, file)
         print("File saved!")
 
@@ -150,7 +201,14 @@ class ServiceManager:
     def add_check_config(self, config, check, check_type):
         if check_type not in config:
             config[check_type] = []
-        config[check_type].append(check)   
+        # Explicit id, so the check keeps it when its settings are changed later
+        check_id = derive_check_id(check_type, check)
+        taken = {existing.get("id") for existing in config[check_type]}
+        unique_id, suffix = check_id, 1
+        while unique_id in taken:
+            unique_id, suffix = f"{check_id}-{suffix}", suffix + 1
+        check["id"] = unique_id
+        config[check_type].append(check)
 
     def _handle_add_http(self, config, *, https: bool = False):
         """
@@ -170,6 +228,13 @@ class ServiceManager:
             check["timeout"] = get_input_timeout(5)
         else:
             check_type = "HTTP"
+
+        # Measure latency over reused or fresh connections
+        print("Which connection latency should be measured?")
+        connection_modes = ["warm", "cold"]
+        selection = select_from_list(["warm (reuse keep-alive connections)", "cold (new connection every check)"])
+        check["connection"] = connection_modes[max(selection, 0)]
+
         check["interval"] = get_input_interval()
 
         self.add_check_config(config, check, check_type)
@@ -252,10 +317,15 @@ class ServiceManager:
         :returns:   True if added, else False
         """
         # Get parameters
-        server = get_input_manual("hostname or IP address", back=True)
-        if server is None:
+        servers = get_input_manual("hostnames or IP addresses, separated by commas", back=True)
+        if servers is None:
             return False
-        check = {"server": server, "interval": get_input_interval()}
+        check = {
+            "servers": [server.strip() for server in servers.split(",") if server.strip()],
+            "samples": get_input_ntp_samples(4),
+            "timeout": get_input_timeout(2),
+            "interval": get_input_interval()
+        }
 
         self.add_check_config(config, check, "NTP")
         return True
@@ -293,6 +363,36 @@ class ServiceManager:
         """
         return self._handle_transport_check(config, "TCP")
 
+    def add_port_range_check(self, config):
+        """
+        Add check of a range of TCP or UDP ports
+
+        :returns:   True if added, else False
+        """
+        ip = get_input_manual("IP address", back=True)
+        if ip is None:
+            return False
+
+        print("Which protocol should be checked?")
+        protocols = ["TCP", "UDP"]
+        protocol = protocols[max(select_from_list(protocols), 0)]
+
+        print("First port of range")
+        start_port = get_input_port_number()
+        print("Last port of range")
+        end_port = get_input_port_number()
+        check = {
+            "protocol": protocol,
+            "ip_address": ip,
+            "start_port": min(start_port, end_port),
+            "end_port": max(start_port, end_port),
+            "timeout": get_input_timeout(3),
+            "interval": get_input_interval()
+        }
+
+        self.add_check_config(config, check, "PortRange")
+        return True
+
     def add_udp_check(self, config):
         """
         Add UDP service check
@@ -312,6 +412,10 @@ class ServiceManager:
         check = {
             "ip_address": 'localhost',
             "port": get_input_port_number(),
+            "probes": get_input_echo_probes(1),
+            "payload_size": get_input_payload_size(64),
+            "persistent": get_input_confirmation("Keep the connection open between checks?"),
+            "timeout": get_input_timeout(3),
             "interval": get_input_interval()
         }
 
@@ -319,6 +423,38 @@ class ServiceManager:
         return True
 
 
+def index_checks(checks_dict: dict) -> dict:
+    """Return check id -> (check type, check configuration) of a checks dictionary"""
+    index = {}
+    for check_type, check_list in (checks_dict or {}).items():
+        for check in check_list:
+            check_id = check.get("id") or derive_check_id(check_type, check)
+            index[check_id] = (check_type, check)
+    return index
+
+
+def diff_checks(old: dict, new: dict) -> dict | None:
+    """
+    Compare two checks dictionaries by check id
+
+    :param old: checks dictionary the monitor is running
+    :param new: checks dictionary it should run
+    :returns:   {"add": checks dictionary, "modify": checks dictionary, "remove": [check ids]},
+                or None if nothing changed
+    """
+    old_index, new_index = index_checks(old), index_checks(new)
+    delta = {"add": {}, "modify": {}, "remove": [check_id for check_id in old_index if check_id not in new_index]}
+    for check_id, (check_type, check) in new_index.items():
+        previous = old_index.get(check_id)
+        if previous == (check_type, check):
+            continue
+        change = "add" if previous is None else "modify"
+        delta[change].setdefault(check_type, []).append(dict(check, id=check_id))
+    if not (delta["add"] or delta["modify"] or delta["remove"]):
+        return None
+    return delta
+
+
 def main():
     manager = ServiceManager()
     manager.startup()
@@ -1,4 +1,6 @@
 import services
+from check_result import derive_check_id
+from check_spec import compile_checks
 
 
 class ServiceMonitor:
@@ -11,6 +13,7 @@ class ServiceMonitor:
         self._dns = []
         self._ntp = []
         self._tcp = []
+        self._port_range = []
         self._udp = []
         self._echo_server = []
         self._checks = []
@@ -21,6 +24,7 @@ class ServiceMonitor:
             "DNS": (self._dns, services.DNS),
             "NTP": (self._ntp, services.NTP),
             "TCP": (self._tcp, services.TCP),
+            "PortRange": (self._port_range, services.PortRange),
             "UDP": (self._udp, services.UDP),
             "Echo": (self._echo_server, services.Echo),
         }
@@ -39,26 +43,75 @@ class ServiceMonitor:
         return checks_dict
 
     def set_checks_from_dict(self, checks_dict):
-        """Unpack checks dictionary and store in checks_list"""
+        """
+        Unpack checks dictionary and store in checks_list
+
+        :raises ConfigError: if any check is invalid, leaving the current checks in place
+        """
+        specs = compile_checks(checks_dict)
         for service in self._services.values():
             # Clear current list of checks for service
             service[0].clear()
-        for check_type, check_list in checks_dict.items():
-            # Initialize check object
-            for check_dict in check_list:
-                check = self._services[check_type][1]()
+        self._checks.clear()
+        self._config = {}
+        self._add_checks(checks_dict, specs)
+
+    def apply_delta(self, delta: dict) -> tuple:
+        """
+        Add, modify and remove checks by id, see service_manager.diff_checks()
+
+        Checks not named in delta keep their objects. Nothing changes if an added or modified check is invalid.
+
+        :param delta:   {"add": checks dictionary, "modify": checks dictionary, "remove": [check ids]}
+        :returns:       (new check objects, ids of checks removed)
+        :raises ConfigError: if an added or modified check is invalid
+        """
+        changes = {}
+        for change in ("add", "modify"):
+            for check_type, check_list in delta.get(change, {}).items():
+                changes.setdefault(check_type, []).extend(check_list)
+        specs = compile_checks(changes)
 
-                # Transfer dict attr values to check object
-                for attr, val in check_dict.items():
-                    setattr(check, attr, val)
+        self._remove_checks(set(delta.get("remove", [])) | {spec.id for spec in specs})
+        return self._add_checks(changes, specs), list(delta.get("remove", []))
 
-                # Add check to respective service list and master checks list
-                self._services[check_type][0].append(check)
-                self._checks.append(check)
+    def _add_checks(self, checks_dict: dict, specs: list) -> list:
+        """
+        Build check objects from a checks dictionary and store them
+
+        :param checks_dict: check settings, kept to diff later configurations against
+        :param specs:       checks_dict compiled by check_spec.compile_checks()
+        :returns:           new check objects
+        """
+        added = []
+        for spec in specs:
+            service_checks, service = self._services[spec.type]
+            check = service.from_spec(spec)
+
+            # Add check to respective service list and master checks list
+            service_checks.append(check)
+            self._checks.append(check)
+            added.append(check)
+        for check_type, check_list in checks_dict.items():
+            self._config.setdefault(check_type, []).extend(check_list)
+        return added
+
+    def _remove_checks(self, ids: set) -> None:
+        """Forget checks with the given ids"""
+        for service_checks, _ in self._services.values():
+            service_checks[:] = [check for check in service_checks if check.id not in ids]
+        self._checks[:] = [check for check in self._checks if check.id not in ids]
+        for check_type, check_list in self._config.items():
+            check_list[:] = [check_dict for check_dict in check_list
+                             if (check_dict.get("id") or derive_check_id(check_type, check_dict)) not in ids]
 
     def get_checks(self):
         return self._checks
 
+    def get_config(self) -> dict:
+        """Return checks dictionary of the checks currently held"""
+        return self._config
+
 
 def main():
     pass
@@ -1,4 +1,9 @@
 from network_monitoring_functions import *
+from check_result import CheckResult, Status, ms_to_ns
+from tcp_probe import probe_tcp_ports, probe_tcp_ports_sync, format_ports
+import echo_probe
+import ntp_client
+from udp_probe import probe_udp_ports, probe_udp_ports_sync, OPEN, NO_RESPONSE, FAILED
 
 default_interval = 5        # seconds
 max_interval = 600          # seconds
@@ -10,74 +15,120 @@ max_16b = 65535
 class Service:
     """Simple network service parent class"""
     def __init__(self):
+        self.id = None                      # stable check id, assigned by ServiceMonitor
         self.interval = default_interval    # default check interval
 
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Build check from its compiled spec, see check_spec.compile_checks()
+
+        :param spec:    validated settings of the check
+        :returns:       check object
+        """
+        check = cls()
+        # Every field after the spec's type is a check attribute
+        check.__dict__.update(zip(spec._fields[1:], spec[1:]))
+        return check
+
     def get_interval(self):
         return self.interval
 
+    def target(self) -> str:
+        """Return description of what the check targets"""
+        return ""
+
+    def result(self, status: Status, latency_ms: float | None = None, detail: str = "", error_code: int = 0) -> CheckResult:
+        """
+        Build result of a check run
+
+        :param status:      outcome of the check
+        :param latency_ms:  measured latency in milliseconds, if any
+        :param detail:      short detail
+        :param error_code:  errno of failure, if any
+        :returns:           check result
+        """
+        return CheckResult(self.id, self.service_type, self.target(), status, ms_to_ns(latency_ms), error_code, detail)
+
+    def error(self, e: Exception) -> CheckResult:
+        """Build result of a check run that raised an exception"""
+        return self.result(Status.ERROR, detail=str(e), error_code=getattr(e, "errno", None) or 0)
+
+    def close(self) -> None:
+        """Release resources held between runs, called once the check is no longer scheduled"""
+        pass
+
 
 class HTTP(Service):
     """HTTP service class"""
     def __init__(self):
         self.url = None
         self.service_type = "HTTP"
+        self.timeout = 5
+        self.connection = "warm"    # "warm" reuses pooled connections, "cold" opens one per check
         super().__init__()
 
-    def check(self) -> str:
+    def target(self) -> str:
+        # Add http protocol to URL
+        if self.url[:7] != "http://":
+            return f"http://{self.url}"
+        return self.url
+
+    def check(self) -> CheckResult:
         """
         Run HTTP check on stored URL
 
-        :returns:   status of check
+        :returns:   result of check
         """
-        # Add http protocol to URL
-        expanded_url = self.url
-        if self.url[:7] != "http://":
-            expanded_url = f"http://{self.url}"
-
-        # Check URL
         try:
-            response = check_server_http(expanded_url)
+            response = check_server_http(self.target(), self.timeout, self.connection)
             if response[0]:
                 # Check successful
-                return f"HTTP check -- {expanded_url} -- Server is up -- Status: {response[1]}"
+                return self.result(Status.UP, response[2], f"status {response[1]} ({self.connection})")
+            if response[1] is not None:
+                # Server answered with an error status
+                return self.result(Status.DOWN, response[2], f"status {response[1]} ({self.connection})")
             # Check failed
-            return f"HTTP check -- {expanded_url} -- Server unreachable"
+            return self.result(Status.DOWN, detail="Server unreachable")
         except Exception as e:
-            return f"HTTP check -- {expanded_url} -- Error: {e}"
+            return self.error(e)
 
 
 class HTTPS(HTTP):
     """HTTPS service class"""
     def __init__(self):
-        self.timeout = 5
-        self.service_type = "HTTPS"
         super().__init__()
+        self.service_type = "HTTPS"
+
+    def target(self) -> str:
+        # Add https protocol
+        if self.url[:8] != "https://":
+            return f"https://{self.url}"
+        return self.url
 
-    def check(self) -> str:
+    def check(self) -> CheckResult:
         """
         Run HTTPS check on stored URL
 
-        :returns:   status of check
+        :returns:   result of check
         """
-        # Add https protocol
-        expanded_url = self.url
-        if self.url[:8] != "https://":
-            expanded_url = f"https://{self.url}"
-
-        # Check URL
         try:
-            response = check_server_https(expanded_url, self.timeout)
+            response = check_server_https(self.target(), self.timeout, self.connection)
             if response[0]:
                 # Check successful
-                return f"HTTPS check -- {expanded_url} -- Server is up -- Status: {response[1]}"
+                return self.result(Status.UP, response[3], f"status {response[1]} ({self.connection})")
+            if response[1] is not None:
+                # Server answered with an error status
+                return self.result(Status.DOWN, response[3], f"status {response[1]} ({self.connection})")
             # Check failed
-            return f"HTTPS check -- {expanded_url} -- Server unreachable -- {response[2]}."
+            status = Status.TIMEOUT if response[2] == "Timeout occurred" else Status.DOWN
+            return self.result(status, detail=response[2])
         except Exception as e:
-            return f"HTTPS check -- {expanded_url} -- Error: {e}."
+            return self.error(e)
 
 
 class ICMP(Service):
-    """HTTPS service class"""
+    """ICMP service class"""
     def __init__(self):
         self.host = None
         self.service_type = "ICMP"
@@ -86,73 +137,122 @@ class ICMP(Service):
         self.sequence_number = 1
         super().__init__()
 
-    def check(self) -> str:
+    def target(self) -> str:
+        return self.host
+
+    def check(self) -> CheckResult:
         """
         Run ICMP check on stored host
 
-        :returns:   status of check
+        :returns:   result of check
+        """
+        try:
+            return self._report(ping(self.host, self.ttl, self.timeout, self.sequence_number))
+        except Exception as e:
+            return self.error(e)
+
+    async def check_async(self) -> CheckResult:
+        """
+        Run ICMP check on stored host from the scheduler's event loop
+
+        :returns:   result of check
         """
         try:
-            response = ping(self.host, self.ttl, self.timeout, self.sequence_number)
-            if response[1] is None:
-                if response[0] is None:
-                    # No response
-                    return f"ICMP check -- {self.host} -- no response!"
-                # Timeout
-                return f"ICMP check -- {self.host} -- request timed out!"
-            # Check successful
-            return f"ICMP check -- {self.host} -- reply from {response[0]} received in {response[1]}ms"
+            return self._report(await ping_async(self.host, self.ttl, self.timeout, self.sequence_number))
         except Exception as e:
-            return f"ICMP check -- {self.host} -- Error: {e}"
+            return self.error(e)
+
+    def _report(self, response) -> CheckResult:
+        """Build result from ping response"""
+        if response[1] is None:
+            # No response before timeout
+            return self.result(Status.TIMEOUT)
+        # Check successful
+        return self.result(Status.UP, response[1], f"reply from {response[0][0]}")
 
 
 class NTP(Service):
     """NTP service class"""
     def __init__(self):
         self.server = None
+        self.servers = []           # servers queried together, in place of server
+        self.port = 123
+        self.samples = ntp_client.default_samples
+        self.timeout = ntp_client.default_timeout
         self.service_type = "NTP"
         super().__init__()
 
-    def check(self) -> str:
+    def target(self) -> str:
+        return ",".join(self._servers())
+
+    def _servers(self) -> list:
+        return list(self.servers) or [self.server]
+
+    def check(self) -> CheckResult:
         """
-        Run NTP check on stored server
+        Run NTP check on stored servers
 
-        :returns:   status of check
+        :returns:   result of check
         """
         try:
-            response = check_ntp_server(self.server)
-            if response[0]:
-                # Check successful
-                return f"NTP check -- {self.server} -- Server is up -- Current time: {response[1]}"
-            # Check failed
-            return f"NTP check -- {self.server} -- Server is unreachable"
+            return self._report(check_ntp_server(self._servers(), self.port, self.samples, self.timeout))
         except Exception as e:
-            return f"NTP check -- {self.server} -- Error: {e}"
+            return self.error(e)
 
+    async def check_async(self) -> CheckResult:
+        """
+        Run NTP check from the scheduler's event loop
 
-class DNS(NTP):
+        :returns:   result of check
+        """
+        try:
+            return self._report(await check_ntp_server_async(self._servers(), self.port, self.samples, self.timeout))
+        except Exception as e:
+            return self.error(e)
+
+    def _report(self, response) -> CheckResult:
+        """Build result from the selected server, latency being its round trip delay"""
+        ok, selected, results = response
+        details = "; ".join(result.describe() for result in results if result is not selected)
+        if not ok:
+            # No server gave a usable sample
+            return self.result(Status.DOWN, detail=details)
+        answered = sum(result.best is not None for result in results)
+        detail = selected.describe()
+        if len(results) > 1:
+            detail += f" -- {answered}/{len(results)} servers answered; {details}"
+        return self.result(Status.UP, selected.best.delay, detail)
+
+
+class DNS(Service):
     """DNS service class"""
     def __init__(self):
+        self.server = None
+        self.port = 53
         self.service_type = "DNS"
         self.query = None
         self.record_type = None
         super().__init__()
 
-    def check(self) -> str:
+    def target(self) -> str:
+        return self.server
+
+    def check(self) -> CheckResult:
         """
         Run DNS check on stored server using stored query and record type
 
-        :returns:   status of check   
+        :returns:   result of check
         """
         try:
-            response = check_dns_server_status(self.server, self.query, self.record_type)
+            response = check_dns_server_status(self.server, self.query, self.record_type, self.port)
             if response[0]:
                 # Check successful
-                return f"DNS check -- {self.server} -- Server is up -- {self.query} resolved to {response[1][0]}"
+                return self.result(Status.UP, response[2],
+                                   f"{self.query} {self.record_type} {response[1][0]} (setup {response[3]:.2f}ms)")
             # Check failed
-            return f"DNS check -- {self.server} -- Could not resolve {self.query}: {response[1]}"
+            return self.result(Status.DOWN, detail=f"Could not resolve {self.query}: {response[1]}")
         except Exception as e:
-            return f"DNS check -- {self.server} -- Error: {e}"
+            return self.error(e)
 
 
 class TCP(Service):
@@ -163,37 +263,144 @@ class TCP(Service):
         self.port = None
         super().__init__()
 
-    def check(self) -> str:
+    def target(self) -> str:
+        return f"{self.ip_address}:{self.port}"
+
+    def check(self) -> CheckResult:
         """
         Run TCP check on stored IP and port number
 
-        :returns:   status of check
+        :returns:   result of check
+        """
+        try:
+            return self._report(check_tcp_port(self.ip_address, self.port))
+        except Exception as e:
+            return self.error(e)
+
+    async def check_async(self) -> CheckResult:
+        """
+        Run TCP check from the scheduler's event loop
+
+        :returns:   result of check
+        """
+        try:
+            return self._report(await check_tcp_port_async(self.ip_address, self.port))
+        except Exception as e:
+            return self.error(e)
+
+    def _report(self, response) -> CheckResult:
+        """Build result from port check response"""
+        if response[0]:
+            return self.result(Status.UP, response[2])
+        status = Status.TIMEOUT if response[1].endswith("timed out.") else Status.DOWN
+        return self.result(status, detail=response[1])
+
+
+class PortRange(Service):
+    """TCP or UDP port range service class"""
+    def __init__(self):
+        self.service_type = "PortRange"
+        self.protocol = "TCP"
+        self.ip_address = None
+        self.start_port = None
+        self.end_port = None
+        self.timeout = 3
+        super().__init__()
+
+    def target(self) -> str:
+        return f"{self.protocol} {self.ip_address}:{self.start_port}-{self.end_port}"
+
+    def _targets(self) -> list:
+        return [(self.ip_address, port) for port in range(self.start_port, self.end_port + 1)]
+
+    def check(self) -> CheckResult:
+        """
+        Run TCP or UDP check on every port of stored range at once
+
+        :returns:   result of check
+        """
+        try:
+            if self.protocol == "UDP":
+                return self._report(probe_udp_ports_sync(self._targets(), self.timeout))
+            return self._report(probe_tcp_ports_sync(self._targets(), self.timeout))
+        except Exception as e:
+            return self.error(e)
+
+    async def check_async(self) -> CheckResult:
+        """
+        Run port range check from the scheduler's event loop
+
+        :returns:   result of check
         """
         try:
-            response = check_tcp_port(self.ip_address, self.port)
-            return f"TCP check -- {response[1]}"
+            if self.protocol == "UDP":
+                return self._report(await probe_udp_ports(self._targets(), self.timeout))
+            return self._report(await probe_tcp_ports(self._targets(), self.timeout))
         except Exception as e:
-            return f"TCP check -- {self.ip_address}:{self.port} -- Error: {e}"
+            return self.error(e)
+
+    def _report(self, responses) -> CheckResult:
+        """Build result from batch probe responses, up if any port is open"""
+        # TCP probes report whether the port is open, UDP probes report its state
+        opened = [response for response in responses if response[2] is True or response[2] == OPEN]
+        silent = sum(1 for response in responses
+                     if response[2] == NO_RESPONSE or (response[2] is False and response[3].endswith("timed out.")))
+        detail = f"{len(opened)}/{len(responses)} open"
+        if opened:
+            detail += f": {format_ports([response[1] for response in opened])}"
+        if silent:
+            detail += f" -- {silent} {'without response' if self.protocol == 'UDP' else 'timed out'}"
+        if not opened:
+            return self.result(Status.TIMEOUT if silent == len(responses) else Status.DOWN, detail=detail)
+        # Report the mean response latency of the open ports
+        latency = sum(response[4] for response in opened) / len(opened)
+        return self.result(Status.UP, latency, detail)
 
 
 class UDP(TCP):
     """UDP service class"""
     def __init__(self):
+        super().__init__()
         self.service_type = "UDP"
         self.timeout = 3
-        super().__init__()
+        self.payload = None     # text to send, None for the well-known probe of the port's service
+
+    def _payload(self) -> bytes | None:
+        return None if self.payload is None else self.payload.encode()
 
-    def check(self) -> str:
+    def check(self) -> CheckResult:
         """
         Run UDP check on stored IP and port number
 
-        :returns:   status of check
+        :returns:   result of check
         """
         try:
-            response = check_udp_port(self.ip_address, self.port, self.timeout)
-            return f"UDP check -- {response[1]}"
+            return self._report(probe_udp_ports_sync([(self.ip_address, self.port)], self.timeout, self._payload())[0])
         except Exception as e:
-            return f"UDP check -- {self.ip_address}:{self.port} -- Error: {e}"
+            return self.error(e)
+
+    async def check_async(self) -> CheckResult:
+        """
+        Run UDP check from the scheduler's event loop
+
+        :returns:   result of check
+        """
+        try:
+            return self._report((await probe_udp_ports([(self.ip_address, self.port)], self.timeout, self._payload()))[0])
+        except Exception as e:
+            return self.error(e)
+
+    def _report(self, response) -> CheckResult:
+        """Build result from UDP probe response"""
+        _, _, state, description, rtt = response
+        if state == OPEN:
+            return self.result(Status.UP, rtt, description)
+        if state == NO_RESPONSE:
+            # No response means the port is not known to be closed
+            return self.result(Status.UNKNOWN, detail=description)
+        if state == FAILED:
+            return self.result(Status.ERROR, detail=description)
+        return self.result(Status.DOWN, rtt, description)
 
 
 class Echo(TCP):
@@ -201,17 +408,70 @@ class Echo(TCP):
     def __init__(self):
         super().__init__()
         self.service_type = "Echo"
+        self.timeout = 3
+        self.persistent = False     # keep one connection open between runs
+        self.probes = 1             # sequence-numbered probes pipelined per run
+        self.payload_size = echo_probe.default_payload_size
+        self._sock = None
+        self._sequence = 0
 
-    def check(self) -> str:
+    def check(self) -> CheckResult:
         """
         Run echo server check
 
-        :returns:   status of check
+        :returns:   result of check
         """
         try:
-            response = check_echo_server(self.ip_address, self.port)
-            if response[0]:
-                return f"Echo server check -- {self.ip_address}:{self.port} -- {response[1]}"
-            return f"Echo server check -- {self.ip_address}:{self.port} -- {response[1]}"
+            self._sock = self._sock or echo_probe.open_connection(self.ip_address, self.port, self.timeout)
+            self._sock.settimeout(self.timeout)
+            response = echo_probe.echo_burst(self._sock, self._next_sequence(), self.probes, self.payload_size)
+        except Exception as e:
+            return self._failed(e)
+        return self._report(response)
+
+    async def check_async(self) -> CheckResult:
+        """
+        Run echo server check from the scheduler's event loop
+
+        :returns:   result of check
+        """
+        try:
+            self._sock = self._sock or await echo_probe.open_connection_async(self.ip_address, self.port, self.timeout)
+            self._sock.setblocking(False)
+            burst = echo_probe.echo_burst_async(self._sock, self._next_sequence(), self.probes, self.payload_size)
+            response = await asyncio.wait_for(burst, self.timeout)
         except Exception as e:
-            return f"Echo server check -- {self.ip_address}:{self.port} -- Error: {e}"
+            return self._failed(e)
+        return self._report(response)
+
+    def close(self) -> None:
+        """Close persistent connection"""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _next_sequence(self) -> int:
+        sequence = self._sequence
+        self._sequence = (self._sequence + self.probes) & 0xffffffff
+        return sequence
+
+    def _failed(self, e: Exception) -> CheckResult:
+        """Build result of a failed run, dropping its connection"""
+        self.close()
+        if isinstance(e, (TimeoutError, asyncio.TimeoutError)):
+            return self.result(Status.TIMEOUT, detail=f"No echo from {self.target()} within {self.timeout}s")
+        return self.result(Status.DOWN, detail=f"Could not reach echo server at {self.target()}: {e}",
+                           error_code=getattr(e, "errno", None) or 0)
+
+    def _report(self, response) -> CheckResult:
+        """Build result from echo burst response"""
+        ok, description, rtts = response
+        if not (ok and self.persistent):
+            # A connection that misbehaved is not reused, nor is one opened just for this run
+            self.close()
+        if not ok:
+            return self.result(Status.DOWN, detail=description)
+        rtt = echo_probe.rtt_summary(rtts)
+        return self.result(Status.UP, rtt["avg"],
+                           f"{len(rtts)} x {self.payload_size}B -- min/avg/max/jitter "
+                           f"{rtt['min']:.3f}/{rtt['avg']:.3f}/{rtt['max']:.3f}/{rtt['jitter']:.3f}ms")
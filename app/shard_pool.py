@@ -0,0 +1,274 @@
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import zlib
+import instrumentation
+from check_result import derive_check_id
+from result_buffer import ResultBuffer
+from scheduler import CheckScheduler
+from service_monitor import ServiceMonitor
+
+shard_queue_size = 64       # result batches buffered between the workers and the parent
+shard_buffer_size = 1024    # results buffered in a worker while its batches wait to be sent
+forward_max_results = 256   # results a worker sends at once...
+forward_max_age = 0.02      # ...or once its oldest unsent result is this old (seconds)
+report_interval = 1         # seconds between a worker's instrument and lateness reports
+poll_interval = 0.1         # seconds, bounds how long stop takes to be noticed
+stop_timeout = 5            # seconds to wait for workers to stop before killing them
+
+# Messages sent from a worker to the parent
+RESULTS = 0                 # (RESULTS, [result lists])
+REPORT = 1                  # (REPORT, shard, instruments snapshot, lateness stats)
+
+
+def shard_of(check_id: str, shards: int) -> int:
+    """Return index of the shard running a check, stable across restarts"""
+    return zlib.crc32(check_id.encode()) % shards
+
+
+def split_checks(checks_dict: dict, shards: int) -> list:
+    """
+    Split a checks dictionary by the shard each check belongs to
+
+    :param checks_dict: check type -> list of check settings
+    :param shards:      number of shards
+    :returns:           one checks dictionary per shard
+    """
+    parts = [{} for _ in range(shards)]
+    for check_type, check_list in checks_dict.items():
+        for check in check_list:
+            part = parts[shard_of(check.get("id") or derive_check_id(check_type, check), shards)]
+            part.setdefault(check_type, []).append(check)
+    return parts
+
+
+def split_delta(delta: dict, shards: int) -> list:
+    """
+    Split a configuration delta by the shard each check belongs to, see service_manager.diff_checks()
+
+    :returns:   one delta per shard, None for shards it does not change
+    """
+    adds = split_checks(delta.get("add", {}), shards)
+    modifies = split_checks(delta.get("modify", {}), shards)
+    removes = [[] for _ in range(shards)]
+    for check_id in delta.get("remove", []):
+        removes[shard_of(check_id, shards)].append(check_id)
+    return [{"add": add, "modify": modify, "remove": remove} if add or modify or remove else None
+            for add, modify, remove in zip(adds, modifies, removes)]
+
+
+class ShardPool:
+    """
+    Runs checks in several worker processes, so checks are not limited to the one core the GIL allows.
+
+    Every check belongs to the shard picked by a hash of its id, and each shard process runs its
+    checks with its own CheckScheduler. Workers send results to the parent in batches through one
+    bounded queue; the parent puts them in its result buffer, so they leave over the single manager
+    connection. A full result buffer blocks the workers' forwarding threads, and their schedulers
+    then drop results as a single scheduler would.
+
+    Exposes run() and take_lateness_stats() like CheckScheduler. Configuration changes are
+    passed to apply_delta() rather than update(), since check objects cannot cross processes.
+    """
+
+    def __init__(self, checks_dict: dict, shards: int, results: ResultBuffer):
+        """
+        :param checks_dict: check type -> list of check settings, already validated
+        :param shards:      number of worker processes
+        :param results:     buffer receiving every worker's results as lists, see CheckResult.to_list()
+        """
+        self._shards = shards
+        self._results = results
+        # Spawned rather than forked, so workers do not inherit the parent's threads and sockets
+        self._context = multiprocessing.get_context("spawn")
+        self._messages = self._context.Queue(shard_queue_size)
+        self._commands = [self._context.Queue() for _ in range(shards)]
+        self._stop_event = self._context.Event()
+        self._processes = [
+            self._context.Process(target=run_shard, name=f"NETMON-shard-{shard}", daemon=True,
+                                  args=(shard, part, self._commands[shard], self._messages, self._stop_event))
+            for shard, part in enumerate(split_checks(checks_dict, shards))
+        ]
+        self._stats_lock = threading.Lock()
+        self._lateness = {}     # shard -> lateness stats accumulated since the last take_lateness_stats()
+
+    def apply_delta(self, delta: dict) -> None:
+        """Send each worker its part of a configuration delta. Safe to call from any thread."""
+        for commands, part in zip(self._commands, split_delta(delta, self._shards)):
+            if part is not None:
+                commands.put(part)
+
+    def take_lateness_stats(self) -> dict | None:
+        """
+        Return run lateness statistics of every worker since the last call and reset them
+
+        Percentiles are the highest any shard reported, see CheckScheduler.take_lateness_stats().
+
+        :returns:   dictionary of runs, skipped slots, and mean, p50, p99 and max lateness in ms,
+                    or None if no worker has reported yet
+        """
+        with self._stats_lock:
+            lateness, self._lateness = list(self._lateness.values()), {}
+        if not lateness:
+            return None
+        runs = sum(stats["runs"] for stats in lateness)
+        return {
+            "runs": runs,
+            "skipped": sum(stats["skipped"] for stats in lateness),
+            "late_mean_ms": sum(stats["late_mean_ms"] * stats["runs"] for stats in lateness) / runs if runs else 0.0,
+            "late_max_ms": max(stats["late_max_ms"] for stats in lateness),
+            "late_p50_ms": max(stats["late_p50_ms"] for stats in lateness),
+            "late_p99_ms": max(stats["late_p99_ms"] for stats in lateness),
+        }
+
+    def run(self, stop_event) -> None:
+        """
+        Start the workers and merge their results until stop_event is set. Blocks the calling thread.
+
+        :param stop_event:  threading.Event used to stop the pool
+        """
+        for process in self._processes:
+            process.start()
+        exited = set()
+        try:
+            while not stop_event.is_set():
+                self._receive(poll_interval, stop_event)
+                for shard, process in enumerate(self._processes):
+                    if process.exitcode is not None and shard not in exited:
+                        exited.add(shard)
+                        print(f"Shard {shard} stopped unexpectedly (exit code {process.exitcode})")
+        finally:
+            self._stop_event.set()
+            # Keep draining, a worker blocked on the full queue cannot notice the stop
+            deadline = time.monotonic() + stop_timeout
+            while any(process.is_alive() for process in self._processes) and time.monotonic() < deadline:
+                self._receive(poll_interval)
+            for process in self._processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+    def _receive(self, timeout: float, stop_event=None) -> None:
+        """
+        Handle one message from the workers, if one arrives within timeout
+
+        :param stop_event:  event of run(), or None to discard the message
+        """
+        try:
+            message = self._messages.get(timeout=timeout)
+        except queue.Empty:
+            return
+        if stop_event is None:
+            return
+        if message[0] == RESULTS:
+            for result in message[1]:
+                # The sender stops reading the buffer once stop_event is set
+                while not stop_event.is_set():
+                    try:
+                        self._results.put(result, timeout=poll_interval)
+                        break
+                    except queue.Full:
+                        continue
+        elif message[0] == REPORT:
+            _, shard, snapshot, lateness = message
+            instrumentation.instruments.merge(f"shard-{shard}", snapshot)
+            with self._stats_lock:
+                previous = self._lateness.get(shard)
+                self._lateness[shard] = lateness if previous is None else _add_lateness(previous, lateness)
+
+
+def _add_lateness(first: dict, second: dict) -> dict:
+    """Combine two consecutive lateness reports of one shard"""
+    runs = first["runs"] + second["runs"]
+    return {
+        "runs": runs,
+        "skipped": first["skipped"] + second["skipped"],
+        "late_mean_ms": (first["late_mean_ms"] * first["runs"] + second["late_mean_ms"] * second["runs"]) / runs
+                        if runs else 0.0,
+        "late_max_ms": max(first["late_max_ms"], second["late_max_ms"]),
+        "late_p50_ms": second["late_p50_ms"],
+        "late_p99_ms": max(first["late_p99_ms"], second["late_p99_ms"]),
+    }
+
+
+def run_shard(shard: int, checks_dict: dict, commands, messages, stop_event) -> None:
+    """
+    Worker process: run one shard's checks and send their results to the parent until stop_event is set
+
+    :param shard:       index of the shard
+    :param checks_dict: checks of this shard
+    :param commands:    queue of configuration deltas for this shard
+    :param messages:    queue of RESULTS and REPORT messages to the parent
+    :param stop_event:  multiprocessing.Event used to stop the worker
+    """
+    # Ctrl-C reaches the whole process group; the parent stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    service_monitor = ServiceMonitor()
+    service_monitor.set_checks_from_dict(checks_dict)
+    results = ResultBuffer(shard_buffer_size)
+    scheduler = CheckScheduler(service_monitor.get_checks(), lambda check, result: results.offer(result.to_list()))
+
+    def apply_commands():
+        while not stop_event.is_set():
+            try:
+                delta = commands.get(timeout=poll_interval)
+            except queue.Empty:
+                continue
+            try:
+                added, removed = service_monitor.apply_delta(delta)
+            except Exception as e:
+                print(f"Shard {shard} could not apply configuration update: {e}")
+                continue
+            scheduler.update(added, removed)
+
+    threads = [
+        threading.Thread(target=scheduler.run, args=(stop_event,)),
+        threading.Thread(target=apply_commands),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        _forward(shard, results, messages, scheduler, stop_event)
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+        messages.close()
+        messages.join_thread()
+
+
+def _forward(shard: int, results: ResultBuffer, messages, scheduler: CheckScheduler, stop_event) -> None:
+    """Send results to the parent in batches, and instruments and lateness every report_interval"""
+    batch, batch_deadline = [], None
+    report_deadline = time.monotonic() + report_interval
+    while not stop_event.is_set():
+        timeout = poll_interval if batch_deadline is None else max(0.0, batch_deadline - time.monotonic())
+        try:
+            batch.append(results.get(timeout=timeout))
+            if batch_deadline is None:
+                batch_deadline = time.monotonic() + forward_max_age
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        if batch and (len(batch) >= forward_max_results or now >= batch_deadline):
+            _put(messages, (RESULTS, batch), stop_event)
+            batch, batch_deadline = [], None
+
+        if now >= report_deadline:
+            report_deadline = now + report_interval
+            lateness = scheduler.take_lateness_stats()
+            _put(messages, (REPORT, shard, instrumentation.instruments.snapshot(), lateness), stop_event)
+
+
+def _put(messages, message, stop_event) -> None:
+    """Put message on the parent's queue, giving up once stop_event is set"""
+    while not stop_event.is_set():
+        try:
+            messages.put(message, timeout=poll_interval)
+            return
+        except queue.Full:
+            continue
@@ -0,0 +1,146 @@
+import asyncio
+import socket
+import threading
+import weakref
+from timing import now_ns, elapsed_ms, tcp_handshake_rtt_ms
+
+default_timeout = 3             # seconds per connection attempt
+default_per_host_limit = 64     # connects in flight to one host
+default_global_limit = 512      # connects in flight overall, kept well below the default open file limit
+
+_limiters = weakref.WeakKeyDictionary()     # event loop -> ConnectLimiter
+_thread_loops = threading.local()
+
+
+class ConnectLimiter:
+    """
+    Concurrency limits for connects started from one event loop.
+
+    Limits are shared by every probe on the loop, so many TCP checks scheduled at once still
+    never have more than global_limit connects (and sockets) in flight.
+    """
+
+    def __init__(self, per_host_limit: int = default_per_host_limit, global_limit: int = default_global_limit):
+        self.per_host_limit = per_host_limit
+        self._global = asyncio.Semaphore(global_limit)
+        self._hosts = {}        # host -> [semaphore, users]
+
+    async def acquire(self, host: str) -> None:
+        entry = self._hosts.setdefault(host, [asyncio.Semaphore(self.per_host_limit), 0])
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._drop(host, entry)
+            raise
+        try:
+            await self._global.acquire()
+        except BaseException:
+            entry[0].release()
+            self._drop(host, entry)
+            raise
+
+    def release(self, host: str) -> None:
+        entry = self._hosts[host]
+        self._global.release()
+        entry[0].release()
+        self._drop(host, entry)
+
+    def _drop(self, host: str, entry: list) -> None:
+        """Forget host's semaphore once nothing uses it"""
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._hosts[host]
+
+
+def get_limiter() -> ConnectLimiter:
+    """Return the connect limiter of the running event loop"""
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = ConnectLimiter()
+    return limiter
+
+
+async def _probe(host: str, port: int, timeout: float, limiter: ConnectLimiter) -> tuple:
+    """Connect to one port once a slot is free, returning (host, port, is open, description, handshake ms)"""
+    loop = asyncio.get_running_loop()
+    await limiter.acquire(host)
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setblocking(False)
+            # The connect is registered with the loop's selector (epoll on Linux) until it completes
+            start = now_ns()
+            await asyncio.wait_for(loop.sock_connect(s, (host, port)), timeout)
+            end = now_ns()
+            rtt = tcp_handshake_rtt_ms(s) or elapsed_ms(start, end)
+            return host, port, True, f"Port {port} on {host} is open.", rtt
+
+    except asyncio.TimeoutError:
+        return host, port, False, f"Port {port} on {host} timed out.", None
+
+    except socket.error:
+        return host, port, False, f"Port {port} on {host} is closed or not reachable.", None
+
+    except Exception as e:
+        return host, port, False, f"Failed to check port {port} on {host} due to an error: {e}", None
+
+    finally:
+        limiter.release(host)
+
+
+async def probe_tcp_ports(targets: list, timeout: float = default_timeout, on_result=None) -> list:
+    """
+    Check many TCP ports at once with non-blocking connects.
+
+    Every connect is started on the running event loop, subject to the loop's per host and
+    global concurrency limits, and results are collected as the handshakes complete.
+
+    :param targets:     (host IP address, port) pairs to check
+    :param timeout:     seconds allowed for each connect, not counting time waiting for a slot
+    :param on_result:   optional callable(result) invoked as each port's result arrives
+    :returns:           (host, port, is open, description, handshake ms or None) per target, in target order
+    """
+    limiter = get_limiter()
+    tasks = [asyncio.ensure_future(_probe(host, port, timeout, limiter)) for host, port in targets]
+    try:
+        if on_result is not None:
+            for completed in asyncio.as_completed(tasks):
+                on_result(await completed)
+        return list(await asyncio.gather(*tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def probe_tcp_ports_sync(targets: list, timeout: float = default_timeout, on_result=None) -> list:
+    """
+    Blocking version of probe_tcp_ports() for callers without an event loop.
+
+    :returns:   same as probe_tcp_ports()
+    """
+    return run_blocking(probe_tcp_ports(targets, timeout, on_result))
+
+
+def run_blocking(coroutine):
+    """
+    Run coroutine to completion on the calling thread's own event loop.
+
+    The loop is kept for the thread's next call, as creating one per call (asyncio.run)
+    costs more than a loopback probe itself.
+    """
+    loop = getattr(_thread_loops, "loop", None)
+    if loop is None:
+        loop = _thread_loops.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
+
+
+def format_ports(ports: list) -> str:
+    """Format sorted port numbers compactly, e.g. [22, 80, 81, 82] -> '22, 80-82'"""
+    ranges = []
+    for port in ports:
+        if ranges and port == ranges[-1][1] + 1:
+            ranges[-1][1] = port
+        else:
+            ranges.append([port, port])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
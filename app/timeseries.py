@@ -0,0 +1,145 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from check_result import CheckResult, Status
+
+try:
+    import numpy as np
+except ImportError:     # statistics fall back to pure Python
+    np = None
+
+default_capacity = 240      # samples kept per check, e.g. 20 minutes at a 5 second interval
+no_latency = -1             # stored in place of a missing latency
+percentiles = (50, 95, 99)
+
+
+class RingBuffer:
+    """
+    Fixed-size sample history for one check.
+
+    Timestamps, latencies and statuses live in preallocated arrays, so memory use is
+    capacity * 17 bytes per check no matter how long the manager runs.
+    """
+    __slots__ = ("capacity", "_timestamps", "_latency_ns", "_status", "_next", "_count")
+
+    def __init__(self, capacity: int = default_capacity):
+        self.capacity = capacity
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._latency_ns = array('q', bytes(8 * capacity))
+        self._status = array('b', bytes(capacity))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, status: int, latency_ns: int | None) -> None:
+        """Store a sample, overwriting the oldest once full"""
+        i = self._next
+        self._timestamps[i] = timestamp
+        self._latency_ns[i] = no_latency if latency_ns is None else latency_ns
+        self._status[i] = status
+        self._next = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def _chronological(self, column: array):
+        """Return column's stored samples oldest first"""
+        start = (self._next - self._count) % self.capacity
+        if np is not None:
+            view = np.frombuffer(column, dtype=column.typecode)
+            if start + self._count <= self.capacity:
+                return view[start:start + self._count]
+            return np.concatenate((view[start:], view[:self._next]))
+        if start + self._count <= self.capacity:
+            return column[start:start + self._count]
+        return column[start:] + column[:self._next]
+
+    def stats(self, samples: int | None = None, seconds: float | None = None) -> dict | None:
+        """
+        Summarise the most recent samples.
+
+        :param samples: limit window to this many most recent samples
+        :param seconds: limit window to samples from the last this many seconds
+        :returns:       dictionary with samples, availability and latency min/avg/max/p50/p95/p99 in ms,
+                        or None if the window is empty
+        """
+        timestamps = self._chronological(self._timestamps)
+        first = 0
+        if samples is not None:
+            first = max(first, self._count - samples)
+        if seconds is not None:
+            cutoff = time.time() - seconds
+            position = np.searchsorted(timestamps, cutoff) if np is not None else bisect_left(timestamps, cutoff)
+            first = max(first, int(position))
+        count = self._count - first
+        if count <= 0:
+            return None
+
+        status = self._chronological(self._status)[first:]
+        latency = self._chronological(self._latency_ns)[first:]
+        if np is not None:
+            available = int(np.count_nonzero(status == Status.UP))
+            latency = latency[latency != no_latency]
+        else:
+            available = sum(1 for s in status if s == Status.UP)
+            latency = sorted(x for x in latency if x != no_latency)
+
+        summary = {"samples": count, "availability": available / count}
+        if len(latency) == 0:
+            return summary
+
+        if np is not None:
+            summary.update(min=latency.min(), avg=latency.mean(), max=latency.max())
+            for p, value in zip(percentiles, np.percentile(latency, percentiles)):
+                summary[f"p{p}"] = value
+        else:
+            summary.update(min=latency[0], avg=sum(latency) / len(latency), max=latency[-1])
+            for p in percentiles:
+                summary[f"p{p}"] = latency[min(len(latency) - 1, round(p / 100 * (len(latency) - 1)))]
+
+        # Report latencies in milliseconds
+        for key in ("min", "avg", "max") + tuple(f"p{p}" for p in percentiles):
+            summary[key] = float(summary[key]) / 1_000_000
+        return summary
+
+
+class TimeSeriesStore:
+    """In-memory ring buffer per (monitor, check id)"""
+
+    def __init__(self, capacity: int = default_capacity):
+        self.capacity = capacity
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def record(self, monitor: str, result: CheckResult) -> None:
+        """Add result to its check's ring buffer"""
+        key = (monitor, result.check_id)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = RingBuffer(self.capacity)
+            series.append(result.timestamp, result.status, result.latency_ns)
+
+    def keys(self) -> list:
+        """Return (monitor, check id) of every stored series"""
+        with self._lock:
+            return list(self._series)
+
+    def stats(self, key: tuple, samples: int | None = None, seconds: float | None = None) -> dict | None:
+        """
+        Summarise one series, see RingBuffer.stats()
+
+        :param key:     (monitor, check id)
+        :returns:       summary, or None if no samples in the window
+        """
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return None
+            return series.stats(samples, seconds)
+
+    def memory_bytes(self) -> int:
+        """Return bytes used by sample arrays"""
+        with self._lock:
+            return len(self._series) * self.capacity * 17
@@ -0,0 +1,142 @@
+import asyncio
+import socket
+import struct
+import sys
+import time
+
+# Monotonic high resolution clock used for every RTT measurement
+now_ns = time.perf_counter_ns
+
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)     # Linux value
+TCP_INFO = getattr(socket, "TCP_INFO", 11)                  # Linux value
+timespec_format = '@ll'
+timespec_size = struct.calcsize(timespec_format)
+tcp_info_rtt_offset = 68    # offset of tcpi_rtt (microseconds) in struct tcp_info
+tcp_info_size = 104
+
+
+def enable_rx_timestamps(sock: socket.socket) -> bool:
+    """
+    Ask the kernel to timestamp packets received on sock (Linux SO_TIMESTAMPNS).
+
+    :param sock:    socket to configure
+    :returns:       True if kernel timestamps are enabled
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        return True
+    except OSError:
+        return False
+
+
+def recv_timestamped(sock: socket.socket, bufsize: int) -> tuple:
+    """
+    Receive from sock and return when the packet actually arrived.
+
+    When the kernel attached a receive timestamp, the time the packet waited in the socket
+    buffer (while the interpreter was busy) is subtracted from the monotonic clock, so the
+    result excludes scheduling delay without depending on the wall clock for the whole RTT.
+
+    :param sock:    socket to receive from
+    :param bufsize: maximum bytes to receive
+    :returns:       (data, address, arrival time on the now_ns() clock)
+    """
+    data, ancdata, _, addr = sock.recvmsg(bufsize, socket.CMSG_SPACE(timespec_size))
+    return data, addr, kernel_arrival_ns(ancdata)
+
+
+def kernel_arrival_ns(ancdata: list, arrival: int | None = None) -> int:
+    """
+    Correct a receive time using the kernel timestamp in a recvmsg() result, if present.
+
+    :param ancdata:     ancillary data returned by recvmsg()
+    :param arrival:     now_ns() reading taken right after recvmsg(), default now
+    :returns:           time the packet arrived on the now_ns() clock
+    """
+    arrival = now_ns() if arrival is None else arrival
+    wall = time.time_ns()
+
+    stamp = kernel_timestamp_ns(ancdata)
+    if stamp is not None and wall > stamp:
+        arrival -= wall - stamp
+    return arrival
+
+
+def kernel_timestamp_ns(ancdata: list) -> int | None:
+    """
+    Return the kernel receive timestamp in a recvmsg() result.
+
+    :param ancdata:     ancillary data returned by recvmsg()
+    :returns:           wall clock arrival time in ns since the epoch, or None if not timestamped
+    """
+    for level, cmsg_type, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPNS and len(cmsg_data) >= timespec_size:
+            seconds, nanoseconds = struct.unpack_from(timespec_format, cmsg_data)
+            return seconds * 1_000_000_000 + nanoseconds
+    return None
+
+
+async def recv_timestamped_async(sock: socket.socket, bufsize: int) -> tuple:
+    """
+    Coroutine version of recv_timestamped() for non-blocking sockets on an asyncio event loop.
+
+    :param sock:    non-blocking socket to receive from
+    :param bufsize: maximum bytes to receive
+    :returns:       (data, address, arrival time on the now_ns() clock)
+    """
+    while True:
+        try:
+            return recv_timestamped(sock, bufsize)
+        except (BlockingIOError, InterruptedError):
+            pass
+        await wait_readable(sock)
+
+
+async def wait_readable(sock: socket.socket) -> None:
+    """Wait on the running event loop until sock is readable or has a pending error"""
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    loop.add_reader(sock.fileno(), _set_done, readable)
+    try:
+        await readable
+    finally:
+        loop.remove_reader(sock.fileno())
+
+
+def _set_done(future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def tcp_handshake_rtt_ms(sock: socket.socket) -> float | None:
+    """
+    Return the kernel's RTT estimate for a freshly connected TCP socket.
+
+    Right after connect() this is the SYN/SYN-ACK round trip measured by the kernel itself.
+
+    :param sock:    connected TCP socket
+    :returns:       RTT in milliseconds, or None if TCP_INFO is unavailable
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO, tcp_info_size)
+        rtt_us = struct.unpack_from('I', info, tcp_info_rtt_offset)[0]
+    except (OSError, struct.error):
+        return None
+    return rtt_us / 1000 if rtt_us else None
+
+
+def elapsed_ms(start_ns: int, end_ns: int | None = None) -> float:
+    """
+    Milliseconds between two now_ns() readings.
+
+    :param start_ns:    start time
+    :param end_ns:      end time, default now
+    :returns:           elapsed time in milliseconds
+    """
+    if end_ns is None:
+        end_ns = now_ns()
+    return (end_ns - start_ns) / 1_000_000
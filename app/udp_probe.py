@@ -0,0 +1,252 @@
+import asyncio
+import errno
+import os
+import socket
+import struct
+import sys
+from tcp_probe import run_blocking
+from timing import now_ns, elapsed_ms, enable_rx_timestamps, kernel_arrival_ns, recv_timestamped, wait_readable
+
+default_timeout = 3             # seconds to wait for an answer
+recv_size = 2048                # bytes read per datagram
+IP_RECVERR = getattr(socket, "IP_RECVERR", 11)          # Linux value
+MSG_ERRQUEUE = getattr(socket, "MSG_ERRQUEUE", 0x2000)  # Linux value
+sock_extended_err = struct.Struct('=IBBBBII')           # errno, origin, ICMP type, ICMP code, pad, info, data
+errqueue_ancillary_size = 512
+drain_every = 16                # probes sent between reads of replies and errors
+send_attempts = 3               # sends tried while earlier probes' ICMP errors are reported
+icmp_errors = (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN, errno.EACCES)
+
+# Probe states
+OPEN = "open"                   # the port answered
+CLOSED = "closed"               # ICMP port unreachable
+UNREACHABLE = "unreachable"     # other ICMP error, e.g. host unreachable or administratively prohibited
+NO_RESPONSE = "no response"     # open or filtered
+FAILED = "failed"               # probe could not be sent
+
+# Payloads drawing a reply from common services, so an open port is confirmed rather than guessed
+dns_probe = struct.pack('!HHHHHH', 0x4e4d, 0x0100, 1, 0, 0, 0) + b'\x00' + struct.pack('!HH', 2, 1)  # . NS IN
+ntp_probe = b'\x1b' + bytes(47)     # NTPv3 client request
+udp_payloads = {
+    53: dns_probe,
+    123: ntp_probe,
+}
+
+
+def payload_for(port: int, payload: bytes | None = None) -> bytes:
+    """Return payload to send to port, the well-known probe for its service by default"""
+    if payload is not None:
+        return payload
+    return udp_payloads.get(port, b'')
+
+
+def describe(host: str, port: int, state: str, error: int = 0) -> str:
+    """Return description of a probe result"""
+    if state == OPEN:
+        return f"Port {port} on {host} is open."
+    if state == CLOSED:
+        return f"Port {port} on {host} is closed."
+    if state == UNREACHABLE:
+        return f"Port {port} on {host} is not reachable ({os.strerror(error)})."
+    if state == NO_RESPONSE:
+        return f"Port {port} on {host} may be open, but no response received."
+    return f"Failed to check UDP port {port} on {host} due to an error: {os.strerror(error)}"
+
+
+async def _resolve(loop, hosts) -> dict:
+    """
+    Resolve hosts to IPv4 addresses without blocking the event loop
+
+    :returns:   host -> IPv4 address, or the socket.gaierror it could not be resolved with
+    """
+    async def resolve(host):
+        try:
+            socket.inet_aton(host)
+            return host
+        except OSError:
+            pass
+        try:
+            return (await loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_DGRAM))[0][4][0]
+        except socket.gaierror as e:
+            return e
+
+    hosts = list(hosts)
+    return dict(zip(hosts, await asyncio.gather(*(resolve(host) for host in hosts))))
+
+
+def _error_state(error: int) -> str:
+    return CLOSED if error == errno.ECONNREFUSED else UNREACHABLE
+
+
+def _enable_recverr(sock: socket.socket) -> bool:
+    """Queue ICMP errors on sock's error queue (Linux IP_RECVERR)"""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        sock.setsockopt(socket.SOL_IP, IP_RECVERR, 1)
+        return True
+    except OSError:
+        return False
+
+
+async def probe_udp_ports(targets: list, timeout: float = default_timeout, payload: bytes | None = None) -> list:
+    """
+    Check many UDP ports at once.
+
+    On Linux every probe is sent from one unconnected socket with IP_RECVERR enabled. ICMP errors
+    are read from the socket's error queue, whose message address is the original destination,
+    so each error is matched to its probe as soon as it arrives. Replies are matched by source
+    address. Elsewhere each port is probed from its own connected socket, which reports ICMP port
+    unreachable as ECONNREFUSED.
+
+    Host names are resolved to IPv4 addresses first; targets resolving to the same address and
+    port share one probe.
+
+    :param targets:     (host name or IP address, port) pairs to check
+    :param timeout:     seconds to wait for answers
+    :param payload:     datagram to send, by default the well-known probe for each port (see udp_payloads)
+    :returns:           (host, port, state, description, response ms or None) per target, in target order
+    """
+    loop = asyncio.get_running_loop()
+    resolved = await _resolve(loop, {host for host, _ in targets})
+    addresses = list(dict.fromkeys((resolved[host], port) for host, port in targets
+                                   if not isinstance(resolved[host], Exception)))
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        if _enable_recverr(sock):
+            enable_rx_timestamps(sock)
+            results = await _probe_batch(sock, addresses, timeout, payload)
+        else:
+            states = await asyncio.gather(*(_probe_connected(ip, port, timeout, payload) for ip, port in addresses))
+            results = dict(zip(addresses, states))
+
+    report = []
+    for host, port in targets:
+        address = resolved[host]
+        if isinstance(address, Exception):
+            report.append((host, port, FAILED, f"Failed to check UDP port {port} on {host}: {address.strerror}", None))
+            continue
+        state, rtt, error = results.get((address, port), (NO_RESPONSE, None, 0))
+        report.append((host, port, state, describe(host, port, state, error), rtt))
+    return report
+
+
+async def _probe_batch(sock: socket.socket, addresses: list, timeout: float, payload: bytes | None) -> dict:
+    """
+    Probe every (IPv4 address, port) from one socket
+
+    :returns:   (IPv4 address, port) -> (state, rtt ms, errno) of every address that answered or failed
+    """
+    loop = asyncio.get_running_loop()
+    results = {}        # (ip, port) -> (state, rtt ms, errno)
+    sent = {}           # (ip, port) -> send time
+
+    for i, key in enumerate(addresses):
+        port = key[1]
+        try:
+            sent[key] = now_ns()
+            await _send(loop, sock, payload_for(port, payload), key)
+        except OSError as e:
+            del sent[key]
+            results[key] = (FAILED, None, e.errno or 0)
+        # Replies and errors share the socket's receive buffer, so read them while sending
+        # rather than letting a large sweep overflow it
+        if i % drain_every == drain_every - 1:
+            _drain(sock, sent, results, payload)
+
+    deadline = loop.time() + timeout
+    while len(results) < len(addresses):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            await asyncio.wait_for(wait_readable(sock), remaining)
+        except asyncio.TimeoutError:
+            break
+        _drain(sock, sent, results, payload)
+    return results
+
+
+async def _send(loop, sock: socket.socket, data: bytes, address: tuple) -> None:
+    """Send datagram, retrying if the send only reported an earlier probe's ICMP error"""
+    for attempt in range(send_attempts):
+        try:
+            await loop.sock_sendto(sock, data, address)
+            return
+        except OSError as e:
+            # With IP_RECVERR an earlier probe's error is also left pending on the socket, and the next
+            # send fails with it. That error is still read from the error queue, so send again.
+            if e.errno not in icmp_errors or attempt == send_attempts - 1:
+                raise
+
+
+def _drain(sock: socket.socket, sent: dict, results: dict, payload: bytes | None) -> None:
+    """Match every queued reply and ICMP error to its probe"""
+    while True:
+        try:
+            data, address, arrival = recv_timestamped(sock, recv_size)
+        except (BlockingIOError, InterruptedError):
+            break
+        except OSError:
+            # Pending ICMP error reported by recv, read below from the error queue
+            continue
+        key = address[:2]
+        if key[1] == sock.getsockname()[1] and data == payload_for(key[1], payload):
+            # A sweep of a local range covering the probe socket's own port receives its own datagram
+            continue
+        if key in sent and key not in results:
+            results[key] = (OPEN, elapsed_ms(sent[key], arrival), 0)
+
+    while True:
+        try:
+            _, ancdata, _, address = sock.recvmsg(recv_size, errqueue_ancillary_size, MSG_ERRQUEUE)
+        except OSError:
+            break
+        arrival = kernel_arrival_ns(ancdata)
+        key = address[:2] if address else None
+        if key not in sent or key in results:
+            continue
+        for level, cmsg_type, cmsg_data in ancdata:
+            if level == socket.SOL_IP and cmsg_type == IP_RECVERR and len(cmsg_data) >= sock_extended_err.size:
+                error = sock_extended_err.unpack_from(cmsg_data)[0]
+                results[key] = (_error_state(error), elapsed_ms(sent[key], arrival), error)
+                break
+
+
+async def _probe_connected(ip: str, port: int, timeout: float, payload: bytes | None) -> tuple:
+    """
+    Probe one port from its own connected socket
+
+    :returns:   (state, rtt ms, errno)
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            enable_rx_timestamps(sock)
+            sock.connect((ip, port))
+            start = now_ns()
+            await loop.sock_sendall(sock, payload_for(port, payload))
+            try:
+                while True:
+                    try:
+                        _, _, arrival = recv_timestamped(sock, recv_size)
+                        return OPEN, elapsed_ms(start, arrival), 0
+                    except (BlockingIOError, InterruptedError):
+                        await asyncio.wait_for(wait_readable(sock), timeout - elapsed_ms(start) / 1000)
+            except asyncio.TimeoutError:
+                return NO_RESPONSE, None, 0
+            except OSError as e:
+                return _error_state(e.errno), elapsed_ms(start), e.errno
+    except OSError as e:
+        return FAILED, None, e.errno or 0
+
+
+def probe_udp_ports_sync(targets: list, timeout: float = default_timeout, payload: bytes | None = None) -> list:
+    """
+    Blocking version of probe_udp_ports() for callers without an event loop.
+
+    :returns:   same as probe_udp_ports()
+    """
+    return run_blocking(probe_udp_ports(targets, timeout, payload))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules in app/ import each other by their bare names, as when run from that directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
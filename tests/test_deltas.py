@@ -0,0 +1,117 @@
+import pytest
+from check_result import derive_check_id
+from check_spec import ConfigError
+from service_manager import diff_checks, index_checks
+from service_monitor import ServiceMonitor
+from shard_pool import shard_of, split_checks, split_delta
+
+old = {
+    "TCP": [{"id": "web", "ip_address": "10.0.0.1", "port": 80},
+            {"id": "ssh", "ip_address": "10.0.0.1", "port": 22}],
+    "UDP": [{"ip_address": "10.0.0.2", "port": 53}],
+}
+
+
+def copy(checks_dict):
+    return {check_type: [dict(check) for check in check_list] for check_type, check_list in checks_dict.items()}
+
+
+def test_index_derives_missing_ids():
+    index = index_checks(old)
+    udp_id = derive_check_id("UDP", old["UDP"][0])
+    assert set(index) == {"web", "ssh", udp_id}
+    assert index[udp_id] == ("UDP", old["UDP"][0])
+
+
+def test_diff_of_equal_configurations_is_none():
+    assert diff_checks(old, copy(old)) is None
+    assert diff_checks({}, None) is None
+
+
+def test_diff_adds_modifies_and_removes_by_id():
+    new = copy(old)
+    new["TCP"][0]["port"] = 8080
+    del new["TCP"][1]
+    new["Echo"] = [{"id": "echo", "ip_address": "10.0.0.3", "port": 7}]
+    delta = diff_checks(old, new)
+    assert delta == {
+        "add": {"Echo": [{"id": "echo", "ip_address": "10.0.0.3", "port": 7}]},
+        "modify": {"TCP": [{"id": "web", "ip_address": "10.0.0.1", "port": 8080}]},
+        "remove": ["ssh"],
+    }
+
+
+def test_changing_a_check_without_id_removes_and_adds_it():
+    new = copy(old)
+    new["UDP"][0]["port"] = 5353
+    delta = diff_checks(old, new)
+    assert delta["remove"] == [derive_check_id("UDP", old["UDP"][0])]
+    assert delta["add"] == {"UDP": [dict(new["UDP"][0], id=derive_check_id("UDP", new["UDP"][0]))]}
+    assert delta["modify"] == {}
+
+
+def test_check_moved_to_another_type_is_modified():
+    new = copy(old)
+    new["UDP"].append(new["TCP"].pop(1))
+    assert diff_checks(old, new)["modify"] == {"UDP": [{"id": "ssh", "ip_address": "10.0.0.1", "port": 22}]}
+
+
+def test_apply_delta_brings_monitor_to_new_configuration():
+    new = copy(old)
+    new["TCP"][0]["port"] = 8080
+    del new["TCP"][1]
+    new["Echo"] = [{"id": "echo", "ip_address": "10.0.0.3", "port": 7}]
+    monitor = ServiceMonitor()
+    monitor.set_checks_from_dict(copy(old))
+    kept = next(check for check in monitor.get_checks() if check.id == derive_check_id("UDP", old["UDP"][0]))
+
+    added, removed = monitor.apply_delta(diff_checks(old, new))
+    assert sorted(check.id for check in added) == ["echo", "web"]
+    assert removed == ["ssh"]
+    assert sorted(check.id for check in monitor.get_checks()) == sorted(index_checks(new))
+    assert kept in monitor.get_checks()
+    assert diff_checks(monitor.get_config(), new) is None
+
+
+def test_invalid_delta_changes_nothing():
+    monitor = ServiceMonitor()
+    monitor.set_checks_from_dict(copy(old))
+    checks = list(monitor.get_checks())
+    with pytest.raises(ConfigError):
+        monitor.apply_delta({"add": {"TCP": [{"id": "bad", "ip_address": "10.0.0.4", "port": 0}]},
+                             "modify": {}, "remove": ["web"]})
+    assert monitor.get_checks() == checks
+
+
+@pytest.mark.parametrize("shards", [1, 2, 3, 7])
+def test_split_checks_keeps_every_check_once(shards):
+    parts = split_checks(old, shards)
+    assert len(parts) == shards
+    for shard, part in enumerate(parts):
+        assert all(shard_of(check_id, shards) == shard for check_id in index_checks(part))
+    assert sorted(check_id for part in parts for check_id in index_checks(part)) == sorted(index_checks(old))
+
+
+@pytest.mark.parametrize("shards", [1, 2, 3, 7])
+def test_split_delta_sends_each_change_to_its_shard(shards):
+    new = copy(old)
+    new["TCP"][0]["port"] = 8080
+    del new["TCP"][1]
+    new["Echo"] = [{"id": f"echo-{i}", "ip_address": "10.0.0.3", "port": 7} for i in range(10)]
+    delta = diff_checks(old, new)
+    parts = split_delta(delta, shards)
+    assert len(parts) == shards
+
+    changes = []
+    for shard, part in enumerate(parts):
+        if part is None:
+            continue
+        assert part["add"] or part["modify"] or part["remove"]
+        for change in ("add", "modify"):
+            for check_id in index_checks(part[change]):
+                assert shard_of(check_id, shards) == shard
+                changes.append((change, check_id))
+        for check_id in part["remove"]:
+            assert shard_of(check_id, shards) == shard
+            changes.append(("remove", check_id))
+    assert sorted(changes) == sorted([("add", f"echo-{i}") for i in range(10)] + [("modify", "web"), ("remove", "ssh")])
@@ -0,0 +1,34 @@
+import struct
+import pytest
+from icmp_engine import IcmpPacketFactory, calculate_icmp_checksum, update_icmp_checksum
+
+
+def test_checksum_matches_rfc_1071_example():
+    assert calculate_icmp_checksum(bytes.fromhex("0001f203f4f5f6f7")) == 0x220d
+
+
+def test_checksum_pads_odd_length():
+    assert calculate_icmp_checksum(b"\x12\x34\x56") == calculate_icmp_checksum(b"\x12\x34\x56\x00")
+
+
+def test_packet_with_its_checksum_sums_to_zero():
+    header = struct.pack("!BBHHH", 8, 0, 0, 0x1234, 7)
+    payload = b"abcdefg"
+    checksum = calculate_icmp_checksum(header + payload)
+    packet = struct.pack("!BBHHH", 8, 0, checksum, 0x1234, 7) + payload
+    assert calculate_icmp_checksum(packet) == 0
+
+
+@pytest.mark.parametrize("old_word, new_word", [(0, 1), (0, 0xffff), (0x1234, 0xfedc), (0xffff, 0)])
+def test_update_matches_full_calculation(old_word, new_word):
+    payload = b"payload!"
+    old = struct.pack("!BBHHH", 8, 0, 0, 0xbeef, old_word) + payload
+    new = struct.pack("!BBHHH", 8, 0, 0, 0xbeef, new_word) + payload
+    assert update_icmp_checksum(calculate_icmp_checksum(old), old_word, new_word) == calculate_icmp_checksum(new)
+
+
+@pytest.mark.parametrize("sequence", [0, 1, 255, 256, 65535, 65536])
+def test_factory_packets_have_valid_checksums(sequence):
+    packet = IcmpPacketFactory().build(0x4242, sequence, data_size=31)
+    assert calculate_icmp_checksum(packet) == 0
+    assert struct.unpack_from("!H", packet, 6)[0] == sequence & 0xffff
@@ -0,0 +1,76 @@
+import struct
+import pytest
+from protocol import (BATCH, CONFIG, RESULT, STATUS, FrameDecoder, FrameEncoder, ProtocolError, header_format,
+                      max_payload_size, pack_binary, unpack_binary)
+
+body = {"HTTP": [{"id": "web", "url": "http://example.com", "interval": 5, "timeout": 2.5}],
+        "none": None, "flags": [True, False], "negative": -300, "large": 2 ** 40, "text": "café"}
+
+
+@pytest.mark.parametrize("value", [None, True, False, 0, -1, 63, -64, 2 ** 63, 1.5, "", "text", [], {}, body])
+def test_binary_round_trip(value):
+    assert unpack_binary(pack_binary(value)) == value
+
+
+def test_binary_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        pack_binary({1, 2})
+
+
+@pytest.mark.parametrize("data", [b"Z", b"s\x05ab", b"NN"])
+def test_binary_rejects_malformed_payloads(data):
+    with pytest.raises(ProtocolError):
+        unpack_binary(data)
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("compress", [False, True])
+def test_frame_round_trip(binary, compress):
+    encoder, decoder = FrameEncoder(binary=binary), FrameDecoder()
+    messages = decoder.feed(encoder.encode(CONFIG, body, compress) + encoder.encode(STATUS, "ok", compress))
+    assert [(message.type, message.sequence, message.body) for message in messages] == [
+        (CONFIG, 1, body), (STATUS, 2, "ok")]
+    assert decoder.binary is binary
+    assert decoder.compressed is compress
+
+
+def test_frames_split_at_every_byte():
+    encoder, decoder = FrameEncoder(binary=True), FrameDecoder()
+    data = encoder.encode(RESULT, [1, "a"]) + encoder.encode(RESULT, [2, "b"])
+    messages = []
+    for i in range(len(data)):
+        messages += decoder.feed(data[i:i + 1])
+    assert [message.body for message in messages] == [[1, "a"], [2, "b"]]
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_batch_decodes_to_list_of_bodies(binary):
+    encoder = FrameEncoder(binary=binary)
+    items = [["web", "HTTP", i, None] for i in range(3)]
+    (message,) = FrameDecoder().feed(encoder.encode_batch([encoder.pack(item) for item in items], compress=True))
+    assert message.type == BATCH
+    assert message.body == items
+
+
+def test_empty_batch():
+    encoder = FrameEncoder(binary=True)
+    assert FrameDecoder().feed(encoder.encode_batch([])) == [(BATCH, 1, [])]
+
+
+def test_rejects_bad_magic():
+    frame = bytearray(FrameEncoder().encode(STATUS, "ok"))
+    frame[0:2] = b"XX"
+    with pytest.raises(ProtocolError):
+        FrameDecoder().feed(bytes(frame))
+
+
+def test_rejects_oversized_frame_before_reading_it():
+    header = struct.pack(header_format, b"NM", 1, STATUS, 0, 1, max_payload_size + 1)
+    with pytest.raises(ProtocolError):
+        FrameDecoder().feed(header)
+
+
+def test_rejects_malformed_compressed_payload():
+    header = struct.pack(header_format, b"NM", 1, STATUS, 0x02, 1, 4)
+    with pytest.raises(ProtocolError):
+        FrameDecoder().feed(header + b"junk")